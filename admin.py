@@ -1,12 +1,20 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, send_file
 from flask_login import login_required, current_user
 from core.models import db, User, Role, Congregacion, Privilegio
+from core.importacion import (COLUMNAS_PLANILLA, iniciar_importacion_planilla, leer_estado_importacion,
+                              ruta_informe_errores)
 from datetime import datetime
-# Al principio del archivo, añade la importación de pandas
-import pandas as pd
+import os
+import re
 
 admin_bp = Blueprint('admin', __name__)
 
+EXTENSIONES_PLANILLA = ('.csv', '.xlsx', '.xlsm')
+ID_IMPORTACION = re.compile(r'[0-9a-f]{32}')
+
+def _dir_importaciones():
+    return os.path.join(current_app.instance_path, 'importaciones')
+
 @admin_bp.route('/admin/users')
 @login_required
 def user_management():
@@ -20,7 +28,8 @@ def user_management():
     
     return render_template('user_management.html', 
                            users=users, roles=roles, 
-                           congregaciones=congregaciones, privilegios=privilegios)
+                           congregaciones=congregaciones, privilegios=privilegios,
+                           columnas_planilla=COLUMNAS_PLANILLA)
 
 @admin_bp.route('/admin/users/add', methods=['POST'])
 @login_required
@@ -63,26 +72,44 @@ def delete_user(user_id):
 @admin_bp.route('/admin/upload', methods=['POST'])
 @login_required
 def upload_db():
+    """
+    Recibe una planilla (.csv o .xlsx) de publicadores y la importa en segundo
+    plano; el progreso y el informe de errores se consultan en /admin/upload/<id>.
+    """
     if not current_user.role or current_user.role.name != 'admin':
         return jsonify({"error": "No autorizado"}), 403
 
     file = request.files.get('db_file')
-    if not file:
+    if not file or not file.filename:
         return jsonify({"error": "No se recibió ningún archivo."}), 400
+    if os.path.splitext(file.filename)[1].lower() not in EXTENSIONES_PLANILLA:
+        flash("Formato no admitido: sube un archivo .csv o .xlsx.", "danger")
+        return redirect(url_for('admin.user_management'))
 
-    try:
-        # Usamos pandas para leer el archivo (funciona con Excel y CSV)
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
+    # Encabezados elegidos a mano en el formulario; los vacíos se reconocen solos
+    mapeo = {campo: request.form.get(f'col_{campo}', '').strip() for campo in COLUMNAS_PLANILLA}
+    importacion_id = iniciar_importacion_planilla(current_app._get_current_object(), file, _dir_importaciones(), mapeo)
+    flash(f"Importando '{file.filename}'...", "info")
+    return redirect(url_for('admin.estado_importacion', importacion_id=importacion_id))
 
-        # --- Lógica para procesar y añadir/actualizar usuarios ---
-        # (Aquí iría la lógica para iterar sobre el dataframe 'df'
-        # y añadir cada fila a la base de datos, similar a migracion.py)
+@admin_bp.route('/admin/upload/<importacion_id>')
+@login_required
+def estado_importacion(importacion_id):
+    if not current_user.role or current_user.role.name != 'admin': return redirect(url_for('home'))
+    estado = leer_estado_importacion(_dir_importaciones(), importacion_id) if ID_IMPORTACION.fullmatch(importacion_id) else None
+    if estado is None:
+        flash("No existe esa importación.", "warning")
+        return redirect(url_for('admin.user_management'))
+    if request.args.get('formato') == 'json':
+        return jsonify(estado)
+    return render_template('importacion.html', estado=estado)
 
-        flash(f"¡Éxito! Se han procesado {len(df)} registros.", "success")
+@admin_bp.route('/admin/upload/<importacion_id>/errores.csv')
+@login_required
+def informe_importacion(importacion_id):
+    if not current_user.role or current_user.role.name != 'admin': return redirect(url_for('home'))
+    ruta = ruta_informe_errores(_dir_importaciones(), importacion_id)
+    if not ID_IMPORTACION.fullmatch(importacion_id) or not os.path.exists(ruta):
+        flash("No existe el informe de esa importación.", "warning")
         return redirect(url_for('admin.user_management'))
-    except Exception as e:
-        flash(f"Error al procesar el archivo: {e}", "danger")
-        return redirect(url_for('admin.user_management'))
\ No newline at end of file
+    return send_file(ruta, mimetype='text/csv', as_attachment=True, download_name=f"errores_importacion_{importacion_id[:8]}.csv")
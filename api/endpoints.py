@@ -1,180 +1,205 @@
-from flask import Blueprint, request, jsonify, send_file
-from core.motor_busqueda import MotorBusquedaModerno
-from whatsapp_servicio import WhatsAppServicio
-import asyncio
-import threading
-import time
+from flask import Blueprint, Response, request, jsonify
+from core.motor_busqueda import motor, LIMITE_POR_DEFECTO
+from core.cola_envios import encolar_envio, preparar_difusion, resumen_trabajo
+from core.control_whatsapp import ATENDIDA, ATENDIENDO, CADUCADA, FALLIDA, esperar_respuesta, leer_estado, solicitar
+from core.perfil_whatsapp import cargar_manifiesto, escribir_zip, preparar_snapshot
+from whatsapp_servicio import PERFIL_DIR
+from flask_login import current_user
 import os
-import zipfile
 from werkzeug.utils import secure_filename
-import shutil
-import stat
 
 # Se crea el "plano" (blueprint) para todas las rutas de la API
 api = Blueprint('api', __name__)
 
-# Se crean las instancias del motor de búsqueda y del servicio de WhatsApp
-# Estas son las versiones que usará toda la aplicación.
-motor = MotorBusquedaModerno()
-ws_service = WhatsAppServicio()
-
-PERFIL_DIR = os.path.abspath("playwright_whatsapp_profile")
-PERFIL_ZIP = os.path.abspath("playwright_whatsapp_profile.zip")
+# El motor de búsqueda es la instancia compartida que create_app() inicializa. El
+# navegador de WhatsApp no se abre en este proceso: es del trabajador de envíos, al
+# que estas rutas le piden lo que haga falta (core/control_whatsapp.py).
 
 @api.route('/api/buscar', methods=['POST'])
 def buscar():
     """
     Esta es la ruta que el frontend llama para buscar contactos.
-    Cuando el término de búsqueda está vacío, carga toda la tabla.
+    Devuelve una página de `limit` resultados (máximo LIMITE_MAXIMO) ordenada por
+    nombre; para pedir la siguiente se envía el `next_cursor` recibido como `cursor`.
+    Cuando el término de búsqueda está vacío, pagina toda la tabla.
     """
     try:
-        termino = request.get_json().get('termino', '')
-        resultados = motor.buscar_contactos(termino)
-        return jsonify({"usuarios": resultados})
+        data = request.get_json() or {}
+        termino = data.get('termino', '')
+        limite = data.get('limit', LIMITE_POR_DEFECTO)
+        try:
+            resultados, siguiente = motor.buscar_pagina(termino, limite, data.get('cursor'))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Parámetros de paginación inválidos: {e}"}), 400
+        return jsonify({"usuarios": resultados, "next_cursor": siguiente})
     except Exception as e:
         print(f"❌ ERROR en /api/buscar: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
-# --- RUTAS PARA WHATSAPP (CORREGIDAS PARA PLAYWRIGHT/ASYNCIO) ---
+@api.route('/api/buscar/estado', methods=['GET'])
+def buscar_estado():
+    """
+    Indica si el índice de búsqueda de este worker ya está construido.
+    Mientras no lo esté, /api/buscar responde igual consultando la base de datos.
+    """
+    estado = motor.estado()
+    return jsonify(estado), 200 if estado["listo"] else 503
 
-@api.route('/api/whatsapp/conectar', methods=['POST'])
-def whatsapp_conectar():
-    """Maneja la conexión inicial con WhatsApp Web."""
+@api.route('/api/buscar/cache', methods=['GET'])
+def buscar_cache():
+    """Aciertos, fallos y ocupación de la caché de resultados (para dimensionarla)."""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        qr_base64 = loop.run_until_complete(ws_service.conectar_whatsapp())
-        loop.close()
-        if qr_base64:
-            return jsonify({"qr": qr_base64, "status": "qr"})
-        else:
-            return jsonify({"qr": None, "status": "logueado"})
+        return jsonify(motor.cache.estadisticas())
     except Exception as e:
-        print(f"❌ Error en /api/whatsapp/conectar: {e}")
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
+        return jsonify({"error": str(e)}), 500
+
+# --- RUTAS PARA WHATSAPP (el navegador lo maneja trabajador_envios.py) ---
+
+def _pedir_al_trabajador(accion, timeout, archivo=None):
+    """
+    Deja la solicitud al trabajador de envíos y espera su respuesta. Devuelve
+    (estado de la solicitud, resultado, respuesta de error de Flask o None); el
+    estado es None si el trabajador no está en marcha y no se llegó a pedir nada.
+    """
+    if not leer_estado()["trabajador_activo"]:
+        return None, None, (jsonify({"status": "error", "mensaje": "El trabajador de envíos no está en marcha."}), 503)
+    estado, resultado = esperar_respuesta(solicitar(accion, archivo), timeout)
+    if estado == ATENDIDA:
+        return estado, resultado, None
+    if estado == FALLIDA:
+        error = jsonify({"status": "error", "mensaje": resultado.get("mensaje")}), resultado.get("codigo", 500)
+    elif estado == CADUCADA:
+        error = jsonify({"status": "error", "mensaje": "El trabajador de envíos está ocupado; inténtalo de nuevo en un momento."}), 504
+    else:
+        error = jsonify({"status": "error", "mensaje": "El trabajador de envíos sigue atendiendo la solicitud."}), 504
+    return estado, resultado, error
+
+@api.route('/api/whatsapp/conectar', methods=['POST'])
+def whatsapp_conectar():
+    """
+    Maneja la conexión inicial con WhatsApp Web. La hace el trabajador de envíos,
+    que deja el navegador abierto mientras se escanea el QR.
+    """
+    _, resultado, error = _pedir_al_trabajador('conectar', timeout=120)
+    if error:
+        return error
+    return jsonify(resultado)
 
 @api.route('/api/whatsapp/estado', methods=['GET'])
 def whatsapp_estado():
-    """Verifica si la sesión de WhatsApp está activa."""
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        logueado = loop.run_until_complete(ws_service.esta_logueado())
-        loop.close()
-        return jsonify({"status": "logueado" if logueado else "desconectado"})
-    except Exception as e:
-        print(f"❌ Error en /api/whatsapp/estado: {e}")
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
+    """Estado de la sesión de WhatsApp que publica el trabajador de envíos, sin tocar el navegador."""
+    estado = leer_estado()
+    return jsonify({"status": "logueado" if estado["logueado"] else "desconectado", **estado})
 
 @api.route('/api/whatsapp/enviar', methods=['POST'])
 def whatsapp_enviar():
     """
-    Recibe la lista de usuarios y el mensaje, y los envía en segundo plano
-    para no bloquear la aplicación.
+    Pone en la cola persistente un envío masivo. Los destinatarios se indican con
+    `usuario_ids`, con una `busqueda` (mismo término que /api/buscar) o, como antes,
+    con la lista `usuarios` de la que sólo se toman los ids. El `mensaje` es una
+    plantilla que se personaliza por destinatario ({nombre}, {primer_nombre},
+    {congregacion}, {circuito}). Los envía el trabajador de envíos
+    (trabajador_envios.py); el progreso se consulta en /api/whatsapp/trabajos/<id>.
     """
-    data = request.get_json()
-    usuarios = data.get('usuarios', [])
+    data = request.get_json() or {}
     mensaje = data.get('mensaje', '')
+    if not mensaje.strip():
+        return jsonify({"status": "error", "mensaje": "El mensaje está vacío."}), 400
 
+    try:
+        if data.get('busqueda') is not None:
+            usuario_ids = [u['id'] for u in motor.buscar_contactos(str(data['busqueda']))]
+        elif data.get('usuario_ids') is not None:
+            usuario_ids = data['usuario_ids']
+        else:
+            usuario_ids = [u['id'] for u in data.get('usuarios', []) if u.get('id') is not None]
+        destinatarios, descartes = preparar_difusion(mensaje, usuario_ids)
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({"status": "error", "mensaje": f"Destinatarios inválidos: {e}"}), 400
+
+    trabajo = encolar_envio(destinatarios, mensaje, creado_por_id=current_user.id if current_user.is_authenticated else None)
+    if trabajo is None:
+        return jsonify({"status": "error", "mensaje": "Ninguno de los usuarios tiene un teléfono válido.", **descartes}), 400
 
-    import datetime
-    def tarea_de_envio_en_hilo():
-        from whatsapp_servicio import WhatsAppServicio
-        ws_service_local = WhatsAppServicio()
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        for usuario in usuarios:
-            inicio = datetime.datetime.now()
-            print(f"[METRICA] Intentando enviar a {usuario['telefono']} a las {inicio}")
-            try:
-                resultado = loop.run_until_complete(ws_service_local.enviar_mensaje(usuario['telefono'], mensaje))
-                fin = datetime.datetime.now()
-                print(f"[METRICA] Resultado: {resultado} para {usuario['telefono']} en {fin-inicio}")
-            except Exception as e:
-                print(f"[METRICA] ERROR enviando a {usuario['telefono']}: {e}")
-        loop.close()
-
-    # Inicia el hilo que hará el trabajo pesado.
-    thread = threading.Thread(target=tarea_de_envio_en_hilo)
-    thread.start()
-
-    # Devuelve una respuesta inmediata al usuario.
-    return jsonify({"status": "iniciado", "mensaje": f"Proceso de envío iniciado para {len(usuarios)} usuarios."})
+    omitidos = descartes["sin_telefono"] + descartes["duplicados"]
+    return jsonify({
+        "status": "en_cola",
+        "trabajo_id": trabajo.id,
+        "total": len(destinatarios),
+        **descartes,
+        "mensaje": f"Envío puesto en cola para {len(destinatarios)} usuarios"
+                   + (f" ({omitidos} omitidos por teléfono inválido o repetido)." if omitidos else ".")
+    }), 202
+
+@api.route('/api/whatsapp/trabajos/<int:trabajo_id>', methods=['GET'])
+def whatsapp_trabajo(trabajo_id):
+    """Progreso de un envío masivo: conteos por estado y resultado de cada destinatario."""
+    resumen = resumen_trabajo(trabajo_id)
+    if resumen is None:
+        return jsonify({"status": "error", "mensaje": "No existe ese envío."}), 404
+    return jsonify(resumen)
 
 @api.route('/api/whatsapp/cerrar', methods=['POST'])
 def whatsapp_cerrar():
-    """Cierra la sesión de Playwright."""
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(ws_service.cerrar())
-        loop.close()
-        return jsonify({"status": "cerrado", "mensaje": "Sesión de WhatsApp cerrada."})
-    except Exception as e:
-        return jsonify({"status": "error", "mensaje": str(e)}), 500
-
-def on_rm_error(func, path, exc_info):
-    # Cambia permisos y reintenta borrar
-    try:
-        os.chmod(path, stat.S_IWRITE)
-        func(path)
-    except Exception:
-        pass
+    """Pide al trabajador de envíos que cierre el navegador."""
+    _, _, error = _pedir_al_trabajador('cerrar', timeout=30)
+    if error:
+        return error
+    return jsonify({"status": "cerrado", "mensaje": "Sesión de WhatsApp cerrada."})
 
 @api.route('/api/whatsapp/subir_perfil', methods=['POST'])
 def subir_perfil():
+    """
+    Aplica un snapshot del perfil descargado de otro equipo: uno completo sustituye
+    el perfil y uno incremental sólo escribe los archivos que cambiaron. Lo aplica
+    el trabajador de envíos, tras cerrar su navegador, y borra el ZIP.
+    """
     if 'perfil' not in request.files:
         return jsonify({"status": "error", "mensaje": "No se envió ningún archivo."}), 400
     archivo = request.files['perfil']
-    filename = secure_filename(archivo.filename)
+    filename = secure_filename(archivo.filename) or "perfil.zip"
     ruta_zip = os.path.join(os.path.dirname(PERFIL_DIR), filename)
     archivo.save(ruta_zip)
-    try:
-        # Cierra Playwright antes de manipular el perfil
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(ws_service.cerrar())
-            loop.close()
-        except Exception as e:
-            print(f"Advertencia: No se pudo cerrar Playwright antes de reemplazar el perfil: {e}")
-        # Elimina el perfil anterior de forma robusta
-        if os.path.exists(PERFIL_DIR):
-            shutil.rmtree(PERFIL_DIR, onerror=on_rm_error)
-        # Extrae el nuevo perfil
-        with zipfile.ZipFile(ruta_zip, 'r') as zip_ref:
-            zip_ref.extractall(PERFIL_DIR)
-        os.remove(ruta_zip)
-        return jsonify({"status": "ok", "mensaje": "Perfil subido y extraído correctamente. Por favor, vuelve a conectar WhatsApp Web."})
-    except Exception as e:
-        return jsonify({"status": "error", "mensaje": f"Error al extraer el perfil: {e}"}), 500
+    estado, resultado, error = _pedir_al_trabajador('aplicar_perfil', timeout=120, archivo=ruta_zip)
+    if error:
+        # Si el trabajador no la está atendiendo, ya no será él quien borre el ZIP
+        if estado != ATENDIENDO and os.path.exists(ruta_zip):
+            os.remove(ruta_zip)
+        return error
+    return jsonify({
+        "status": "ok",
+        "snapshot": resultado["snapshot"],
+        "tipo": resultado["tipo"],
+        "mensaje": f"Perfil actualizado ({resultado['tipo']}). Por favor, vuelve a conectar WhatsApp Web."
+    })
 
 @api.route('/api/whatsapp/descargar_perfil', methods=['GET'])
 def descargar_perfil():
+    """
+    Descarga un snapshot del perfil como ZIP en streaming (sin las cachés de
+    Chromium). Con ?desde=<id de snapshot> (o ?desde=ultimo) sólo incluye los
+    cambios desde ese snapshot; el id del nuevo va en la cabecera X-Perfil-Snapshot.
+    """
     if not os.path.exists(PERFIL_DIR):
         return jsonify({"status": "error", "mensaje": "No existe perfil para descargar."}), 404
+    base = None
+    if request.args.get('desde'):
+        base = cargar_manifiesto(request.args['desde'])
+        if base is None:
+            return jsonify({"status": "error", "mensaje": "No existe ese snapshot base; descarga uno completo."}), 404
     try:
-        with zipfile.ZipFile(PERFIL_ZIP, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(PERFIL_DIR):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(abs_path, PERFIL_DIR)
-                    zipf.write(abs_path, rel_path)
-        response = send_file(PERFIL_ZIP, as_attachment=True, download_name="playwright_whatsapp_profile.zip")
-        # Limpia el ZIP temporal después de enviar
-        @response.call_on_close
-        def cleanup():
-            if os.path.exists(PERFIL_ZIP):
-                os.remove(PERFIL_ZIP)
-        return response
+        manifiesto, incluidos = preparar_snapshot(PERFIL_DIR, base)
     except Exception as e:
-        return jsonify({"status": "error", "mensaje": f"Error al comprimir el perfil: {e}"}), 500
-
-import os
+        return jsonify({"status": "error", "mensaje": f"Error al preparar el perfil: {e}"}), 500
+    nombre = f"{os.path.basename(PERFIL_DIR)}_{manifiesto['id']}.zip"
+    return Response(escribir_zip(manifiesto, incluidos), mimetype='application/zip', direct_passthrough=True, headers={
+        "Content-Disposition": f"attachment; filename={nombre}",
+        "X-Perfil-Snapshot": manifiesto["id"],
+    })
 
 @api.route('/api/whatsapp/verificar_perfil', methods=['GET'])
 def verificar_perfil():
-    perfil_dir = os.path.abspath("playwright_whatsapp_profile")
+    perfil_dir = PERFIL_DIR
     if not os.path.exists(perfil_dir):
         return jsonify({"status": "error", "mensaje": "No existe la carpeta de perfil."}), 404
     archivos = []
@@ -3,6 +3,7 @@ from flask import Flask, render_template
 from flask_login import LoginManager, login_required
 from flask_migrate import Migrate
 from core.models import db, User
+from core.motor_busqueda import motor
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -26,16 +27,25 @@ def create_app():
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    # Un único motor de búsqueda por worker; sus índices se construyen en segundo plano
+    # desde el arranque (no en los comandos de la CLI)
+    motor.init_app(app)
 
     from auth import auth as auth_blueprint
     from api.endpoints import api as api_blueprint
     from registros import registros_bp
     from admin import admin_bp
+    from visitas import visitas_bp
 
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(api_blueprint)
     app.register_blueprint(registros_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(visitas_bp)
+
+    from commands import seed, importar_accdb
+    app.cli.add_command(seed)
+    app.cli.add_command(importar_accdb)
 
     @app.route('/')
     @login_required
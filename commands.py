@@ -1,16 +1,17 @@
 import click
 from flask.cli import with_appcontext
-from core.models import db, User, Role, Privilegio, Congregacion
+from core.importacion import (crear_admin, importar_access, leer_contactos_csv, poblar_roles_y_privilegios,
+                               sincronizar_contactos)
 import csv
 import os
-import re
 
 @click.command(name='seed')
 @with_appcontext
 def seed():
     """
     Comando para poblar la base de datos con los datos iniciales
-    desde el archivo contactos.csv.
+    desde el archivo contactos.csv. Se puede repetir: sólo aplica lo que
+    cambió en el CSV desde la última vez.
     """
     csv_path = 'contactos.csv'
     if not os.path.exists(csv_path):
@@ -18,72 +19,55 @@ def seed():
         return
 
     print("-> ✍️  Poblando Roles y Privilegios...")
-    roles_a_crear = ['admin', 'editor', 'analyst']
-    for role_name in roles_a_crear:
-        if not db.session.execute(db.select(Role).filter_by(name=role_name)).scalar_one_or_none():
-            db.session.add(Role(name=role_name))
-    
-    privilegios_a_crear = [
-        'Superintendente Viajante', 'Anciano', 'Siervo Ministerial', 
-        'Precursor Especial', 'Precursor Regular', 'Precursor Auxiliar', 
-        'Publicador', 'Betelita'
-    ]
-    for priv_name in privilegios_a_crear:
-        if not db.session.execute(db.select(Privilegio).filter_by(nombre=priv_name)).scalar_one_or_none():
-            db.session.add(Privilegio(nombre=priv_name))
-    db.session.commit()
+    poblar_roles_y_privilegios()
 
     print("-> 👤 Creando usuario 'admin'...")
-    if not db.session.execute(db.select(User).filter_by(username='admin')).scalar_one_or_none():
-        admin_role = db.session.execute(db.select(Role).filter_by(name='admin')).scalar_one()
-        admin_user = User(username='admin', email='admin@ppam.com', nombre_completo='Administrador del Sistema'[:128], role=admin_role)
-        admin_user.set_password('admin')
-        db.session.add(admin_user)
-        db.session.commit()
+    crear_admin('Administrador del Sistema')
 
-    # --- LÓGICA COMPLETA PARA MIGRAR CONTACTOS DESDE CSV ---
-    with open(csv_path, mode='r', encoding='latin-1') as file:
-        csv_reader = csv.DictReader(file, delimiter=';')
-        contactos_csv = list(csv_reader)
-    
-    print(f"-> 🚀 Migrando {len(contactos_csv)} contactos a la tabla de Usuarios...")
+    contactos_csv = leer_contactos_csv(csv_path)
+    print(f"-> 🚀 Sincronizando {len(contactos_csv)} contactos con la tabla de Usuarios...")
+    resultado = sincronizar_contactos(contactos_csv)
+    print(f"-> ✅ {resultado['creados']} creados, {resultado['actualizados']} actualizados, "
+          f"{resultado['eliminados']} eliminados y {resultado['sin_cambios']} sin cambios "
+          f"({resultado['filas_por_segundo']} filas/s, {resultado['segundos']}s).")
+    if resultado['conservados']:
+        print(f"-> ⚠️  {resultado['conservados']} publicadores que ya no están en el CSV se conservan porque tienen historial.")
+    if resultado['omitidas']:
+        print(f"-> ⚠️  {resultado['omitidas']} filas sin Id, sin nombre, sin congregación o con el Id repetido no se sincronizaron.")
+    print("-> ✅ Base de datos poblada exitosamente.")
 
-    # Crear Congregaciones
-    congregaciones_unicas = sorted(list(set((row['Circuito'], row['Congregacion']) for row in contactos_csv if row.get('Congregacion'))))
-    mapa_congregacion_id = {}
-    for circuito, congregacion_nombre in congregaciones_unicas:
-        cong_obj = db.session.execute(db.select(Congregacion).filter_by(nombre=congregacion_nombre, circuito=circuito)).scalar_one_or_none()
-        if not cong_obj:
-            cong_obj = Congregacion(nombre=congregacion_nombre, circuito=circuito)
-            db.session.add(cong_obj)
-            db.session.commit()
-        mapa_congregacion_id[(circuito, congregacion_nombre)] = cong_obj.id
 
-    # Migrar cada contacto del CSV a la tabla User
-    usuarios_creados = 0
-    for i, contacto in enumerate(contactos_csv):
-        nombre_completo = contacto.get('Nombre', '').strip()
-        if not nombre_completo: continue
-            
-        username_base = re.sub(r'[^a-z0-9.]', '', nombre_completo.lower().replace(' ', '.'))
-        username_unico = f"{username_base}.{i}"
+@click.command(name='importar-accdb')
+@click.argument('ruta', default='Circuito1.accdb')
+@click.option('--tabla', 'tablas', multiple=True, help="Tabla a importar (se puede repetir); por defecto, todas.")
+@click.option('--errores', 'ruta_errores', default='importacion_accdb_errores.csv', show_default=True,
+              help="CSV donde se anotan las filas rechazadas.")
+@with_appcontext
+def importar_accdb(ruta, tablas, ruta_errores):
+    """
+    Comando para importar los publicadores de una base de datos de Access
+    (Circuito1.accdb) con mdbtools o access-parser, sin Windows ni ODBC.
+    """
+    if not os.path.exists(ruta):
+        print(f"-> ERROR: No se encontró el archivo '{ruta}'.")
+        return
 
-        cong_id = mapa_congregacion_id.get((contacto.get('Circuito'), contacto.get('Congregacion')))
-        if cong_id:
-            if not db.session.execute(db.select(User).filter_by(username=username_unico)).scalar_one_or_none():
-                editor_role = db.session.execute(db.select(Role).filter_by(name='editor')).scalar_one()
-                nuevo_usuario = User(
-                    nombre_completo=nombre_completo,
-                    telefono=contacto.get('Telefono'),
-                    congregacion_id=cong_id,
-                    username=username_unico,
-                    email=f"{username_unico}@example.com",
-                    role_id=editor_role.id
-                )
-                nuevo_usuario.set_password('123456') # Contraseña por defecto para publicadores
-                db.session.add(nuevo_usuario)
-                usuarios_creados += 1
-                
-    db.session.commit()
-    print(f"-> ✅ {usuarios_creados} nuevos publicadores migrados.")
-    print("-> ✅ Base de datos poblada exitosamente.")
\ No newline at end of file
+    poblar_roles_y_privilegios()
+    print(f"-> 🚀 Importando '{ruta}'...")
+    with open(ruta_errores, 'w', encoding='utf-8-sig', newline='') as informe:
+        escritor = csv.writer(informe, delimiter=';')
+        escritor.writerow(['tabla', 'fila', 'campo', 'valor', 'error'])
+        try:
+            resultado = importar_access(ruta, tablas=list(tablas) or None,
+                                        al_error=lambda *error: escritor.writerow(error))
+        except (RuntimeError, ValueError) as e:
+            print(f"-> ERROR: {e}")
+            return
+    print(f"-> ✅ Tablas importadas: {', '.join(resultado['tablas']) or 'ninguna'}.")
+    if resultado['parcial']:
+        print(f"-> ❌ La tabla '{resultado['parcial']['tabla']}' se importó sólo en parte "
+              f"({resultado['parcial']['filas']} filas confirmadas) y se detuvo la importación: {resultado['error']}")
+    print(f"-> ✅ {resultado['creados']} publicadores creados y {resultado['actualizados']} actualizados "
+          f"de {resultado['filas']} filas ({resultado['filas_por_segundo']} filas/s, {resultado['segundos']}s).")
+    if resultado['errores']:
+        print(f"-> ⚠️  {resultado['errores']} filas con errores; detalle en '{ruta_errores}'.")
@@ -0,0 +1,183 @@
+# src/core/busqueda_sql.py
+import re
+from sqlalchemy import and_, or_, exists, func, literal, literal_column, select, text
+from core.models import db, User, Congregacion, Territorio
+
+# Columna tsvector generada por la migración de búsqueda en Postgres (no está en el
+# modelo para que db.create_all() siga funcionando en SQLite)
+COLUMNA_BUSQUEDA = literal_column('users.busqueda')
+
+
+def condicion_sub_consulta(terminos_numericos, terminos_texto):
+    """
+    Filtro SQL de una sub-consulta: cada término numérico debe aparecer en el circuito
+    y cada término de texto en el nombre, teléfono, congregación, circuito o en algún
+    territorio de la congregación.
+    """
+    condiciones = [Congregacion.circuito.ilike(f"%{t}%") for t in terminos_numericos]
+    for t in terminos_texto:
+        termino_like = f"%{t}%"
+        condiciones.append(or_(
+            User.nombre_completo.ilike(termino_like),
+            User.telefono.ilike(termino_like),
+            Congregacion.nombre.ilike(termino_like),
+            Congregacion.circuito.ilike(termino_like),
+            exists().where(Territorio.congregacion_id == Congregacion.id, Territorio.nombre.ilike(termino_like))
+        ))
+    return and_(*condiciones) if condiciones else literal(True)
+
+
+def _consulta_base():
+    return select(User.id).join(Congregacion, Congregacion.id == User.congregacion_id)
+
+
+class BackendILike:
+    """Respaldo genérico (SQLite y otros): una consulta ILIKE por sub-consulta."""
+    nombre = 'ilike'
+    ordena_por_relevancia = False
+
+    def disponible(self):
+        return True
+
+    def buscar_ids(self, sub_consultas):
+        """`sub_consultas` es una lista de (términos numéricos, términos de texto)."""
+        ids = set()
+        for numericos, textos in sub_consultas:
+            ids.update(db.session.execute(_consulta_base().where(condicion_sub_consulta(numericos, textos))).scalars())
+        return list(ids)
+
+
+class BackendPostgres:
+    """
+    Búsqueda en Postgres: los ILIKE se resuelven con los índices GIN de pg_trgm y
+    todas las sub-consultas van en una sola consulta, ordenada por relevancia
+    (ts_rank sobre users.busqueda más la similitud de trigramas con el nombre).
+    """
+    nombre = 'postgres'
+    ordena_por_relevancia = True
+
+    def __init__(self):
+        self._disponible = None
+
+    def disponible(self):
+        """La migración que crea users.busqueda y los índices puede no haberse aplicado."""
+        if self._disponible is None:
+            self._disponible = db.session.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'users' AND column_name = 'busqueda'")).first() is not None
+        return self._disponible
+
+    def buscar_ids(self, sub_consultas):
+        condicion = or_(*[condicion_sub_consulta(numericos, textos) for numericos, textos in sub_consultas])
+        textos = [t for _, terminos in sub_consultas for t in terminos]
+        # Sólo caracteres de palabra: nada de operadores de tsquery que venga del usuario
+        palabras = sorted({p for t in textos for p in re.findall(r'\w+', t)})
+        relevancia = func.similarity(User.nombre_completo, ' '.join(textos)) if textos else literal(0)
+        if palabras:
+            consulta_ts = func.to_tsquery('simple', ' | '.join(f"{p}:*" for p in palabras))
+            relevancia = relevancia + func.ts_rank(COLUMNA_BUSQUEDA, consulta_ts)
+        consulta = _consulta_base().where(condicion).order_by(relevancia.desc(), User.nombre_completo, User.id)
+        return db.session.execute(consulta).scalars().all()
+
+
+# Columnas de texto de contactos_fts, para los términos que van por LIKE
+COLUMNAS_FTS = ('nombre', 'telefono', 'congregacion', 'circuito', 'territorios')
+# Los trigramas no sirven para términos más cortos
+LONGITUD_TRIGRAMA = 3
+
+
+def _frase_fts(termino):
+    """Término como frase FTS5; con el tokenizador trigram, una frase es una subcadena."""
+    return '"' + termino.replace('"', '""') + '"'
+
+
+def _patron_like(termino):
+    return '%' + re.sub(r'([\\%_])', r'\\\1', termino) + '%'
+
+
+class BackendFTS5:
+    """
+    Búsqueda en SQLite sobre la tabla virtual contactos_fts (espejo mantenido por
+    triggers) con el tokenizador trigram: cada término se busca como subcadena, igual
+    que en el índice en memoria, pero resuelto con el índice de trigramas en lugar de
+    LIKE '%término%' sobre las tablas unidas. Si todos los términos tienen al menos
+    tres caracteres, todas las sub-consultas van en un solo MATCH ordenado por bm25;
+    los más cortos se filtran con LIKE sobre las columnas del espejo.
+    """
+    nombre = 'fts5'
+    ordena_por_relevancia = True
+
+    def __init__(self):
+        self._disponible = None
+
+    def disponible(self):
+        """
+        La migración que crea contactos_fts puede no haberse aplicado (p. ej. con
+        db.create_all()), o haberlo hecho sin trigram en un SQLite anterior a 3.34.
+        """
+        if self._disponible is None:
+            sql = db.session.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'contactos_fts'")).scalar()
+            self._disponible = bool(sql) and 'trigram' in sql
+        return self._disponible
+
+    @staticmethod
+    def expresion_match(sub_consultas):
+        """(a AND b) OR (...): los términos numéricos sólo se buscan en la columna circuito."""
+        alternativas = []
+        for numericos, textos in sub_consultas:
+            frases = [f"circuito : {_frase_fts(t)}" for t in numericos] + [_frase_fts(t) for t in textos]
+            if frases:
+                alternativas.append(f"({' AND '.join(frases)})")
+        return ' OR '.join(alternativas)
+
+    @staticmethod
+    def _condicion_like(numericos, textos, parametros):
+        """Condición LIKE de los términos cortos de una sub-consulta; añade sus parámetros."""
+        condiciones = []
+        for columnas, terminos in ((('circuito',), numericos), (COLUMNAS_FTS, textos)):
+            for t in terminos:
+                nombre = f"l{len(parametros)}"
+                parametros[nombre] = _patron_like(t)
+                condiciones.append('(' + ' OR '.join(f"{c} LIKE :{nombre} ESCAPE '\\'" for c in columnas) + ')')
+        return ' AND '.join(condiciones)
+
+    def buscar_ids(self, sub_consultas):
+        largo = lambda terminos: [t for t in terminos if len(t) >= LONGITUD_TRIGRAMA]
+        corto = lambda terminos: [t for t in terminos if len(t) < LONGITUD_TRIGRAMA]
+        if all(not corto(n) and not corto(t) for n, t in sub_consultas):
+            expresion = self.expresion_match(sub_consultas)
+            if not expresion: return []
+            return db.session.execute(text(
+                "SELECT rowid FROM contactos_fts WHERE contactos_fts MATCH :expresion "
+                "ORDER BY bm25(contactos_fts), nombre, rowid"), {"expresion": expresion}).scalars().all()
+
+        # Con términos cortos, una consulta por sub-consulta: MATCH para los largos y LIKE
+        # para los cortos (sin MATCH, el LIKE recorre el espejo, que no une tablas)
+        ids = {}
+        for numericos, textos in sub_consultas:
+            parametros = {}
+            condiciones = []
+            expresion = self.expresion_match([(largo(numericos), largo(textos))])
+            if expresion:
+                parametros["expresion"] = expresion
+                condiciones.append("contactos_fts MATCH :expresion")
+            condicion_like = self._condicion_like(corto(numericos), corto(textos), parametros)
+            if condicion_like:
+                condiciones.append(condicion_like)
+            if not condiciones:
+                continue
+            orden = "bm25(contactos_fts), nombre, rowid" if expresion else "nombre, rowid"
+            ids.update(dict.fromkeys(db.session.execute(text(
+                f"SELECT rowid FROM contactos_fts WHERE {' AND '.join(condiciones)} ORDER BY {orden}"),
+                parametros).scalars()))
+        return list(ids)
+
+
+def backend_para(dialecto):
+    """Backend SQL adecuado para el dialecto de la base de datos."""
+    if dialecto == 'postgresql':
+        return BackendPostgres()
+    if dialecto == 'sqlite':
+        return BackendFTS5()
+    return BackendILike()
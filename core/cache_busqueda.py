@@ -0,0 +1,156 @@
+# src/core/cache_busqueda.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class CacheMemoria:
+    """
+    LRU con caducidad (TTL) en la memoria del proceso. Las claves llevan la generación
+    compartida de los contactos, así que un commit en otro worker deja sin uso las
+    entradas viejas de este aunque no se borren hasta caducar.
+    """
+    nombre = 'memoria'
+
+    def __init__(self, capacidad=512, ttl=300):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None: return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class CacheSQLite:
+    """
+    Caché en un archivo SQLite local, compartida por todos los workers de gunicorn
+    de la máquina: una página calculada en un worker sirve para los demás.
+    """
+    nombre = 'sqlite'
+
+    def __init__(self, ruta, capacidad=2048, ttl=300):
+        self.ruta = ruta
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._local = threading.local()
+        self._escrituras = 0
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        con = self._conexion()
+        with con:
+            con.execute("CREATE TABLE IF NOT EXISTS cache_busqueda ("
+                        "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL NOT NULL, usado REAL NOT NULL)")
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def obtener(self, clave):
+        con = self._conexion()
+        ahora = time.time()
+        fila = con.execute("SELECT valor FROM cache_busqueda WHERE clave = ? AND expira > ?", (clave, ahora)).fetchone()
+        if fila is None: return None
+        con.execute("UPDATE cache_busqueda SET usado = ? WHERE clave = ?", (ahora, clave))
+        return json.loads(fila[0])
+
+    def guardar(self, clave, valor):
+        con = self._conexion()
+        ahora = time.time()
+        con.execute("INSERT OR REPLACE INTO cache_busqueda (clave, valor, expira, usado) VALUES (?, ?, ?, ?)",
+                    (clave, json.dumps(valor, ensure_ascii=False), ahora + self.ttl, ahora))
+        # La poda del LRU se hace cada tantas escrituras, no en cada una
+        self._escrituras += 1
+        if self._escrituras % 64 == 0:
+            with con:
+                con.execute("DELETE FROM cache_busqueda WHERE expira <= ?", (ahora,))
+                con.execute("DELETE FROM cache_busqueda WHERE clave IN ("
+                            "SELECT clave FROM cache_busqueda ORDER BY usado DESC LIMIT -1 OFFSET ?)", (self.capacidad,))
+
+    def invalidar(self):
+        self._conexion().execute("DELETE FROM cache_busqueda")
+
+    def __len__(self):
+        return self._conexion().execute("SELECT count(*) FROM cache_busqueda").fetchone()[0]
+
+
+class CacheBusqueda:
+    """Caché de resultados de búsqueda con contadores de aciertos y fallos."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave):
+        valor = self.backend.obtener(clave)
+        if valor is None:
+            self.fallos += 1
+        else:
+            self.aciertos += 1
+        return valor
+
+    def guardar(self, clave, valor):
+        self.backend.guardar(clave, valor)
+
+    def invalidar(self):
+        self.invalidaciones += 1
+        self.backend.invalidar()
+
+    def estadisticas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "backend": self.backend.nombre,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 3) if consultas else None,
+            "invalidaciones": self.invalidaciones,
+            "entradas": len(self.backend),
+            "capacidad": self.backend.capacidad,
+            "ttl": self.backend.ttl
+        }
+
+
+def crear_cache(config, instance_path):
+    """
+    Crea la caché según BUSQUEDA_CACHE: 'memoria' (por defecto, una por worker) o
+    'sqlite' / 'sqlite:///ruta/archivo.db' (compartida entre workers). En ambos casos
+    las claves incluyen la generación compartida que publica core/motor_busqueda.py.
+    """
+    tipo = config.get('BUSQUEDA_CACHE', 'memoria')
+    capacidad = int(config.get('BUSQUEDA_CACHE_CAPACIDAD', 512))
+    ttl = float(config.get('BUSQUEDA_CACHE_TTL', 300))
+    if tipo.startswith('sqlite'):
+        ruta = tipo[len('sqlite:///'):] if tipo.startswith('sqlite:///') else os.path.join(instance_path, 'cache_busqueda.db')
+        return CacheBusqueda(CacheSQLite(ruta, capacidad, ttl))
+    return CacheBusqueda(CacheMemoria(capacidad, ttl))
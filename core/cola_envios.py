@@ -0,0 +1,260 @@
+# src/core/cola_envios.py
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import func, update
+from core.models import db, User, Congregacion, TrabajoEnvio, MensajeSaliente, AsignacionVisita
+from core.telefonos import normalizar_telefono
+
+# Estados de un mensaje: en_cola -> enviando -> enviado | fallido (o de vuelta a
+# en_cola si falló la sesión de WhatsApp y no el mensaje: devolver_a_la_cola)
+EN_COLA, ENVIANDO, ENVIADO, FALLIDO = 'en_cola', 'enviando', 'enviado', 'fallido'
+# Estados de un trabajo (un envío masivo)
+COMPLETADO = 'completado'
+
+# Ids por consulta al cargar destinatarios (por debajo del límite de parámetros de SQLite)
+TAMANO_LOTE_IDS = 500
+# Estados de una asignación S-43 antes y después de que el publicador responda 'Acepto'
+PENDIENTE, CONFIRMADO = 'Pendiente', 'Confirmado'
+# Marcadores de las plantillas: {nombre}, {congregacion}...
+MARCADOR = re.compile(r'\{(\w+)\}')
+
+
+def renderizar_plantilla(plantilla, valores):
+    """Sustituye los marcadores conocidos; los desconocidos se dejan tal cual."""
+    return MARCADOR.sub(lambda m: str(valores[m.group(1)]) if m.group(1) in valores else m.group(0), plantilla)
+
+
+def preparar_difusion(plantilla, usuario_ids):
+    """
+    Carga de la base de datos a los usuarios indicados y arma un mensaje por
+    destinatario con la plantilla. Se usa el teléfono E.164 guardado en el usuario:
+    los que no tienen un número válido se descartan y los números repetidos se
+    envían una sola vez (al primer usuario en el orden dado).
+    Devuelve (destinatarios, {"sin_telefono": n, "duplicados": n}).
+    """
+    usuario_ids = list(dict.fromkeys(int(i) for i in usuario_ids))
+    filas = {}
+    for i in range(0, len(usuario_ids), TAMANO_LOTE_IDS):
+        consulta = (
+            db.select(User.id, User.nombre_completo, User.telefono_e164, Congregacion.nombre, Congregacion.circuito)
+            .outerjoin(Congregacion, Congregacion.id == User.congregacion_id)
+            .where(User.id.in_(usuario_ids[i:i + TAMANO_LOTE_IDS]))
+        )
+        filas.update((fila[0], fila) for fila in db.session.execute(consulta))
+
+    destinatarios, vistos = [], set()
+    descartes = {"sin_telefono": 0, "duplicados": 0}
+    for usuario_id in usuario_ids:
+        if usuario_id not in filas:
+            continue
+        _, nombre, telefono, congregacion, circuito = filas[usuario_id]
+        if not telefono:
+            descartes["sin_telefono"] += 1
+            continue
+        if telefono in vistos:
+            descartes["duplicados"] += 1
+            continue
+        vistos.add(telefono)
+        valores = {
+            "nombre": nombre,
+            "primer_nombre": nombre.split()[0] if nombre else '',
+            "congregacion": congregacion or '',
+            "circuito": circuito or '',
+            "telefono": telefono
+        }
+        destinatarios.append({"id": usuario_id, "nombre": nombre, "telefono": telefono,
+                              "texto": renderizar_plantilla(plantilla, valores)})
+    return destinatarios, descartes
+
+
+def encolar_envio(destinatarios, mensaje, creado_por_id=None, confirmar=True):
+    """
+    Guarda un envío masivo como un trabajo con un mensaje por destinatario.
+    `destinatarios` son diccionarios con 'telefono' y, opcionalmente, 'id', 'nombre'
+    y 'texto' (el mensaje ya personalizado; si falta se usa `mensaje`). Los teléfonos
+    se guardan en E.164 y los que no son válidos se descartan. Devuelve el trabajo
+    (o None si no hay a quién enviar).
+
+    Con `confirmar=False` no hace commit: el envío queda en la transacción de quien
+    llama y sólo entra en la cola si esa transacción se confirma.
+    """
+    destinatarios = [dict(d, telefono=normalizar_telefono(d.get('telefono'))) for d in destinatarios]
+    destinatarios = [d for d in destinatarios if d['telefono']]
+    if not destinatarios:
+        return None
+    trabajo = TrabajoEnvio(mensaje=mensaje, estado=EN_COLA, creado_por_id=creado_por_id)
+    db.session.add(trabajo)
+    for d in destinatarios:
+        trabajo.mensajes.append(MensajeSaliente(
+            usuario_id=d.get('id'), nombre=d.get('nombre'), telefono=d['telefono'],
+            texto=d.get('texto', mensaje), estado=EN_COLA, intentos=0))
+    if confirmar:
+        db.session.commit()
+    else:
+        db.session.flush()
+    return trabajo
+
+
+def recuperar_interrumpidos():
+    """
+    Al arrancar el trabajador, los mensajes que quedaron 'enviando' (el proceso murió
+    a mitad del envío) vuelven a la cola. Devuelve cuántos se recuperaron.
+    """
+    resultado = db.session.execute(update(MensajeSaliente).where(MensajeSaliente.estado == ENVIANDO).values(estado=EN_COLA))
+    db.session.commit()
+    return resultado.rowcount
+
+
+def reclamar_siguientes(cantidad=1):
+    """
+    Marca como 'enviando' los siguientes `cantidad` mensajes en orden FIFO (por
+    trabajo y luego por mensaje), saltando los que esperan para reintentarse.
+    """
+    mensajes = db.session.execute(
+        db.select(MensajeSaliente)
+        .where(MensajeSaliente.estado == EN_COLA,
+               (MensajeSaliente.reintentar_en.is_(None)) | (MensajeSaliente.reintentar_en <= datetime.utcnow()))
+        .order_by(MensajeSaliente.trabajo_id, MensajeSaliente.id).limit(cantidad)
+    ).scalars().all()
+    for mensaje in mensajes:
+        mensaje.estado = ENVIANDO
+        mensaje.intentos += 1
+        if mensaje.trabajo.estado == EN_COLA:
+            mensaje.trabajo.estado = ENVIANDO
+    if mensajes:
+        db.session.commit()
+    return mensajes
+
+
+def devolver_a_la_cola(mensajes, error, max_intentos, espera_base, espera_maxima=3600):
+    """
+    Tras un fallo de la sesión de WhatsApp (no del mensaje), los mensajes de
+    `mensajes` que siguen 'enviando' vuelven a la cola con espera exponencial:
+    espera_base * 2^(intentos - 1) segundos, como mucho espera_maxima. Los que ya
+    llevan `max_intentos` se dan por fallidos. Devuelve cuántos volvieron a la cola.
+    """
+    devueltos = 0
+    for mensaje in mensajes:
+        if mensaje.estado != ENVIANDO:
+            continue
+        if mensaje.intentos >= max_intentos:
+            registrar_resultado(mensaje, False, f"{error} (tras {mensaje.intentos} intentos)")
+            continue
+        espera = min(espera_base * 2 ** (mensaje.intentos - 1), espera_maxima)
+        mensaje.estado = EN_COLA
+        mensaje.error = (error or '')[:255] or None
+        mensaje.reintentar_en = datetime.utcnow() + timedelta(seconds=espera)
+        devueltos += 1
+    db.session.commit()
+    return devueltos
+
+
+def registrar_resultado(mensaje, enviado, error=None, entrega=None, duracion_ms=None, confirmacion_ms=None, captura=None):
+    """
+    Guarda el resultado de un mensaje (con la confirmación de entrega y los tiempos
+    que midió el servicio de WhatsApp) y cierra el trabajo cuando ya no le queda
+    nada pendiente.
+    """
+    mensaje.estado = ENVIADO if enviado else FALLIDO
+    mensaje.reintentar_en = None
+    mensaje.error = None if enviado else (error or 'No se pudo enviar el mensaje')[:255]
+    mensaje.entrega = entrega
+    mensaje.duracion_ms = duracion_ms
+    mensaje.confirmacion_ms = confirmacion_ms
+    mensaje.captura = captura[:255] if captura else None
+    if enviado:
+        mensaje.enviado_en = datetime.utcnow()
+    # Las asignaciones S-43 notificadas con este mensaje reflejan el resultado
+    db.session.execute(
+        update(AsignacionVisita).where(AsignacionVisita.mensaje_id == mensaje.id)
+        .values(notificacion=mensaje.estado, notificada_en=mensaje.enviado_en)
+    )
+    db.session.flush()
+    pendientes = db.session.execute(
+        db.select(func.count(MensajeSaliente.id))
+        .where(MensajeSaliente.trabajo_id == mensaje.trabajo_id, MensajeSaliente.estado.in_([EN_COLA, ENVIANDO]))
+    ).scalar()
+    if not pendientes:
+        mensaje.trabajo.estado = COMPLETADO
+        mensaje.trabajo.finalizado_en = datetime.utcnow()
+    db.session.commit()
+
+
+def _esperando_respuesta(horas):
+    """Asignaciones notificadas hace menos de `horas` que siguen sin confirmar."""
+    return (
+        (AsignacionVisita.estado == PENDIENTE)
+        & (AsignacionVisita.notificacion == ENVIADO)
+        & (AsignacionVisita.notificada_en >= datetime.utcnow() - timedelta(hours=horas))
+    )
+
+
+def hay_respuestas_pendientes(horas):
+    """True si alguna asignación notificada en las últimas `horas` espera el 'Acepto' del publicador."""
+    return db.session.execute(
+        db.select(AsignacionVisita.id).where(_esperando_respuesta(horas)).limit(1)
+    ).first() is not None
+
+
+def confirmar_asignaciones(telefonos, horas):
+    """
+    Marca como confirmadas las asignaciones pendientes de los publicadores que
+    respondieron desde esos teléfonos E.164. Se buscan por el índice de
+    users.telefono_e164 y se actualizan con un UPDATE por lote y un solo commit.
+    Devuelve cuántas asignaciones se confirmaron.
+    """
+    telefonos = sorted(set(telefonos))
+    confirmadas = 0
+    for i in range(0, len(telefonos), TAMANO_LOTE_IDS):
+        publicadores = db.select(User.id).where(User.telefono_e164.in_(telefonos[i:i + TAMANO_LOTE_IDS]))
+        confirmadas += db.session.execute(
+            update(AsignacionVisita)
+            .where(AsignacionVisita.publicador_id.in_(publicadores), _esperando_respuesta(horas))
+            .values(estado=CONFIRMADO)
+        ).rowcount
+    db.session.commit()
+    return confirmadas
+
+
+def resumen_trabajo(trabajo_id):
+    """Progreso de un trabajo para la interfaz: conteo por estado y resultado de cada destinatario."""
+    trabajo = db.session.get(TrabajoEnvio, trabajo_id)
+    if trabajo is None:
+        return None
+    conteos = dict(db.session.execute(
+        db.select(MensajeSaliente.estado, func.count(MensajeSaliente.id))
+        .where(MensajeSaliente.trabajo_id == trabajo_id).group_by(MensajeSaliente.estado)
+    ).all())
+    # Posición en la cola: mensajes pendientes de trabajos anteriores
+    por_delante = db.session.execute(
+        db.select(func.count(MensajeSaliente.id))
+        .where(MensajeSaliente.trabajo_id < trabajo_id, MensajeSaliente.estado.in_([EN_COLA, ENVIANDO]))
+    ).scalar() if trabajo.estado == EN_COLA else 0
+    return {
+        "id": trabajo.id,
+        "estado": trabajo.estado,
+        "creado_en": trabajo.creado_en.isoformat(),
+        "finalizado_en": trabajo.finalizado_en.isoformat() if trabajo.finalizado_en else None,
+        "total": sum(conteos.values()),
+        "en_cola": conteos.get(EN_COLA, 0),
+        "enviando": conteos.get(ENVIANDO, 0),
+        "enviados": conteos.get(ENVIADO, 0),
+        "fallidos": conteos.get(FALLIDO, 0),
+        "entregados": sum(1 for m in trabajo.mensajes if m.entrega in ('entregado', 'leido')),
+        "mensajes_por_delante": por_delante,
+        "mensajes": [{
+            "id": m.id,
+            "usuario_id": m.usuario_id,
+            "nombre": m.nombre,
+            "telefono": m.telefono,
+            "estado": m.estado,
+            "intentos": m.intentos,
+            "reintentar_en": m.reintentar_en.isoformat() if m.estado == EN_COLA and m.reintentar_en else None,
+            "error": m.error,
+            "entrega": m.entrega,
+            "duracion_ms": m.duracion_ms,
+            "confirmacion_ms": m.confirmacion_ms,
+            "captura": m.captura,
+            "enviado_en": m.enviado_en.isoformat() if m.enviado_en else None
+        } for m in trabajo.mensajes]
+    }
@@ -0,0 +1,141 @@
+# src/core/control_whatsapp.py
+"""
+Control del navegador de WhatsApp entre procesos. El perfil de Chromium sólo lo
+abre el trabajador de envíos (trabajador_envios.py): el proceso web no lanza
+Playwright, deja una solicitud en solicitudes_whatsapp (conectar, cerrar, aplicar
+un snapshot del perfil) y espera la respuesta. El estado de la sesión lo lee de la
+fila que el trabajador publica en estado_whatsapp.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, update
+from core.models import db, SolicitudWhatsApp, EstadoWhatsApp
+
+# Estados de una solicitud: pendiente -> atendiendo -> atendida | fallida; caducada
+# si el web dejó de esperarla antes de que el trabajador la tomara
+PENDIENTE, ATENDIENDO, ATENDIDA, FALLIDA, CADUCADA = 'pendiente', 'atendiendo', 'atendida', 'fallida', 'caducada'
+# Segundos entre latidos del trabajador y sin latido tras los que se le da por parado
+INTERVALO_LATIDO = 30
+LATIDO_MAXIMO = 300
+# Días que se conservan las solicitudes ya resueltas
+DIAS_SOLICITUDES = 1
+
+
+# --- Lado del proceso web ---
+
+def solicitar(accion, archivo=None):
+    """Deja una solicitud para el trabajador y devuelve su id."""
+    solicitud = SolicitudWhatsApp(accion=accion, estado=PENDIENTE, archivo=archivo)
+    db.session.add(solicitud)
+    db.session.commit()
+    return solicitud.id
+
+
+def esperar_respuesta(solicitud_id, timeout, intervalo=0.5):
+    """
+    Espera a que el trabajador resuelva la solicitud y devuelve (estado, resultado).
+    Si vence `timeout` sin que la haya tomado, la marca como caducada para que ya no
+    la atienda y devuelve (CADUCADA, None); si la está atendiendo, (ATENDIENDO, None).
+    """
+    limite = time.monotonic() + timeout
+    while True:
+        solicitud = db.session.get(SolicitudWhatsApp, solicitud_id, populate_existing=True)
+        if solicitud.estado in (ATENDIDA, FALLIDA):
+            return solicitud.estado, json.loads(solicitud.resultado) if solicitud.resultado else {}
+        if time.monotonic() >= limite:
+            break
+        # Se cierra la transacción de lectura para ver lo que confirme el trabajador
+        db.session.commit()
+        time.sleep(intervalo)
+    caducada = db.session.execute(
+        update(SolicitudWhatsApp).where(SolicitudWhatsApp.id == solicitud_id, SolicitudWhatsApp.estado == PENDIENTE)
+        .values(estado=CADUCADA)
+    ).rowcount
+    db.session.commit()
+    return (CADUCADA if caducada else ATENDIENDO), None
+
+
+def leer_estado():
+    """
+    Estado de la sesión publicado por el trabajador, con las claves de
+    WhatsAppServicio.estado() más el QR pendiente de escanear y si el trabajador
+    está en marcha (dio un latido en los últimos LATIDO_MAXIMO segundos).
+    """
+    fila = db.session.get(EstadoWhatsApp, 1, populate_existing=True)
+    if fila is None:
+        return {"logueado": False, "estado": 'desconocido', "actualizado_en": None, "navegador_abierto": False,
+                "lanzamientos": 0, "qr": None, "trabajador_activo": False}
+    return {
+        "logueado": fila.estado == 'conectado',
+        "estado": fila.estado,
+        "actualizado_en": fila.actualizado_en.isoformat() if fila.actualizado_en else None,
+        "navegador_abierto": fila.navegador_abierto,
+        "lanzamientos": fila.lanzamientos,
+        "qr": fila.qr,
+        "trabajador_activo": bool(fila.latido) and fila.latido >= datetime.utcnow() - timedelta(seconds=LATIDO_MAXIMO)
+    }
+
+
+# --- Lado del trabajador de envíos ---
+
+def recuperar_solicitudes():
+    """
+    Al arrancar el trabajador: las solicitudes que quedaron a medias fallan (el web
+    ya no las espera) y se borran las resueltas hace más de DIAS_SOLICITUDES.
+    """
+    db.session.execute(
+        update(SolicitudWhatsApp).where(SolicitudWhatsApp.estado == ATENDIENDO)
+        .values(estado=FALLIDA, resultado=json.dumps({"mensaje": "El trabajador de envíos se reinició."}))
+    )
+    db.session.execute(
+        delete(SolicitudWhatsApp).where(SolicitudWhatsApp.estado != PENDIENTE,
+                                        SolicitudWhatsApp.creada_en < datetime.utcnow() - timedelta(days=DIAS_SOLICITUDES))
+    )
+    db.session.commit()
+
+
+def tomar_solicitud():
+    """La solicitud pendiente más antigua, ya marcada como 'atendiendo' (None si no hay)."""
+    solicitud = db.session.execute(
+        db.select(SolicitudWhatsApp).where(SolicitudWhatsApp.estado == PENDIENTE)
+        .order_by(SolicitudWhatsApp.id).limit(1)
+    ).scalar()
+    if solicitud is None:
+        return None
+    # Sólo si sigue pendiente: el web pudo haberla dado por caducada entretanto
+    tomada = db.session.execute(
+        update(SolicitudWhatsApp).where(SolicitudWhatsApp.id == solicitud.id, SolicitudWhatsApp.estado == PENDIENTE)
+        .values(estado=ATENDIENDO)
+    ).rowcount
+    db.session.commit()
+    return solicitud if tomada else None
+
+
+def responder(solicitud, resultado, fallida=False):
+    """Guarda la respuesta del trabajador a la solicitud."""
+    solicitud.estado = FALLIDA if fallida else ATENDIDA
+    solicitud.resultado = json.dumps(resultado, ensure_ascii=False)
+    solicitud.atendida_en = datetime.utcnow()
+    db.session.commit()
+
+
+def publicar_estado(estado, qr=None):
+    """
+    Guarda el estado de la sesión que ve el trabajador (WhatsAppServicio.estado())
+    y cuenta como latido. El QR se conserva mientras la página lo siga mostrando.
+    """
+    fila = db.session.get(EstadoWhatsApp, 1)
+    if fila is None:
+        fila = EstadoWhatsApp(id=1)
+        db.session.add(fila)
+    fila.estado = estado["estado"]
+    if qr is not None:
+        fila.qr = qr
+    elif estado["estado"] != 'esperando_qr' or not estado["navegador_abierto"]:
+        fila.qr = None
+    fila.navegador_abierto = estado["navegador_abierto"]
+    fila.lanzamientos = estado["lanzamientos"]
+    fila.actualizado_en = datetime.fromisoformat(estado["actualizado_en"]) if estado["actualizado_en"] else None
+    fila.latido = datetime.utcnow()
+    db.session.commit()
@@ -0,0 +1,791 @@
+# src/core/importacion.py
+"""
+Sincronización de contactos.csv con la tabla de usuarios, compartida por el
+comando `flask seed` y por migracion.py. Cada fila se identifica por su columna
+Id y una huella de su contenido, así que sólo se escriben las altas, cambios y
+bajas desde la última vez, por lotes (executemany): volver a sembrar con el
+mismo CSV no escribe nada.
+
+También importa las planillas (CSV o Excel) que se suben en /admin/upload:
+lectura por lotes, mapeo de columnas y alta o actualización de cada publicador,
+y las tablas de bases de datos de Access (Circuito1.accdb) con el mismo upsert.
+"""
+import os
+import csv
+import re
+import shutil
+import subprocess
+import json
+import time
+import uuid
+import codecs
+import hashlib
+import threading
+import unicodedata
+from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import delete, insert, update
+from werkzeug.security import generate_password_hash
+from core.models import (db, User, Role, Privilegio, Congregacion, RegistroActividad, AsignacionVisita,
+                         TrabajoEnvio, MensajeSaliente, ContactoSincronizado, user_privilegios)
+from core.telefonos import normalizar_telefono
+from core.motor_busqueda import invalidacion_diferida
+
+ROLES = ['admin', 'editor', 'analyst']
+PRIVILEGIOS = [
+    'Superintendente Viajante', 'Anciano', 'Siervo Ministerial',
+    'Precursor Especial', 'Precursor Regular', 'Precursor Auxiliar',
+    'Publicador', 'Betelita'
+]
+# Contraseña con la que se crean los publicadores importados que no traen una propia
+CONTRASENA_POR_DEFECTO = '123456'
+# A partir de cuántas contraseñas propias se reparte el hash entre procesos, y cuántos
+UMBRAL_PROCESOS = 8
+PROCESOS_HASH = int(os.environ.get('IMPORTACION_PROCESOS', os.cpu_count() or 1))
+# Columnas de contactos.csv que se copian al publicador y forman la huella de cada fila
+CAMPOS_SINCRONIZADOS = ('Nombre', 'Telefono', 'Circuito', 'Congregacion')
+# Filas por INSERT de varias filas (y por lote al leer planillas)
+TAMANO_LOTE = 500
+# Bytes por lectura al detectar la codificación de un CSV
+TAMANO_BLOQUE_LECTURA = 1024 * 1024
+
+
+def leer_contactos_csv(ruta):
+    """Filas de contactos.csv (latin-1, separado por ';') como diccionarios."""
+    with open(ruta, mode='r', encoding='latin-1') as archivo:
+        return list(csv.DictReader(archivo, delimiter=';'))
+
+
+def poblar_roles_y_privilegios():
+    """Crea los roles y privilegios que falten, con una consulta por tabla."""
+    roles = set(db.session.execute(db.select(Role.name)).scalars())
+    privilegios = set(db.session.execute(db.select(Privilegio.nombre)).scalars())
+    db.session.add_all(Role(name=nombre) for nombre in ROLES if nombre not in roles)
+    db.session.add_all(Privilegio(nombre=nombre) for nombre in PRIVILEGIOS if nombre not in privilegios)
+    db.session.commit()
+
+
+def crear_admin(nombre_completo):
+    """Crea el usuario 'admin' (contraseña 'admin') si no existe. Devuelve True si lo creó."""
+    if db.session.execute(db.select(User.id).filter_by(username='admin')).first():
+        return False
+    admin_role = db.session.execute(db.select(Role).filter_by(name='admin')).scalar_one()
+    admin_user = User(username='admin', email='admin@ppam.com', nombre_completo=nombre_completo, role=admin_role)
+    admin_user.set_password('admin')
+    db.session.add(admin_user)
+    db.session.commit()
+    return True
+
+
+def username_contacto(nombre_completo, indice):
+    """Usuario de un contacto: su nombre en minúsculas con puntos y la fila del CSV."""
+    username_base = re.sub(r'[^a-z0-9.]', '', nombre_completo.lower().replace(' ', '.'))
+    return f"{username_base}.{indice}"
+
+
+def hashear_contrasenas(contrasenas):
+    """
+    Hash (KDF de werkzeug, con sal propia) de cada contraseña, en el mismo orden.
+    El KDF es deliberadamente lento, así que con muchas se reparte entre procesos.
+    """
+    if len(contrasenas) < UMBRAL_PROCESOS or PROCESOS_HASH < 2:
+        return [generate_password_hash(c) for c in contrasenas]
+    with ProcessPoolExecutor(max_workers=PROCESOS_HASH) as pool:
+        return list(pool.map(generate_password_hash, contrasenas, chunksize=4))
+
+
+def _mapa_congregaciones():
+    return {(circuito, nombre): id_ for id_, nombre, circuito in
+            db.session.execute(db.select(Congregacion.id, Congregacion.nombre, Congregacion.circuito))}
+
+
+def huella_contacto(fila):
+    """SHA-256 de los CAMPOS_SINCRONIZADOS de una fila de contactos.csv."""
+    datos = json.dumps([(fila.get(campo) or '').strip() for campo in CAMPOS_SINCRONIZADOS], ensure_ascii=False)
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+
+def _en_lotes(valores):
+    valores = list(valores)
+    for i in range(0, len(valores), TAMANO_LOTE):
+        yield valores[i:i + TAMANO_LOTE]
+
+
+def _usuarios_con_historial(ids):
+    """Los de `ids` con registros, asignaciones o mensajes, que no se pueden borrar sin perderlos."""
+    con_historial = set()
+    for columna in (RegistroActividad.user_id, AsignacionVisita.publicador_id,
+                    MensajeSaliente.usuario_id, TrabajoEnvio.creado_por_id):
+        for lote in _en_lotes(ids):
+            con_historial.update(db.session.execute(db.select(columna).where(columna.in_(lote)).distinct()).scalars())
+    return con_historial
+
+
+def _adoptar_existentes(filas):
+    """
+    {Id de la fila: id de usuario} para las filas nunca sincronizadas cuyo
+    publicador ya existe (bases sembradas antes de la sincronización). Sólo se
+    adoptan usuarios que creó el importador: rol editor y el correo
+    <username>@example.com que les pone; nunca los administradores ni las cuentas
+    creadas a mano. Se reconocen por su teléfono E.164 o, si la fila no trae
+    teléfono, por su nombre si es único, salvo que el usuario ya tenga historial
+    (registros, asignaciones o mensajes): a ésos sólo los identifica el teléfono.
+    """
+    enlazados = set(db.session.execute(
+        db.select(ContactoSincronizado.usuario_id).where(ContactoSincronizado.usuario_id.is_not(None))).scalars())
+    candidatos = [(id_, nombre, e164) for id_, nombre, e164 in db.session.execute(
+        db.select(User.id, User.nombre_completo, User.telefono_e164).join(Role, User.role_id == Role.id)
+        .where(Role.name == 'editor', User.email == User.username + '@example.com'))
+        if id_ not in enlazados]
+    con_historial = _usuarios_con_historial([id_ for id_, _, _ in candidatos])
+    por_telefono, por_nombre = {}, {}
+    for id_, nombre, e164 in candidatos:
+        if e164:
+            por_telefono.setdefault(e164, id_)
+        clave = _clave(nombre)
+        por_nombre[clave] = id_ if por_nombre.get(clave, id_) == id_ and id_ not in con_historial else None
+
+    adoptados = {}
+    for id_origen, fila in filas.items():
+        e164 = normalizar_telefono(fila.get('Telefono'))
+        usuario_id = por_telefono.get(e164) if e164 else por_nombre.get(_clave(fila.get('Nombre')))
+        if usuario_id and usuario_id not in enlazados:
+            adoptados[id_origen] = usuario_id
+            enlazados.add(usuario_id)
+    return adoptados
+
+
+def sincronizar_contactos(filas):
+    """
+    Sincroniza los publicadores con contactos.csv por su columna Id. La huella de
+    cada fila (huella_contacto) se compara con la de la última sincronización,
+    guardada en ContactoSincronizado, y en una sola transacción se aplican sólo
+    las altas de Id nuevos, los cambios de las filas cuya huella difiere y las
+    bajas de los Id que ya no están. Con el CSV sin cambios no se escribe nada, y
+    reordenarlo no crea duplicados: el usuario de un alta lleva su Id, no su posición.
+    Las filas que aún no se habían sincronizado se enlazan con el publicador que ya
+    exista (_adoptar_existentes) en vez de duplicarlo. En las bajas se conservan los
+    publicadores con historial; sólo dejan de sincronizarse.
+    Las inserciones van por Core, así que telefono_e164 se calcula aquí. Los
+    usuarios nuevos sin columna 'Contrasena' comparten el hash de
+    CONTRASENA_POR_DEFECTO, calculado una sola vez; a los existentes no se les
+    cambia la contraseña.
+    Devuelve {"filas", "creados", "actualizados", "eliminados", "conservados",
+    "sin_cambios", "omitidas", "congregaciones", "segundos", "filas_por_segundo"}.
+    """
+    inicio = time.perf_counter()
+    vigentes, presentes, omitidas = {}, set(), 0
+    for fila in filas:
+        id_origen = (fila.get('Id') or '').strip()
+        presentes.add(id_origen)
+        # Sin Id, nombre o congregación no se sincroniza (tampoco se da de baja si ya lo
+        # estaba); un Id repetido vale la primera vez
+        if (not id_origen or id_origen in vigentes or not (fila.get('Nombre') or '').strip()
+                or not (fila.get('Congregacion') or '').strip()):
+            omitidas += 1
+            continue
+        vigentes[id_origen] = fila
+
+    sincronizados = {id_origen: (hash_, usuario_id) for id_origen, hash_, usuario_id in db.session.execute(
+        db.select(ContactoSincronizado.id_origen, ContactoSincronizado.hash, ContactoSincronizado.usuario_id))}
+    huellas = {id_origen: huella_contacto(fila) for id_origen, fila in vigentes.items()}
+    cambiadas = {id_origen: vigentes[id_origen] for id_origen, huella in huellas.items()
+                 if sincronizados.get(id_origen, (None,))[0] != huella}
+    bajas = [id_origen for id_origen in sincronizados if id_origen not in presentes]
+    resultado = {"filas": len(filas), "creados": 0, "actualizados": 0, "eliminados": 0, "conservados": 0,
+                 "sin_cambios": len(vigentes) - len(cambiadas), "omitidas": omitidas, "congregaciones": 0}
+
+    if cambiadas or bajas:
+        congregaciones = _mapa_congregaciones()
+        nuevas = sorted({(fila['Circuito'], fila['Congregacion']) for fila in cambiadas.values()} - set(congregaciones))
+        if nuevas:
+            db.session.execute(insert(Congregacion), [{"circuito": circuito, "nombre": nombre} for circuito, nombre in nuevas])
+            congregaciones = _mapa_congregaciones()
+        resultado["congregaciones"] = len(nuevas)
+
+        usuario_de = {id_origen: sincronizados[id_origen][1] for id_origen in cambiadas if id_origen in sincronizados}
+        # Un publicador borrado a mano desde la última sincronización se vuelve a dar de alta
+        existentes = set()
+        for lote in _en_lotes({u for u in usuario_de.values() if u}):
+            existentes.update(db.session.execute(db.select(User.id).where(User.id.in_(lote))).scalars())
+        usuario_de = {id_origen: u for id_origen, u in usuario_de.items() if u in existentes}
+        usuario_de.update(_adoptar_existentes({i: f for i, f in cambiadas.items() if i not in sincronizados}))
+        cambios, altas, propias = [], {}, []
+        usernames = set(db.session.execute(db.select(User.username)).scalars()) if len(usuario_de) < len(cambiadas) else set()
+        for id_origen, fila in cambiadas.items():
+            telefono = fila.get('Telefono')
+            valores = {
+                "nombre_completo": fila['Nombre'].strip(),
+                "telefono": telefono,
+                "telefono_e164": normalizar_telefono(telefono),
+                "congregacion_id": congregaciones.get((fila.get('Circuito'), fila.get('Congregacion'))),
+            }
+            if usuario_de.get(id_origen):
+                cambios.append(dict(valores, id=usuario_de[id_origen]))
+                continue
+            username = username_contacto(valores['nombre_completo'], id_origen)
+            while username in usernames:
+                username += 'x'
+            usernames.add(username)
+            altas[id_origen] = dict(valores, username=username, email=f"{username}@example.com",
+                                    role_id=None, password_hash=None)
+            if (fila.get('Contrasena') or '').strip():
+                propias.append((altas[id_origen], fila['Contrasena'].strip()))
+
+        if altas:
+            editor_id = db.session.execute(db.select(Role.id).filter_by(name='editor')).scalar_one()
+            for (usuario, _), hash_ in zip(propias, hashear_contrasenas([c for _, c in propias])):
+                usuario["password_hash"] = hash_
+            hash_por_defecto = generate_password_hash(CONTRASENA_POR_DEFECTO) if len(propias) < len(altas) else None
+            for usuario in altas.values():
+                usuario.update(role_id=editor_id, password_hash=usuario["password_hash"] or hash_por_defecto)
+            for lote in _en_lotes(altas.values()):
+                db.session.execute(insert(User), lote)
+            for lote in _en_lotes(altas):
+                ids = dict(db.session.execute(db.select(User.username, User.id).where(
+                    User.username.in_([altas[id_origen]["username"] for id_origen in lote]))).all())
+                usuario_de.update({id_origen: ids[altas[id_origen]["username"]] for id_origen in lote})
+        for lote in _en_lotes(cambios):
+            db.session.execute(update(User), lote)
+
+        # Huellas: se actualizan las ya sincronizadas y se insertan las nuevas
+        ahora = datetime.utcnow()
+        huellas_cambiadas = [{"id_origen": id_origen, "hash": huellas[id_origen], "usuario_id": usuario_de[id_origen],
+                              "sincronizado_en": ahora} for id_origen in cambiadas]
+        for lote in _en_lotes(h for h in huellas_cambiadas if h["id_origen"] in sincronizados):
+            db.session.execute(update(ContactoSincronizado), lote)
+        for lote in _en_lotes(h for h in huellas_cambiadas if h["id_origen"] not in sincronizados):
+            db.session.execute(insert(ContactoSincronizado), lote)
+
+        if bajas:
+            usuarios_baja = {sincronizados[id_origen][1] for id_origen in bajas} - {None}
+            borrar = sorted(usuarios_baja - _usuarios_con_historial(usuarios_baja))
+            for lote in _en_lotes(bajas):
+                db.session.execute(delete(ContactoSincronizado).where(ContactoSincronizado.id_origen.in_(lote)))
+            for lote in _en_lotes(borrar):
+                db.session.execute(delete(user_privilegios).where(user_privilegios.c.user_id.in_(lote)))
+                db.session.execute(delete(User).where(User.id.in_(lote)))
+            resultado.update(eliminados=len(borrar), conservados=len(usuarios_baja) - len(borrar))
+        db.session.commit()
+        resultado.update(creados=len(altas), actualizados=len(cambios))
+
+    segundos = time.perf_counter() - inicio
+    resultado.update(segundos=round(segundos, 3),
+                     filas_por_segundo=round(len(filas) / segundos) if segundos else len(filas))
+    return resultado
+
+
+# --- Planillas subidas en /admin/upload (CSV o Excel) ---
+
+# Campos de User/Congregacion que se importan y encabezados que se reconocen para cada uno
+COLUMNAS_PLANILLA = {
+    'nombre_completo': ['nombre', 'nombres', 'nombre completo', 'publicador'],
+    'telefono': ['telefono', 'celular', 'movil', 'whatsapp'],
+    'email': ['correo', 'correo electronico', 'e-mail'],
+    'congregacion': ['congregacion'],
+    'circuito': ['circuito', 'cirtuito'],
+    'fecha_nacimiento': ['fecha de nacimiento', 'nacimiento'],
+    'fecha_bautismo': ['fecha de bautismo', 'bautismo'],
+}
+FORMATOS_FECHA = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d %H:%M:%S']
+
+
+def _clave(texto):
+    """Texto comparable: sin tildes, en minúsculas y con los espacios normalizados."""
+    texto = unicodedata.normalize('NFD', str(texto or ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower().replace('_', ' ')
+    return ' '.join(texto.split())
+
+
+def mapear_columnas(encabezados, mapeo=None):
+    """
+    {campo: encabezado del archivo}. `mapeo` fija a mano el encabezado de algunos
+    campos; el resto se reconoce por COLUMNAS_PLANILLA. Lanza ValueError si falta
+    la columna del nombre o una columna indicada a mano no está en el archivo.
+    """
+    por_clave = {_clave(e): e for e in encabezados if e}
+    columnas = {}
+    for campo, alias in COLUMNAS_PLANILLA.items():
+        elegido = (mapeo or {}).get(campo)
+        if elegido:
+            if elegido not in encabezados:
+                raise ValueError(f"La columna '{elegido}' no está en el archivo.")
+            columnas[campo] = elegido
+            continue
+        for nombre in [_clave(campo)] + alias:
+            if nombre in por_clave:
+                columnas[campo] = por_clave[nombre]
+                break
+    if 'nombre_completo' not in columnas:
+        raise ValueError("No se encontró la columna del nombre; indícala en el mapeo de columnas.")
+    return columnas
+
+
+def _codificacion(ruta):
+    """'utf-8-sig' si todo el archivo es UTF-8 válido, si no 'latin-1' (se lee por bloques)."""
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(ruta, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE_LECTURA), b''):
+                decodificador.decode(bloque)
+            decodificador.decode(b'', final=True)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def leer_planilla(ruta):
+    """
+    Filas de un CSV o de la hoja activa de un .xlsx, en lotes de TAMANO_LOTE pares
+    (número de fila en el archivo, {encabezado: valor}). Nunca se carga el archivo
+    entero: el CSV se lee con pandas por trozos y el Excel con openpyxl en modo
+    de sólo lectura.
+    """
+    if ruta.lower().endswith('.csv'):
+        import pandas as pd
+        codificacion = _codificacion(ruta)
+        with open(ruta, encoding=codificacion, newline='') as archivo:
+            muestra = archivo.read(4096)
+        try:
+            separador = csv.Sniffer().sniff(muestra, delimiters=';,\t').delimiter
+        except csv.Error:
+            separador = ';'
+        trozos = pd.read_csv(ruta, sep=separador, encoding=codificacion, dtype=str,
+                             keep_default_na=False, chunksize=TAMANO_LOTE)
+        for trozo in trozos:
+            # Fila 1: encabezados
+            yield [(int(i) + 2, fila) for i, fila in zip(trozo.index, trozo.to_dict('records'))]
+        return
+
+    from openpyxl import load_workbook
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezados = [str(c).strip() if c is not None else '' for c in next(filas, ())]
+        lote = []
+        for numero, valores in enumerate(filas, 2):
+            if all(v is None or str(v).strip() == '' for v in valores):
+                continue
+            lote.append((numero, dict(zip(encabezados, valores))))
+            if len(lote) == TAMANO_LOTE:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    finally:
+        libro.close()
+
+
+def _texto(valor):
+    """Celda como texto; los números enteros que Excel guarda como float pierden el '.0'."""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _email(texto):
+    """Correo comparable: sin espacios alrededor y en minúsculas."""
+    return texto.strip().lower()[:120]
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(str(valor).strip(), formato).date()
+        except ValueError:
+            pass
+    raise ValueError("fecha no reconocida (usa AAAA-MM-DD o DD/MM/AAAA)")
+
+
+class ImportacionContactos:
+    """
+    Upsert de publicadores por lotes. Un usuario existente se reconoce por su
+    teléfono E.164 (o, sin teléfono, por su nombre sin tildes ni mayúsculas si es
+    único) y se actualiza con las celdas no vacías; si no existe, se crea con el rol
+    editor y la contraseña por defecto. Los índices de usuarios, correos y
+    congregaciones se cargan una vez y se mantienen al día entre lotes, así que cada
+    lote cuesta un UPDATE por lotes, un INSERT de varias filas y un commit.
+    Las filas con errores no se importan: se pasan a `al_error(fila, campo, valor, mensaje)`.
+    """
+
+    def __init__(self, al_error=None):
+        self.al_error = al_error
+        self.por_telefono, self.por_nombre, self.por_email = {}, {}, {}
+        for id_, nombre, e164, email in db.session.execute(
+                db.select(User.id, User.nombre_completo, User.telefono_e164, User.email)):
+            self._indexar(id_, nombre, e164, email)
+        self.usernames = set(db.session.execute(db.select(User.username)).scalars())
+        self.congregaciones = _mapa_congregaciones()
+        self.editor_id = db.session.execute(db.select(Role.id).filter_by(name='editor')).scalar_one()
+        self.hash_por_defecto = None
+        self.filas = self.creados = self.actualizados = self.errores = 0
+
+    def _indexar(self, id_, nombre, e164, email):
+        if e164:
+            self.por_telefono.setdefault(e164, id_)
+        clave = _clave(nombre)
+        # Un nombre repetido deja de servir para reconocer a nadie
+        self.por_nombre[clave] = id_ if self.por_nombre.get(clave, id_) == id_ else None
+        if email:
+            self.por_email[_email(email)] = id_
+
+    def _error(self, numero, campo, valor, mensaje):
+        self.errores += 1
+        if self.al_error:
+            self.al_error(numero, campo, '' if valor is None else str(valor), mensaje)
+
+    def _clave_congregacion(self, nombre, circuito):
+        """(circuito, nombre) de la congregación de la fila, exista ya o haya que crearla."""
+        if (circuito, nombre) in self.congregaciones:
+            return circuito, nombre
+        if not circuito:
+            candidatas = [c for c in self.congregaciones if _clave(c[1]) == _clave(nombre)]
+            if len(candidatas) == 1:
+                return candidatas[0]
+            raise ValueError("falta el circuito para identificar o crear la congregación")
+        return circuito, nombre
+
+    def _congregacion(self, circuito, nombre):
+        """Id de la congregación; sólo se inserta al aplicar una fila aceptada."""
+        if (circuito, nombre) not in self.congregaciones:
+            self.congregaciones[(circuito, nombre)] = db.session.execute(
+                insert(Congregacion).values(nombre=nombre, circuito=circuito)).inserted_primary_key[0]
+        return self.congregaciones[(circuito, nombre)]
+
+    def _validar(self, numero, fila, columnas):
+        """
+        Valores de User de la fila (sólo las celdas con datos), o None si tiene errores.
+        La congregación va como clave (circuito, nombre) en 'congregacion': validar no
+        escribe nada en la base de datos.
+        """
+        celdas = {}
+        for campo, encabezado in columnas.items():
+            valor = fila.get(encabezado)
+            if valor is not None and _texto(valor) != '':
+                # Las fechas de Excel se quedan como vienen; todo lo demás se pasa a texto
+                es_fecha = campo.startswith('fecha_') and isinstance(valor, (date, datetime))
+                celdas[campo] = valor if es_fecha else _texto(valor)
+        valores = {}
+        if not celdas.get('nombre_completo'):
+            self._error(numero, 'nombre_completo', None, "falta el nombre")
+            return None
+        valores['nombre_completo'] = celdas['nombre_completo'][:150]
+        try:
+            if 'telefono' in celdas:
+                telefono = celdas['telefono']
+                campo = 'telefono'
+                valores['telefono_e164'] = normalizar_telefono(telefono)
+                if valores['telefono_e164'] is None:
+                    raise ValueError("teléfono no válido")
+                valores['telefono'] = telefono[:50]
+            if 'email' in celdas:
+                campo = 'email'
+                valores['email'] = _email(celdas['email'])
+                if '@' not in valores['email']:
+                    raise ValueError("correo no válido")
+            for campo in ('fecha_nacimiento', 'fecha_bautismo'):
+                if campo in celdas:
+                    valores[campo] = _fecha(celdas[campo])
+            if 'congregacion' in celdas:
+                campo = 'congregacion'
+                valores['congregacion'] = self._clave_congregacion(celdas['congregacion'], celdas.get('circuito'))
+        except ValueError as e:
+            self._error(numero, campo, celdas.get(campo), str(e))
+            return None
+        return valores
+
+    def _nuevo(self, valores, numero):
+        username = username_contacto(valores['nombre_completo'], numero)
+        while username in self.usernames:
+            username += 'x'
+        self.usernames.add(username)
+        if self.hash_por_defecto is None:
+            self.hash_por_defecto = generate_password_hash(CONTRASENA_POR_DEFECTO)
+        nuevo = {campo: None for campo in ('telefono', 'telefono_e164', 'fecha_nacimiento', 'fecha_bautismo', 'congregacion_id')}
+        nuevo.update(username=username, email=f"{username}@example.com", role_id=self.editor_id,
+                     password_hash=self.hash_por_defecto)
+        return nuevo
+
+    def procesar(self, lote, columnas):
+        """Aplica un lote de (número de fila, fila) y confirma la transacción."""
+        cambios, nuevos, pendientes = {}, [], {}
+        for numero, fila in lote:
+            self.filas += 1
+            valores = self._validar(numero, fila, columnas)
+            if valores is None:
+                continue
+            e164, nombre = valores.get('telefono_e164'), _clave(valores['nombre_completo'])
+            # Con teléfono sólo cuenta el teléfono: dos homónimos con números distintos son dos personas
+            id_ = self.por_telefono.get(e164) if e164 else self.por_nombre.get(nombre)
+            # La misma persona repetida en el lote se fusiona en una sola alta
+            destino = None if id_ else pendientes.get(e164 or nombre)
+            # El dueño de un correo es el id del usuario o, si aún no se ha insertado, su username
+            persona = id_ or (destino['username'] if destino else None)
+            email = valores.get('email')
+            if email and email in self.por_email and self.por_email[email] != persona:
+                self._error(numero, 'email', email, "el correo ya pertenece a otro usuario")
+                continue
+            congregacion = valores.pop('congregacion', None)
+            if congregacion:
+                valores['congregacion_id'] = self._congregacion(*congregacion)
+            if id_:
+                cambios.setdefault(id_, {"id": id_}).update(valores)
+            else:
+                if destino is None:
+                    destino = self._nuevo(valores, numero)
+                    nuevos.append(destino)
+                destino.update(valores)
+                persona = destino['username']
+                pendientes.update({clave: destino for clave in (e164, nombre) if clave})
+            if email:
+                self.por_email[email] = persona
+
+        # El UPDATE por clave primaria agrupa las filas con las mismas columnas
+        if cambios:
+            db.session.execute(update(User), list(cambios.values()))
+        if nuevos:
+            db.session.execute(insert(User), nuevos)
+            creados = dict(db.session.execute(
+                db.select(User.username, User.id).where(User.username.in_([n['username'] for n in nuevos]))).all())
+            for nuevo in nuevos:
+                self._indexar(creados[nuevo['username']], nuevo['nombre_completo'], nuevo['telefono_e164'], nuevo['email'])
+        for id_, valores in cambios.items():
+            self._indexar(id_, valores['nombre_completo'], valores.get('telefono_e164'), valores.get('email'))
+        db.session.commit()
+        self.actualizados += len(cambios)
+        self.creados += len(nuevos)
+
+
+def _guardar_estado(ruta, estado):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(estado, archivo)
+    os.replace(temporal, ruta)
+
+
+def leer_estado_importacion(directorio, importacion_id):
+    """Progreso de una importación de planilla, o None si no existe."""
+    ruta = os.path.join(directorio, f"{importacion_id}.json")
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def ruta_informe_errores(directorio, importacion_id):
+    return os.path.join(directorio, f"{importacion_id}_errores.csv")
+
+
+def importar_planilla(ruta, directorio, importacion_id, mapeo=None):
+    """
+    Importa una planilla lote a lote, dejando el progreso en <directorio>/<id>.json
+    y las filas rechazadas en <id>_errores.csv a medida que aparecen (la memoria no
+    crece con el tamaño del archivo). Necesita un contexto de aplicación.
+    """
+    ruta_estado = os.path.join(directorio, f"{importacion_id}.json")
+    estado = leer_estado_importacion(directorio, importacion_id) or {"id": importacion_id}
+    inicio = time.perf_counter()
+    # La planilla subida se borra pase lo que pase, también si no se pudo abrir el informe
+    try:
+        with open(ruta_informe_errores(directorio, importacion_id), 'w', encoding='utf-8-sig', newline='') as informe:
+            escritor = csv.writer(informe, delimiter=';')
+            escritor.writerow(['fila', 'campo', 'valor', 'error'])
+            importacion = ImportacionContactos(al_error=lambda *error: escritor.writerow(error))
+            columnas = None
+            with invalidacion_diferida(db.session()):
+                for lote in leer_planilla(ruta):
+                    if columnas is None:
+                        columnas = mapear_columnas(list(lote[0][1].keys()), mapeo)
+                        estado["columnas"] = columnas
+                    importacion.procesar(lote, columnas)
+                    informe.flush()
+                    segundos = time.perf_counter() - inicio
+                    estado.update(filas=importacion.filas, creados=importacion.creados, actualizados=importacion.actualizados,
+                                  errores=importacion.errores, segundos=round(segundos, 1),
+                                  filas_por_segundo=round(importacion.filas / segundos) if segundos else importacion.filas)
+                    _guardar_estado(ruta_estado, estado)
+        estado["estado"] = "completado"
+    except Exception as e:
+        db.session.rollback()
+        estado.update(estado="error", mensaje=str(e))
+    finally:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    _guardar_estado(ruta_estado, estado)
+    print(f"📥 Importación {importacion_id}: {estado.get('estado')} - {estado.get('filas', 0)} filas, "
+          f"{estado.get('creados', 0)} creados, {estado.get('actualizados', 0)} actualizados, {estado.get('errores', 0)} errores.")
+    return estado
+
+
+def iniciar_importacion_planilla(app, archivo, directorio, mapeo=None):
+    """
+    Guarda la planilla subida y la importa en un hilo aparte, para que la petición
+    responda enseguida aunque el archivo sea grande. Devuelve el id de la importación.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    importacion_id = uuid.uuid4().hex
+    extension = os.path.splitext(archivo.filename or '')[1].lower()
+    ruta = os.path.join(directorio, f"{importacion_id}{extension}")
+    archivo.save(ruta)
+    _guardar_estado(os.path.join(directorio, f"{importacion_id}.json"), {
+        "id": importacion_id, "archivo": archivo.filename, "estado": "procesando",
+        "creado_en": datetime.now().isoformat(timespec='seconds'),
+        "filas": 0, "creados": 0, "actualizados": 0, "errores": 0})
+
+    def trabajar():
+        with app.app_context():
+            try:
+                importar_planilla(ruta, directorio, importacion_id, mapeo)
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=trabajar, name=f"importacion-{importacion_id[:8]}", daemon=True).start()
+    return importacion_id
+
+
+# --- Bases de datos de Access (.accdb / .mdb) ---
+
+def _lector_access():
+    """
+    'mdbtools' si están instalados los comandos mdb-tables y mdb-export (leen la
+    tabla en streaming), si no 'access_parser' si está instalado el paquete.
+    Ninguno necesita Windows ni un driver ODBC. Lanza RuntimeError si no hay ninguno.
+    """
+    if shutil.which('mdb-tables') and shutil.which('mdb-export'):
+        return 'mdbtools'
+    try:
+        import access_parser  # noqa: F401
+        return 'access_parser'
+    except ImportError:
+        raise RuntimeError("Para leer bases de datos de Access instala mdbtools "
+                           "(apt install mdbtools) o el paquete access-parser (pip install access-parser).")
+
+
+def tablas_access(ruta):
+    """Nombres de las tablas de usuario (sin las MSys* del sistema) de una base de Access."""
+    if _lector_access() == 'mdbtools':
+        salida = subprocess.run(['mdb-tables', '-1', ruta], capture_output=True, text=True, check=True).stdout
+        tablas = salida.splitlines()
+    else:
+        from access_parser import AccessParser
+        tablas = list(AccessParser(ruta).catalog)
+    return [t for t in tablas if t.strip() and not t.startswith(('MSys', 'f_', '~'))]
+
+
+def _exportar_access(ruta, tabla):
+    return subprocess.Popen(['mdb-export', '-D', '%Y-%m-%d', ruta, tabla], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+
+
+def columnas_tabla_access(ruta, tabla):
+    """Encabezados de una tabla de Access, sin leer sus filas (con mdbtools)."""
+    if _lector_access() == 'mdbtools':
+        proceso = _exportar_access(ruta, tabla)
+        try:
+            return next(csv.reader(proceso.stdout), [])
+        finally:
+            proceso.kill()
+            proceso.stdout.close()
+            proceso.stderr.close()
+            proceso.wait()
+    from access_parser import AccessParser
+    return list(AccessParser(ruta).parse_table(tabla))
+
+
+def leer_tabla_access(ruta, tabla):
+    """
+    Filas de una tabla de Access en lotes de TAMANO_LOTE pares (número de fila,
+    {columna: valor}), como leer_planilla(). Con mdbtools la salida de mdb-export
+    se procesa mientras se genera; access-parser sólo sabe leer la tabla entera.
+    """
+    lote = []
+    if _lector_access() == 'mdbtools':
+        proceso = _exportar_access(ruta, tabla)
+        completa = False
+        try:
+            for numero, fila in enumerate(csv.DictReader(proceso.stdout), 1):
+                lote.append((numero, fila))
+                if len(lote) == TAMANO_LOTE:
+                    yield lote
+                    lote = []
+            completa = True
+        finally:
+            # Si se deja de leer a medias, mdb-export no debe quedarse esperando
+            if not completa:
+                proceso.kill()
+            proceso.stdout.close()
+            error = proceso.stderr.read()
+            proceso.stderr.close()
+            if proceso.wait() != 0 and completa:
+                raise RuntimeError(f"mdb-export no pudo leer la tabla '{tabla}': {error.strip()}")
+    else:
+        from access_parser import AccessParser
+        columnas = AccessParser(ruta).parse_table(tabla)
+        nombres = list(columnas)
+        for numero, valores in enumerate(zip(*(columnas[n] for n in nombres)), 1):
+            lote.append((numero, dict(zip(nombres, valores))))
+            if len(lote) == TAMANO_LOTE:
+                yield lote
+                lote = []
+    if lote:
+        yield lote
+
+
+def importar_access(ruta, tablas=None, mapeo=None, al_error=None):
+    """
+    Importa de una pasada las tablas de una base de Access (todas las que tengan
+    columna de nombre, o sólo `tablas`) con el upsert de ImportacionContactos, lote
+    a lote y con el motor de búsqueda invalidado una sola vez al final.
+    Las columnas de todas las tablas se comprueban antes de escribir nada: con
+    `tablas`, una sin columna de nombre lanza ValueError; sin `tablas`, se omite.
+    Si una tabla falla a mitad, se detiene la importación y `parcial` dice qué
+    tabla quedó a medias y cuántas de sus filas llegaron a confirmarse.
+    `al_error(tabla, fila, campo, valor, mensaje)` recibe las filas rechazadas.
+    Devuelve {"tablas", "omitidas", "parcial", "error", "filas", "creados",
+    "actualizados", "errores", "segundos", "filas_por_segundo"}.
+    Necesita un contexto de aplicación.
+    """
+    inicio = time.perf_counter()
+    columnas_de, omitidas = {}, []
+    for tabla in tablas or tablas_access(ruta):
+        try:
+            columnas_de[tabla] = mapear_columnas(columnas_tabla_access(ruta, tabla), mapeo)
+        except ValueError as e:
+            if tablas:
+                raise ValueError(f"Tabla '{tabla}': {e}")
+            # Sin columna de nombre no es una tabla de publicadores
+            print(f"-> ⏭️  Tabla '{tabla}' omitida: {e}")
+            omitidas.append(tabla)
+
+    importadas, parcial, error = [], None, None
+    importacion = ImportacionContactos()
+    with invalidacion_diferida(db.session()):
+        for tabla, columnas in columnas_de.items():
+            importacion.al_error = (lambda *fallo, tabla=tabla: al_error(tabla, *fallo)) if al_error else None
+            confirmadas = 0
+            try:
+                for lote in leer_tabla_access(ruta, tabla):
+                    importacion.procesar(lote, columnas)
+                    confirmadas += len(lote)
+            except Exception as e:
+                db.session.rollback()
+                parcial, error = {"tabla": tabla, "filas": confirmadas}, str(e)
+                break
+            importadas.append(tabla)
+    segundos = time.perf_counter() - inicio
+    return {
+        "tablas": importadas,
+        "omitidas": omitidas,
+        "parcial": parcial,
+        "error": error,
+        "filas": importacion.filas,
+        "creados": importacion.creados,
+        "actualizados": importacion.actualizados,
+        "errores": importacion.errores,
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(importacion.filas / segundos) if segundos else importacion.filas,
+    }
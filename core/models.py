@@ -2,7 +2,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import validates
 from datetime import datetime
+from core.telefonos import normalizar_telefono
 
 db = SQLAlchemy()
 
@@ -16,6 +18,8 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre_completo = db.Column(db.String(150), nullable=False)
     telefono = db.Column(db.String(50), nullable=True)
+    # El teléfono en E.164 ('+584141234567'), calculado una vez al asignar `telefono`
+    telefono_e164 = db.Column(db.String(16), nullable=True, index=True)
     fecha_nacimiento = db.Column(db.Date, nullable=True)
     fecha_bautismo = db.Column(db.Date, nullable=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -25,6 +29,11 @@ class User(UserMixin, db.Model):
     congregacion_id = db.Column(db.Integer, db.ForeignKey('congregaciones.id'))
     privilegios = db.relationship('Privilegio', secondary=user_privilegios, backref=db.backref('users', lazy=True))
 
+    @validates('telefono')
+    def _normalizar_telefono(self, key, telefono):
+        self.telefono_e164 = normalizar_telefono(telefono)
+        return telefono
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -87,4 +96,87 @@ class AsignacionVisita(db.Model):
     
     # Relación con el publicador asignado
     publicador_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    publicador = db.relationship('User', backref='visitas_asignadas')
\ No newline at end of file
+    publicador = db.relationship('User', backref='visitas_asignadas')
+
+    # Notificación por WhatsApp: se encola en la misma transacción que la asignación
+    mensaje_id = db.Column(db.Integer, db.ForeignKey('mensajes_salientes.id'), nullable=True, index=True)
+    mensaje = db.relationship('MensajeSaliente')
+    notificacion = db.Column(db.String(20), nullable=False, default='en_cola') # en_cola -> enviado | fallido; sin_telefono si no hubo a quién enviar
+    notificada_en = db.Column(db.DateTime, nullable=True)
+
+# --- Cola persistente de mensajes de WhatsApp (la atiende trabajador_envios.py) ---
+
+class TrabajoEnvio(db.Model):
+    __tablename__ = 'trabajos_envio'
+
+    id = db.Column(db.Integer, primary_key=True)
+    mensaje = db.Column(db.Text, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='en_cola', index=True) # en_cola -> enviando -> completado
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finalizado_en = db.Column(db.DateTime, nullable=True)
+    creado_por_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    mensajes = db.relationship('MensajeSaliente', backref='trabajo', lazy=True, order_by='MensajeSaliente.id')
+
+class MensajeSaliente(db.Model):
+    __tablename__ = 'mensajes_salientes'
+    __table_args__ = (db.Index('ix_mensajes_salientes_cola', 'estado', 'trabajo_id', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    trabajo_id = db.Column(db.Integer, db.ForeignKey('trabajos_envio.id'), nullable=False, index=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    nombre = db.Column(db.String(150), nullable=True)
+    telefono = db.Column(db.String(50), nullable=False)
+    texto = db.Column(db.Text, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='en_cola') # en_cola -> enviando -> enviado | fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    reintentar_en = db.Column(db.DateTime, nullable=True) # Tras un fallo de la sesión, no se reclama antes de esta hora
+    error = db.Column(db.String(255), nullable=True)
+    actualizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    enviado_en = db.Column(db.DateTime, nullable=True)
+    # Confirmación leída de los ticks de WhatsApp Web: pendiente | enviado | entregado | leido
+    entrega = db.Column(db.String(20), nullable=True)
+    duracion_ms = db.Column(db.Integer, nullable=True) # Lo que tardó el envío completo
+    confirmacion_ms = db.Column(db.Integer, nullable=True) # Del Enter al primer tick
+    captura = db.Column(db.String(255), nullable=True) # Captura de pantalla si falló
+
+# --- Control del navegador de WhatsApp: lo pide el web y lo ejecuta el trabajador (core/control_whatsapp.py) ---
+
+class SolicitudWhatsApp(db.Model):
+    __tablename__ = 'solicitudes_whatsapp'
+
+    id = db.Column(db.Integer, primary_key=True)
+    accion = db.Column(db.String(20), nullable=False) # conectar | cerrar | aplicar_perfil
+    estado = db.Column(db.String(20), nullable=False, default='pendiente', index=True) # pendiente -> atendiendo -> atendida | fallida; caducada si nadie la tomó a tiempo
+    archivo = db.Column(db.String(500), nullable=True) # ZIP del snapshot que aplica aplicar_perfil
+    resultado = db.Column(db.Text, nullable=True) # Respuesta del trabajador en JSON
+    creada_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    atendida_en = db.Column(db.DateTime, nullable=True)
+
+class EstadoWhatsApp(db.Model):
+    __tablename__ = 'estado_whatsapp'
+
+    id = db.Column(db.Integer, primary_key=True) # Una sola fila, id = 1
+    estado = db.Column(db.String(20), nullable=False, default='desconocido') # desconocido | esperando_qr | conectado
+    qr = db.Column(db.Text, nullable=True) # PNG en base64 mientras se espera el escaneo
+    navegador_abierto = db.Column(db.Boolean, nullable=False, default=False)
+    lanzamientos = db.Column(db.Integer, nullable=False, default=0)
+    actualizado_en = db.Column(db.DateTime, nullable=True) # Cuándo se vio el estado en la página
+    latido = db.Column(db.DateTime, nullable=True) # Última señal de vida del trabajador
+
+# --- Sincronización incremental de contactos.csv (core/importacion.py) ---
+
+class ContactoSincronizado(db.Model):
+    __tablename__ = 'contactos_sincronizados'
+
+    id_origen = db.Column(db.String(64), primary_key=True) # Columna Id de contactos.csv
+    hash = db.Column(db.String(64), nullable=False) # SHA-256 de los campos sincronizados de la fila
+    usuario_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    sincronizado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# --- Generación de los contactos compartida entre procesos (core/motor_busqueda.py) ---
+
+class GeneracionBusqueda(db.Model):
+    __tablename__ = 'generacion_busqueda'
+
+    id = db.Column(db.Integer, primary_key=True) # Una sola fila, id = 1
+    generacion = db.Column(db.Integer, nullable=False, default=0) # Avanza con cada commit que cambia los contactos
@@ -1,8 +1,41 @@
+import os
 import re
-from core.models import db, User, Congregacion, Territorio
-from sqlalchemy import or_, select
-from fuzzywuzzy import process
+import json
+import base64
+import sys
+import mmap
+import zlib
+import hashlib
+import time
+import struct
+import threading
+import weakref
+import click
+from array import array
+from bisect import bisect_left, bisect_right
+from core.cache_busqueda import CacheBusqueda, CacheMemoria, crear_cache
+from core.busqueda_sql import BackendILike, backend_para
+from core.models import db, User, Congregacion, Territorio, Privilegio, GeneracionBusqueda, user_privilegios
+from sqlalchemy import and_, or_, select, update, insert, event
+from sqlalchemy.orm import Session
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Levenshtein
+from fuzzywuzzy import fuzz as fuzzywuzzy_fuzz
 from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Tamaño de página de /api/buscar y tope que acepta el servidor
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+# Tablas cuyo contenido alimenta el índice de contactos
+TABLAS_INDEXADAS = {'users', 'congregaciones', 'territorios', 'user_privilegios', 'privilegios'}
+MODELOS_INDEXADOS = (User, Congregacion, Territorio, Privilegio)
+
+# Edad máxima del índice (segundos) aunque la generación no cambie: cubre los cambios
+# hechos fuera de la sesión del ORM (SQL a mano, restauraciones). 0 la desactiva.
+TTL_INDICE_POR_DEFECTO = 3600
 
 def soundex(token):
     token = token.lower()
@@ -21,108 +54,737 @@ def soundex(token):
         else: last_code = '0'
     return (result.replace('0', '') + '000')[:4]
 
+# fuzzywuzzy descarta los caracteres 128-255 antes de puntuar con WRatio
+_LATIN1_ALTO = dict.fromkeys(range(128, 256))
+
+def procesar_fuzzy(texto):
+    """Mismo pre-procesado que fuzzywuzzy aplica con WRatio (full_process con force_ascii)."""
+    return re.sub(r'(?ui)\W', ' ', texto.translate(_LATIN1_ALTO)).lower().strip()
+
+# El WRatio de rapidfuzz nunca queda más de un punto por debajo del de fuzzywuzzy
+# (redondeos intermedios); con este margen la poda no descarta al ganador.
+MARGEN_FUZZY = 2
+
+def mejor_coincidencia(termino, palabras, procesadas=None, corte=0):
+    """
+    Mismo resultado que fuzzywuzzy.process.extractOne(termino, palabras, score_cutoff=corte).
+    rapidfuzz puntúa todas las palabras en una sola pasada en C, y sólo las que quedan
+    cerca del mejor puntaje se vuelven a puntuar con fuzzywuzzy para decidir igual que antes.
+    Devuelve (palabra, puntaje) o None.
+    """
+    if not palabras: return None
+    if procesadas is None:
+        procesadas = [procesar_fuzzy(p) for p in palabras]
+    consulta = procesar_fuzzy(termino)
+    candidatos = process.extract(consulta, procesadas, scorer=fuzz.WRatio, processor=None,
+                                 limit=None, score_cutoff=max(corte - MARGEN_FUZZY, 0))
+    if not candidatos: return None
+    # El mejor candidato de rapidfuzz fija una cota inferior del puntaje ganador
+    cota = max(corte, fuzzywuzzy_fuzz.WRatio(consulta, procesadas[candidatos[0][2]], full_process=False))
+    mejor = None
+    for _, puntaje_aprox, i in candidatos:
+        if puntaje_aprox < cota - MARGEN_FUZZY: continue
+        puntaje = fuzzywuzzy_fuzz.WRatio(consulta, procesadas[i], full_process=False)
+        if puntaje < corte: continue
+        # Ante un empate fuzzywuzzy se queda con la primera palabra de la lista
+        if mejor is None or puntaje > mejor[1] or (puntaje == mejor[1] and i < mejor[0]):
+            mejor = (i, puntaje)
+    return (palabras[mejor[0]], mejor[1]) if mejor else None
+
+def codificar_cursor(usuario):
+    """Cursor opaco con la clave de orden (nombre, id) del último resultado entregado."""
+    clave = json.dumps([usuario["nombre"], usuario["id"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(clave.encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor):
+    """Devuelve (nombre, id) o lanza ValueError si el cursor no es válido."""
+    try:
+        nombre, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(nombre, str) or not isinstance(user_id, int):
+        raise ValueError("Cursor inválido")
+    return nombre, user_id
+
+def tokenizar(texto):
+    """Divide un texto en tokens normalizados (minúsculas, sin separadores)."""
+    if not texto: return []
+    return [p for p in re.split(r'[\s/,-]+', texto.lower()) if p]
+
+def formatear_filas(filas, privilegios):
+    """
+    Convierte la proyección plana (usuario + congregación) y los pares
+    (user_id, privilegio) en los diccionarios que devuelve la búsqueda, por id.
+    """
+    privilegios_por_usuario = defaultdict(list)
+    for user_id, nombre in privilegios:
+        privilegios_por_usuario[user_id].append(nombre)
+    return {
+        user_id: {
+            "id": user_id,
+            "nombre": nombre,
+            "telefono": telefono,
+            "circuito": circuito,
+            "congregacion": cong_nombre,
+            "privilegios": privilegios_por_usuario.get(user_id, [])
+        }
+        for user_id, nombre, telefono, cong_id, cong_nombre, circuito in filas
+    }
+
+class IndiceContactos:
+    """
+    Índice invertido en memoria: token normalizado -> ids de usuario.
+    Indexa nombre, teléfono, congregación, territorios y circuito de cada
+    usuario con congregación, y guarda el resultado ya formateado.
+    """
+    def __init__(self, filas, territorios, privilegios):
+        self.usuarios = formatear_filas(filas, privilegios)
+        self.vocabulario = set()
+        self.circuitos = {}
+        self.usuarios_por_congregacion = defaultdict(set)
+        postings = defaultdict(set)
+        for user_id, nombre, telefono, cong_id, cong_nombre, circuito in filas:
+            self.usuarios_por_congregacion[cong_id].add(user_id)
+            self.circuitos[cong_id] = (circuito or '').lower()
+            for texto in (nombre, telefono, cong_nombre, circuito):
+                for token in tokenizar(texto):
+                    postings[token].add(user_id)
+
+        # Los territorios pertenecen a la congregación: apuntan a todos sus usuarios
+        for cong_id, nombre in territorios:
+            tokens = tokenizar(nombre)
+            self.vocabulario.update(tokens)
+            ids = self.usuarios_por_congregacion.get(cong_id)
+            if not ids: continue
+            for token in tokens:
+                postings[token].update(ids)
+
+        self.vocabulario.update(postings)
+        self.postings = dict(postings)
+        # Sufijos ordenados de cada token: permiten buscar subcadenas con bisect
+        self.sufijos = sorted((token[i:], token) for token in self.postings for i in range(len(token)))
+        self.orden = sorted(self.usuarios, key=lambda i: (self.usuarios[i]["nombre"], i))
+
+    def ids_por_subcadena(self, termino):
+        """Ids de los usuarios con algún token que contiene `termino`."""
+        ids = set()
+        i = bisect_left(self.sufijos, (termino,))
+        while i < len(self.sufijos) and self.sufijos[i][0].startswith(termino):
+            ids |= self.postings[self.sufijos[i][1]]
+            i += 1
+        return ids
+
+    def ids_por_circuito(self, termino):
+        ids = set()
+        for cong_id, circuito in self.circuitos.items():
+            if termino in circuito:
+                ids |= self.usuarios_por_congregacion[cong_id]
+        return ids
+
+    def buscar(self, terminos_numericos, terminos_texto):
+        """Intersección de los filtros de una sub-consulta (igual que los AND del SQL)."""
+        ids = None
+        for t in terminos_numericos:
+            encontrados = self.ids_por_circuito(t)
+            ids = encontrados if ids is None else ids & encontrados
+            if not ids: return set()
+        for t in terminos_texto:
+            encontrados = self.ids_por_subcadena(t)
+            ids = encontrados if ids is None else ids & encontrados
+            if not ids: return set()
+        return set(self.usuarios) if ids is None else ids
+
+    def formatear(self, ids):
+        return [self.usuarios[i] for i in sorted(ids, key=lambda i: (self.usuarios[i]["nombre"], i))]
+
+    def todos(self):
+        return [self.usuarios[i] for i in self.orden]
+
+class ArbolBK:
+    """
+    BK-tree sobre la distancia de Levenshtein: encuentra las palabras a distancia
+    <= k de un término visitando sólo las ramas que la desigualdad triangular permite.
+    Vive en arreglos planos de uint32 (nodos: offset, longitud, primera arista,
+    n aristas; aristas: distancia, hijo) más el texto UTF-8 de las palabras, así que
+    puede apuntar a un mmap: cada palabra se decodifica sólo cuando se visita.
+    Los nodos están en orden alfabético, por lo que el árbol es también una
+    secuencia ordenada de palabras en la que se puede usar bisect.
+    """
+    def __init__(self, nodos, aristas, textos):
+        self.nodos = nodos
+        self.aristas = aristas
+        self.textos = textos
+
+    @classmethod
+    def construir(cls, palabras):
+        palabras = sorted(set(palabras))
+        hijos = [dict() for _ in palabras]
+        for i in range(1, len(palabras)):
+            nodo = 0
+            while True:
+                d = Levenshtein.distance(palabras[i], palabras[nodo])
+                siguiente = hijos[nodo].get(d)
+                if siguiente is None:
+                    hijos[nodo][d] = i
+                    break
+                nodo = siguiente
+
+        nodos, aristas, textos = array('I'), array('I'), bytearray()
+        for palabra, ramas in zip(palabras, hijos):
+            codificada = palabra.encode('utf-8')
+            nodos.extend((len(textos), len(codificada), len(aristas) // 2, len(ramas)))
+            textos += codificada
+            for d in sorted(ramas):
+                aristas.extend((d, ramas[d]))
+        return cls(nodos, aristas, bytes(textos))
+
+    def __len__(self):
+        return len(self.nodos) // 4
+
+    def __getitem__(self, i):
+        offset, longitud = self.nodos[4 * i], self.nodos[4 * i + 1]
+        return bytes(self.textos[offset:offset + longitud]).decode('utf-8')
+
+    def buscar(self, termino, max_distancia):
+        """Lista ordenada de (distancia, palabra) a distancia <= max_distancia."""
+        if not len(self): return []
+        nodos, aristas, distancia = self.nodos, self.aristas, Levenshtein.distance
+        resultados = []
+        pendientes = [0]
+        while pendientes:
+            i = pendientes.pop()
+            palabra = self[i]
+            d = distancia(termino, palabra)
+            if d <= max_distancia: resultados.append((d, palabra))
+            inicio = nodos[4 * i + 2]
+            for j in range(inicio, inicio + nodos[4 * i + 3]):
+                distancia_arista = aristas[2 * j]
+                if distancia_arista > d + max_distancia: break
+                if distancia_arista >= d - max_distancia:
+                    pendientes.append(aristas[2 * j + 1])
+        return sorted(resultados)
+
+def _codigo_soundex(codigo):
+    return zlib.crc32(codigo.encode('utf-8'))
+
+class IndicesDifusos:
+    """
+    Vocabulario e índices usados para interpretar términos (abreviaturas y soundex)
+    y para buscar palabras a distancia de edición acotada (árbol BK). Se guardan juntos en un archivo que cada worker mapea con mmap sin
+    reconstruir nada: las abreviaturas salen de bisect sobre el árbol (ordenado) y
+    el soundex de un arreglo de códigos ordenados con el número de su palabra.
+
+    Formato: cabecera (con la huella SHA-256 del vocabulario), nodos y aristas del
+    árbol, códigos soundex, palabra de cada código y el texto UTF-8 de las palabras.
+    """
+    MAGICO = b'PPAMBK02'
+    CABECERA = struct.Struct('<8sIII32s')
+
+    def __init__(self, arbol_bk, codigos_soundex, palabras_soundex, huella, mapa=None):
+        self.arbol_bk = arbol_bk
+        self.codigos_soundex = codigos_soundex
+        self.palabras_soundex = palabras_soundex
+        self.huella = huella
+        self._mapa = mapa
+        self._procesadas = None
+
+    @staticmethod
+    def calcular_huella(palabras):
+        return hashlib.sha256('\n'.join(sorted(palabras)).encode('utf-8')).digest()
+
+    @classmethod
+    def construir(cls, palabras):
+        arbol = ArbolBK.construir(palabras)
+        pares = sorted((_codigo_soundex(soundex(arbol[i])), i) for i in range(len(arbol)))
+        codigos, palabras_soundex = array('I', (c for c, _ in pares)), array('I', (i for _, i in pares))
+        return cls(arbol, codigos, palabras_soundex, cls.calcular_huella(arbol[i] for i in range(len(arbol))))
+
+    def __len__(self):
+        return len(self.arbol_bk)
+
+    def abreviaturas(self, termino):
+        """Palabras que empiezan por `termino` si tiene exactamente 3 letras."""
+        if len(termino) != 3: return []
+        arbol = self.arbol_bk
+        candidatos = []
+        i = bisect_left(arbol, termino)
+        while i < len(arbol):
+            palabra = arbol[i]
+            if not palabra.startswith(termino): break
+            candidatos.append(palabra)
+            i += 1
+        return candidatos
+
+    def por_soundex(self, termino):
+        """Palabras con el mismo código soundex que `termino`."""
+        codigo = soundex(termino)
+        clave = _codigo_soundex(codigo)
+        inicio = bisect_left(self.codigos_soundex, clave)
+        fin = bisect_right(self.codigos_soundex, clave, lo=inicio)
+        candidatos = (self.arbol_bk[self.palabras_soundex[k]] for k in range(inicio, fin))
+        # Dos códigos distintos pueden compartir el CRC: se descartan las colisiones
+        return [p for p in candidatos if soundex(p) == codigo]
+
+    def corregir(self, termino):
+        """
+        Palabras del vocabulario más cercanas a `termino` por distancia de edición
+        (hasta 1 para términos cortos, 2 para el resto). Lista vacía si no hay ninguna.
+        """
+        max_distancia = 1 if len(termino) <= 4 else 2
+        cercanas = self.arbol_bk.buscar(termino, max_distancia)
+        if not cercanas: return []
+        minima = cercanas[0][0]
+        return [palabra for d, palabra in cercanas if d == minima]
+
+    def procesadas(self):
+        """
+        (palabras, palabras pre-procesadas) para puntuar el vocabulario entero en una
+        sola llamada. Se decodifican la primera vez que una consulta llega a ese paso.
+        """
+        if self._procesadas is None:
+            palabras = [self.arbol_bk[i] for i in range(len(self))]
+            self._procesadas = (palabras, [procesar_fuzzy(p) for p in palabras])
+        return self._procesadas
+
+    def guardar(self, ruta):
+        """Escribe los índices en `ruta` de forma atómica (archivo temporal + reemplazo)."""
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        arbol = self.arbol_bk
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'wb') as f:
+            f.write(self.CABECERA.pack(self.MAGICO, len(arbol), len(arbol.aristas) // 2, len(arbol.textos), self.huella))
+            for arreglo in (arbol.nodos, arbol.aristas, self.codigos_soundex, self.palabras_soundex):
+                f.write(arreglo.tobytes())
+            f.write(arbol.textos)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Abre unos índices guardados sin copiarlos a memoria: los arreglos apuntan al mmap."""
+        if sys.byteorder != 'little':
+            raise ValueError("El formato del índice difuso sólo se puede mapear en plataformas little-endian")
+        with open(ruta, 'rb') as f:
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapa) < cls.CABECERA.size or mapa[:len(cls.MAGICO)] != cls.MAGICO:
+            mapa.close()
+            raise ValueError(f"{ruta} no es un índice difuso válido (o es de un formato anterior)")
+        magico, n_nodos, n_aristas, n_textos, huella = cls.CABECERA.unpack_from(mapa)
+        vista = memoryview(mapa)
+        secciones = []
+        inicio = cls.CABECERA.size
+        for tamano in (n_nodos * 16, n_aristas * 8, n_nodos * 4, n_nodos * 4):
+            secciones.append(vista[inicio:inicio + tamano].cast('I'))
+            inicio += tamano
+        nodos, aristas, codigos, palabras_soundex = secciones
+        arbol = ArbolBK(nodos, aristas, vista[inicio:inicio + n_textos])
+        return cls(arbol, codigos, palabras_soundex, huella, mapa)
+
+# Motores vivos a los que se avisa cuando cambian los contactos
+_motores = weakref.WeakSet()
+
+@event.listens_for(Session, 'after_flush')
+def _detectar_cambios(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, MODELOS_INDEXADOS):
+            session.info['contactos_modificados'] = True
+            return
+
+@event.listens_for(Session, 'do_orm_execute')
+def _detectar_sentencias(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        tabla = getattr(orm_execute_state.statement, 'table', None)
+        if tabla is not None and tabla.name in TABLAS_INDEXADAS:
+            orm_execute_state.session.info['contactos_modificados'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_tras_commit(session):
+    """Marca los índices como obsoletos cuando se confirma un cambio en los contactos."""
+    if session.info.pop('contactos_modificados', False):
+        if 'invalidacion_diferida' in session.info:
+            session.info['invalidacion_diferida'] = True
+            return
+        _publicar_generacion(session)
+        _invalidar_motores()
+
+def _invalidar_motores():
+    for motor_activo in list(_motores):
+        motor_activo.invalidar_indice()
+
+def _publicar_generacion(session):
+    """
+    Avanza la generación compartida en la base de datos: los demás procesos (workers de
+    gunicorn, CLI, trabajador de envíos) la comparan en cada búsqueda. Se escribe en su
+    propia transacción, después del commit, para que un fallo no deshaga los datos.
+    """
+    tabla = GeneracionBusqueda.__table__
+    try:
+        with session.get_bind().begin() as conexion:
+            avance = conexion.execute(update(tabla).where(tabla.c.id == 1).values(generacion=tabla.c.generacion + 1))
+            if avance.rowcount == 0:
+                # Bases creadas con db.create_all(): la fila no existe todavía
+                conexion.execute(insert(tabla).values(id=1, generacion=1))
+    except Exception as e:
+        print(f"⚠️ No se pudo publicar la generación de búsqueda: {e}")
+
+@contextmanager
+def invalidacion_diferida(session):
+    """
+    Para importaciones que confirman por lotes: los commits del bloque no invalidan
+    los índices uno a uno (cada uno lanzaría una reconstrucción) sino una sola vez
+    al salir, si alguno cambió los contactos.
+    """
+    session.info['invalidacion_diferida'] = False
+    try:
+        yield
+    finally:
+        if session.info.pop('invalidacion_diferida', False):
+            _publicar_generacion(session)
+            _invalidar_motores()
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_tras_rollback(session):
+    session.info.pop('contactos_modificados', None)
+
 class MotorBusquedaModerno:
     def __init__(self):
-        self.vocabulario = set()
-        self.indice_abreviaturas = defaultdict(set)
-        self.indice_soundex = defaultdict(set)
+        self.indice_contactos = None
+        self.indices_difusos = IndicesDifusos.construir(())
+        self.app = None
+        self.ruta_indice_difuso = None
+        self.listo = threading.Event()
+        self.construido_en = None
+        self.ttl_indice = TTL_INDICE_POR_DEFECTO
+        self.cache = CacheBusqueda(CacheMemoria())
+        self._backend = None
+        self._generacion_indice = None
+        self._generacion_en_construccion = None
+        self._indice_vigente = False
+        self._reconstruyendo = False
+        self._reconstruccion_pendiente = False
+        self._lock_indice = threading.Lock()
+        self._aviso_generacion = False
+        self._activo = False
+        _motores.add(self)
 
     def init_app(self, app):
-        with app.app_context():
-            self._construir_indices_inteligentes()
+        """
+        Asocia el motor a la app y, en los procesos que atienden peticiones (gunicorn,
+        flask run), lanza la construcción de los índices en segundo plano. Los comandos
+        de la CLI (migraciones, seed) y el trabajador de envíos (BUSQUEDA_CALENTAR=0)
+        también crean la app y no leen los contactos salvo que lleguen a buscar.
+        """
+        self.app = app
+        app.extensions['motor_busqueda'] = self
+        self.cache = crear_cache(app.config, app.instance_path)
+        self.ruta_indice_difuso = app.config.get(
+            'BUSQUEDA_INDICE_DIFUSO', os.path.join(app.instance_path, 'indice_difuso.bk'))
+        self.ttl_indice = float(app.config.get('BUSQUEDA_INDICE_TTL', TTL_INDICE_POR_DEFECTO))
+        if self._calentar_al_iniciar(app):
+            self._activar()
+
+    @staticmethod
+    def _calentar_al_iniciar(app):
+        """False con BUSQUEDA_CALENTAR=0 o dentro de un comando de la CLI que no sea `flask run`."""
+        if str(app.config.get('BUSQUEDA_CALENTAR', os.environ.get('BUSQUEDA_CALENTAR', '1'))).lower() in ('0', 'false', 'no'):
+            return False
+        contexto = click.get_current_context(silent=True)
+        return contexto is None or contexto.info_name == 'run'
+
+    def _activar(self):
+        """Una vez por proceso: carga el índice difuso guardado y lanza la construcción."""
+        with self._lock_indice:
+            if self._activo: return
+            self._activo = True
+        # El vocabulario guardado por otro worker (o el arranque anterior) se mapea al
+        # instante; la reconstrucción en segundo plano lo refresca si cambió.
+        if os.path.exists(self.ruta_indice_difuso):
+            try:
+                self.indices_difusos = IndicesDifusos.cargar(self.ruta_indice_difuso)
+                print(f"📂 Índice difuso cargado de disco: {len(self.indices_difusos)} palabras.")
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el índice difuso guardado: {e}")
+        self._programar_reconstruccion()
+
+    def invalidar_indice(self):
+        """Un commit en este proceso cambió los contactos: vacía la caché y reconstruye el índice."""
+        try:
+            self.cache.invalidar()
+        except Exception as e:
+            print(f"⚠️ No se pudo invalidar la caché de búsqueda: {e}")
+        self._marcar_obsoleto()
 
-    def _construir_indices_inteligentes(self):
+    def _marcar_obsoleto(self):
+        self._indice_vigente = False
+        # Sólo reconstruye el proceso que ya construyó sus índices (no la CLI ni el trabajador)
+        if self.app is not None and self._activo:
+            self._programar_reconstruccion()
+
+    def _generacion_actual(self):
+        """Generación compartida de los contactos (tabla generacion_busqueda); None si no se puede leer."""
+        try:
+            generacion = db.session.execute(
+                select(GeneracionBusqueda.generacion).where(GeneracionBusqueda.id == 1)).scalar()
+        except Exception as e:
+            db.session.rollback()
+            # Sin la migración aplicada fallaría en cada búsqueda: se avisa una sola vez
+            if not self._aviso_generacion:
+                self._aviso_generacion = True
+                print(f"⚠️ No se pudo leer la generación de búsqueda: {e}")
+            return None
+        return generacion or 0
+
+    def _comprobar_generacion(self):
+        """
+        Lee la generación compartida y marca el índice obsoleto si otro proceso confirmó
+        cambios en los contactos o si superó su edad máxima. Devuelve la generación leída.
+        """
+        generacion = self._generacion_actual()
+        if generacion is not None and generacion not in (self._generacion_indice, self._generacion_en_construccion):
+            self._marcar_obsoleto()
+        elif (self.ttl_indice and self.construido_en is not None and not self._reconstruyendo
+              and datetime.now() - self.construido_en > timedelta(seconds=self.ttl_indice)):
+            self._marcar_obsoleto()
+        return generacion
+
+    def _programar_reconstruccion(self):
+        """Lanza el hilo de reconstrucción, o deja una pendiente si ya hay uno en curso."""
+        with self._lock_indice:
+            if self._reconstruyendo:
+                self._reconstruccion_pendiente = True
+                return
+            self._reconstruyendo = True
+        threading.Thread(target=self._hilo_reconstruccion, name='indice-busqueda', daemon=True).start()
+
+    def _hilo_reconstruccion(self):
+        while True:
+            with self.app.app_context():
+                self._reconstruir_indices()
+            with self._lock_indice:
+                if not self._reconstruccion_pendiente:
+                    self._reconstruyendo = False
+                    return
+                self._reconstruccion_pendiente = False
+
+    def _consultar_filas(self, ids=None, despues_de=None, limite=None):
+        """
+        Proyección plana de usuarios con congregación, ordenada por (nombre, id), y de
+        sus privilegios: siempre dos consultas, sin cargar objetos del ORM.
+        `ids` limita a esos usuarios; `despues_de` y `limite` paginan por clave.
+        """
+        consulta = (select(User.id, User.nombre_completo, User.telefono,
+                           Congregacion.id, Congregacion.nombre, Congregacion.circuito)
+                    .join(Congregacion, Congregacion.id == User.congregacion_id)
+                    .order_by(User.nombre_completo, User.id))
+        if ids is not None:
+            consulta = consulta.where(User.id.in_(ids))
+        if despues_de is not None:
+            nombre, user_id = despues_de
+            consulta = consulta.where(or_(User.nombre_completo > nombre,
+                                          and_(User.nombre_completo == nombre, User.id > user_id)))
+        if limite is not None:
+            consulta = consulta.limit(limite)
+        filas = db.session.execute(consulta).all()
+
+        consulta_privilegios = (select(user_privilegios.c.user_id, Privilegio.nombre)
+                                .join(Privilegio, Privilegio.id == user_privilegios.c.privilegio_id)
+                                .order_by(Privilegio.id))
+        if ids is not None or limite is not None:
+            if not filas: return filas, []
+            consulta_privilegios = consulta_privilegios.where(user_privilegios.c.user_id.in_([f[0] for f in filas]))
+        return filas, db.session.execute(consulta_privilegios).all()
+
+    def _construir_indice_contactos(self):
+        """Carga usuarios, territorios y privilegios en tres consultas y arma el índice."""
+        filas, privilegios = self._consultar_filas()
+        territorios = db.session.execute(select(Territorio.congregacion_id, Territorio.nombre)).all()
+        return IndiceContactos(filas, territorios, privilegios)
+
+    def _reconstruir_indices(self):
+        """Construye índices nuevos y los publica de una sola vez. Devuelve True si tuvo éxito."""
         print("🧠 Construyendo índice inteligente y fonético...")
+        inicio = time.perf_counter()
+        # La generación se lee antes que los datos: un commit posterior la hará avanzar
+        generacion = self._generacion_en_construccion = self._generacion_actual()
         try:
-            textos = (db.session.execute(select(User.nombre_completo)).scalars().all() +
-                      db.session.execute(select(User.telefono)).scalars().all() +
-                      db.session.execute(select(Congregacion.nombre)).scalars().all() +
-                      db.session.execute(select(Territorio.nombre)).scalars().all() +
-                      db.session.execute(select(Congregacion.circuito)).scalars().all())
-            
-            palabras_unicas = set()
-            for texto in textos:
-                if texto:
-                    palabras = re.split(r'[\s/,-]+', texto.lower())
-                    palabras_unicas.update(p for p in palabras if p)
-            self.vocabulario = palabras_unicas
-            
-            for palabra in self.vocabulario:
-                if len(palabra) > 2: self.indice_abreviaturas[palabra[:3]].add(palabra)
-                sx = soundex(palabra)
-                self.indice_soundex[sx].add(palabra)
-            
-            print(f"✅ Conocimiento adquirido: {len(self.vocabulario)} palabras.")
+            # Se marca vigente antes de leer: un commit concurrente lo vuelve a invalidar
+            self._indice_vigente = True
+            indice = self._construir_indice_contactos()
+            # Con el archivo al día (mismo vocabulario) no se reconstruye ni se reescribe
+            difusos = self.indices_difusos
+            if difusos.huella != IndicesDifusos.calcular_huella(indice.vocabulario):
+                difusos = IndicesDifusos.construir(indice.vocabulario)
+                self._guardar_indice_difuso(difusos)
         except Exception as e:
+            self._indice_vigente = False
             print(f"⚠️ Error al construir el índice: {e}")
+            return False
+        # Intercambio atómico: las búsquedas en curso terminan con los índices anteriores
+        self.indice_contactos, self.indices_difusos = indice, difusos
+        self._generacion_indice = generacion
+        self.construido_en = datetime.now()
+        self.listo.set()
+        duracion = (time.perf_counter() - inicio) * 1000
+        print(f"✅ Conocimiento adquirido: {len(difusos)} palabras, {len(indice.usuarios)} usuarios ({duracion:.0f} ms).")
+        return True
+
+    def _guardar_indice_difuso(self, difusos):
+        if not self.ruta_indice_difuso: return
+        try:
+            difusos.guardar(self.ruta_indice_difuso)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el índice difuso en {self.ruta_indice_difuso}: {e}")
+
+    def _obtener_indice_contactos(self, generacion=None):
+        """
+        Índice con el que atender la búsqueda; None mientras no haya uno construido o
+        mientras el que hay sea de una generación anterior (se responde desde la BD).
+        """
+        if self.app is None and not self._indice_vigente:
+            # Sin init_app (scripts, shell) se construye en línea
+            with self._lock_indice:
+                if not self._indice_vigente:
+                    self._reconstruir_indices()
+        elif self.app is not None and not self._activo:
+            # Proceso que no construyó al arrancar (CLI, shell): empieza ahora, en segundo
+            # plano, y mientras tanto responde la base de datos
+            self._activar()
+        if generacion is not None and self._generacion_indice != generacion:
+            return None
+        return self.indice_contactos
+
+    def estado(self):
+        indice = self.indice_contactos
+        return {
+            "listo": self.listo.is_set(),
+            "vigente": self._indice_vigente,
+            "reconstruyendo": self._reconstruyendo,
+            "usuarios": len(indice.usuarios) if indice else 0,
+            "palabras": len(self.indices_difusos),
+            "generacion": self._generacion_indice,
+            "construido_en": self.construido_en.isoformat() if self.construido_en else None
+        }
 
     def _interpretar_termino(self, termino):
-        if termino in self.indice_abreviaturas:
-            candidatos = list(self.indice_abreviaturas[termino])
+        indices = self.indices_difusos
+        candidatos = indices.abreviaturas(termino)
+        if candidatos:
             if len(candidatos) == 1: return candidatos[0]
-            mejor_match, _ = process.extractOne(termino, candidatos)
+            mejor_match, _ = mejor_coincidencia(termino, candidatos)
             return mejor_match
-        sx = soundex(termino)
-        if sx in self.indice_soundex:
-            candidatos = list(self.indice_soundex[sx])
-            mejor_match, _ = process.extractOne(termino, candidatos)
+        candidatos = indices.por_soundex(termino)
+        if candidatos:
+            mejor_match, _ = mejor_coincidencia(termino, candidatos)
             return mejor_match
-        if not self.vocabulario or len(termino) < 3: return termino
-        mejor_match, score = process.extractOne(termino, self.vocabulario)
-        return mejor_match if score >= 75 else termino
+        if not len(indices) or len(termino) < 3: return termino
+        # Último recurso: el vocabulario entero con corte 75, igual que extractOne. El
+        # árbol BK no lo acota: la palabra más cercana en ediciones no siempre es la de
+        # mayor WRatio.
+        resultado = mejor_coincidencia(termino, *indices.procesadas(), corte=75)
+        return resultado[0] if resultado else termino
 
-    def _ejecutar_sub_consulta(self, sub_termino):
+    def _separar_terminos(self, sub_termino):
         terminos_numericos = re.findall(r'[a-zA-Záéíóúñ]+[ -]?\d+', sub_termino)
         texto_sin_numeros = re.sub(r'[a-zA-Záéíóúñ]+[ -]?\d+', '', sub_termino).strip()
         terminos_texto_suelto = texto_sin_numeros.split() if texto_sin_numeros else []
-
         terminos_interpretados = {self._interpretar_termino(t) for t in terminos_texto_suelto}
-        
-        query = select(User).join(User.congregacion).outerjoin(Congregacion.territorios)
+        return terminos_numericos, terminos_interpretados
 
-        for t in terminos_numericos:
-            query = query.filter(Congregacion.circuito.ilike(f"%{t}%"))
-
-        for t in terminos_interpretados:
-            termino_like = f"%{t}%"
-            condicion = or_(
-                User.nombre_completo.ilike(termino_like),
-                User.telefono.ilike(termino_like),
-                Congregacion.nombre.ilike(termino_like),
-                Territorio.nombre.ilike(termino_like)
-            )
-            query = query.filter(condicion)
-            
-        return db.session.execute(query.distinct()).scalars().all()
+    def _backend_sql(self):
+        """Backend SQL del respaldo, elegido por dialecto (ILIKE si el propio no está migrado)."""
+        if self._backend is None:
+            backend = backend_para(db.engine.dialect.name)
+            try:
+                if not backend.disponible():
+                    backend = BackendILike()
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ No se pudo verificar el backend de búsqueda '{backend.nombre}': {e}")
+                backend = BackendILike()
+            print(f"🔎 Respaldo SQL de búsqueda: {backend.nombre}")
+            self._backend = backend
+        return self._backend
+
+    def _buscar_ids_en_bd(self, termino_completo):
+        """Ids que cumplen alguna de las sub-consultas separadas por comas."""
+        sub_consultas = [self._separar_terminos(s.strip()) for s in termino_completo.split(',') if s.strip()]
+        return self._backend_sql().buscar_ids(sub_consultas)
 
     def buscar_contactos(self, termino_completo):
         termino_completo = termino_completo.lower().strip()
-        
+
+        indice = self._obtener_indice_contactos(self._comprobar_generacion())
+        if indice is not None:
+            return self._buscar_en_indice(indice, termino_completo)
+
+        # Respaldo: consulta directa a la base de datos, más 2 consultas para formatear
         if not termino_completo:
-            todos_los_usuarios = db.session.execute(select(User).order_by(User.nombre_completo)).scalars().all()
-            return [self._formatear_usuario(u) for u in todos_los_usuarios]
+            return self._formatear_resultados(*self._consultar_filas())
+
+        ids = self._buscar_ids_en_bd(termino_completo)
+        if not ids: return []
+        filas, privilegios = self._consultar_filas(ids)
+        if not self._backend_sql().ordena_por_relevancia:
+            return self._formatear_resultados(filas, privilegios)
+        usuarios = formatear_filas(filas, privilegios)
+        return [usuarios[i] for i in ids if i in usuarios]
 
+    def buscar_pagina(self, termino_completo, limite=LIMITE_POR_DEFECTO, cursor=None):
+        """
+        Una página de resultados ordenada por (nombre, id) y el cursor de la siguiente
+        (None si es la última). Lanza ValueError si el cursor no es válido.
+        """
+        limite = max(1, min(int(limite), LIMITE_MAXIMO))
+        despues_de = decodificar_cursor(cursor) if cursor else None
+        termino_completo = termino_completo.lower().strip()
+
+        generacion = self._comprobar_generacion()
+        if generacion is not None:
+            # La clave lleva la generación compartida: ningún worker sirve páginas anteriores a un commit
+            clave = json.dumps([generacion, termino_completo, limite, cursor], ensure_ascii=False)
+            en_cache = self.cache.obtener(clave)
+            if en_cache is not None:
+                return en_cache[0], en_cache[1]
+
+        # Un índice de otra generación no se usa: la página sale de la BD, ya al día
+        indice = self._obtener_indice_contactos(generacion)
+        cacheable = generacion is not None
+        if indice is not None:
+            resultados = self._buscar_en_indice(indice, termino_completo)
+            inicio = 0
+            if despues_de is not None:
+                inicio = bisect_right([(u["nombre"], u["id"]) for u in resultados], despues_de)
+            pagina = resultados[inicio:inicio + limite + 1]
+        else:
+            pagina = self._buscar_pagina_en_bd(termino_completo, limite + 1, despues_de)
+
+        siguiente = codificar_cursor(pagina[limite - 1]) if len(pagina) > limite else None
+        pagina = pagina[:limite]
+        if cacheable:
+            self.cache.guardar(clave, [pagina, siguiente])
+        return pagina, siguiente
+
+    def _buscar_pagina_en_bd(self, termino_completo, limite, despues_de):
+        ids = None
+        if termino_completo:
+            # Las páginas conservan el orden (nombre, id) del cursor aunque el backend ordene por relevancia
+            ids = self._buscar_ids_en_bd(termino_completo)
+            if not ids: return []
+        filas, privilegios = self._consultar_filas(ids, despues_de=despues_de, limite=limite)
+        usuarios = formatear_filas(filas, privilegios)
+        return [usuarios[fila[0]] for fila in filas]
+
+    def _formatear_resultados(self, filas, privilegios):
+        usuarios = formatear_filas(filas, privilegios)
+        return [usuarios[i] for i in sorted(usuarios, key=lambda i: (usuarios[i]["nombre"], i))]
+
+    def _buscar_en_indice(self, indice, termino_completo):
+        if not termino_completo:
+            return indice.todos()
         sub_consultas = [s.strip() for s in termino_completo.split(',') if s.strip()]
-        resultados_totales = {}
+        ids = set()
         for sub_termino in sub_consultas:
-            resultados_parciales = self._ejecutar_sub_consulta(sub_termino)
-            for usuario in resultados_parciales:
-                resultados_totales[usuario.id] = usuario
-        
-        return [self._formatear_usuario(u) for u in resultados_totales.values()]
-
-    # En src/core/motor_busqueda.py
+            ids |= indice.buscar(*self._separar_terminos(sub_termino))
+        return indice.formatear(ids)
 
-    def _formatear_usuario(self, usuario):
-        if not usuario or not usuario.congregacion: return {}
-        return {
-            "id": usuario.id,
-            "nombre": usuario.nombre_completo,
-            "telefono": usuario.telefono,
-            "circuito": usuario.congregacion.circuito,
-            "congregacion": usuario.congregacion.nombre,
-            # --- LÍNEA AÑADIDA PARA INCLUIR PRIVILEGIOS ---
-            "privilegios": [p.nombre for p in usuario.privilegios]
-        }
     # Crea una instancia única del motor que será usada por toda la aplicación
 motor = MotorBusquedaModerno()
@@ -0,0 +1,233 @@
+# src/core/perfil_whatsapp.py
+"""
+Copias del perfil de Chromium de WhatsApp Web (snapshots) para moverlo entre
+equipos. Un snapshot es un ZIP que se genera mientras se descarga, sin archivo
+temporal, y lleva dentro su manifiesto (MANIFIESTO): tamaño, fecha y SHA-256 de
+cada archivo del perfil. Los directorios de caché, que Chromium regenera, no se
+copian.
+
+Un snapshot incremental sólo lleva los archivos que cambiaron desde otro snapshot
+(el base) y la lista de los que se borraron. Para detectarlos se compara tamaño y
+mtime con el manifiesto base y, sólo si difieren, el hash del contenido.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+
+# Manifiesto dentro del ZIP y archivo (junto al perfil) con el snapshot aplicado
+MANIFIESTO = "manifiesto_perfil.json"
+# Manifiestos de los snapshots generados, para poder pedir incrementales desde ellos
+SNAPSHOTS_DIR = os.path.abspath(os.environ.get("PERFIL_SNAPSHOTS_DIR", "perfil_snapshots"))
+MAX_SNAPSHOTS = int(os.environ.get("PERFIL_MAX_SNAPSHOTS", 10))
+# Directorios que Chromium regenera solo: no hace falta copiarlos
+DIRECTORIOS_CACHE = {
+    "Cache", "Code Cache", "GPUCache", "DawnCache", "DawnGraphiteCache", "DawnWebGPUCache",
+    "GraphiteDawnCache", "GrShaderCache", "ShaderCache", "CacheStorage", "ScriptCache",
+    "Crashpad", "component_crx_cache", "extensions_crx_cache", "optimization_guide_model_store",
+    "Safe Browsing", "BrowserMetrics",
+}
+# Archivos de bloqueo de una instancia de Chromium en marcha
+ARCHIVOS_IGNORADOS = {"SingletonLock", "SingletonSocket", "SingletonCookie", "lockfile"}
+# Bytes por lectura al calcular hashes y al escribir el ZIP
+TAMANO_BLOQUE = 1024 * 1024
+
+
+def _sha256(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _archivos_perfil(perfil_dir):
+    """(ruta relativa con '/', ruta absoluta, os.stat) de cada archivo que entra en un snapshot."""
+    for raiz, dirs, archivos in os.walk(perfil_dir):
+        dirs[:] = sorted(d for d in dirs if d not in DIRECTORIOS_CACHE)
+        for nombre in sorted(archivos):
+            ruta = os.path.join(raiz, nombre)
+            if nombre in ARCHIVOS_IGNORADOS or os.path.islink(ruta):
+                continue
+            try:
+                info = os.stat(ruta)
+            except OSError:
+                continue  # Chromium lo borró mientras se recorría el perfil
+            yield os.path.relpath(ruta, perfil_dir).replace(os.sep, '/'), ruta, info
+
+
+def cargar_manifiesto(snapshot_id):
+    """Manifiesto de un snapshot generado aquí ('ultimo' = el más reciente), o None."""
+    if not os.path.isdir(SNAPSHOTS_DIR):
+        return None
+    if snapshot_id == 'ultimo':
+        guardados = sorted(f for f in os.listdir(SNAPSHOTS_DIR) if f.endswith('.json'))
+        if not guardados:
+            return None
+        snapshot_id = guardados[-1][:-len('.json')]
+    ruta = os.path.join(SNAPSHOTS_DIR, f"{os.path.basename(str(snapshot_id))}.json")
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _guardar_manifiesto(manifiesto):
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOTS_DIR, f"{manifiesto['id']}.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f)
+    # Los ids empiezan por la fecha: ordenarlos es ordenarlos por antigüedad
+    guardados = sorted(f for f in os.listdir(SNAPSHOTS_DIR) if f.endswith('.json'))
+    for viejo in guardados[:-MAX_SNAPSHOTS]:
+        os.remove(os.path.join(SNAPSHOTS_DIR, viejo))
+
+
+def preparar_snapshot(perfil_dir, base=None):
+    """
+    Decide qué archivos van en el snapshot. Con `base` (un manifiesto) sólo los
+    nuevos o modificados; los de igual tamaño y mtime se dan por iguales sin leerlos.
+    Devuelve (manifiesto, [(ruta relativa, ruta absoluta), ...]) listo para
+    escribir_zip(); el hash de los archivos incluidos se calcula al escribirlos.
+    """
+    anteriores = base["archivos"] if base else {}
+    archivos, incluidos = {}, []
+    for rel, ruta, info in _archivos_perfil(perfil_dir):
+        entrada = {"tam": info.st_size, "mtime": info.st_mtime_ns, "sha256": None}
+        previo = anteriores.get(rel)
+        if previo and previo["tam"] == entrada["tam"] and previo["mtime"] == entrada["mtime"]:
+            entrada["sha256"] = previo["sha256"]
+        elif previo and previo["tam"] == entrada["tam"] and _sha256(ruta) == previo["sha256"]:
+            # Sólo cambió la fecha: se anota la nueva para no volver a leerlo la próxima vez
+            entrada["sha256"] = previo["sha256"]
+        else:
+            incluidos.append((rel, ruta))
+        archivos[rel] = entrada
+    manifiesto = {
+        "id": time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 1_000_000:06d}",
+        "tipo": "incremental" if base else "completo",
+        "base": base["id"] if base else None,
+        "archivos": archivos,
+        "eliminados": sorted(set(anteriores) - set(archivos)),
+    }
+    return manifiesto, incluidos
+
+
+class _SalidaZip:
+    """Destino no buscable para ZipFile: acumula lo escrito hasta que se recoge."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def recoger(self):
+        datos, self.partes = b''.join(self.partes), []
+        return datos
+
+
+def escribir_zip(manifiesto, incluidos):
+    """
+    Generador con los bytes del ZIP del snapshot, para enviarlo en streaming: en
+    memoria sólo hay un bloque a la vez. El manifiesto va al final, con los hashes
+    calculados mientras se comprimía. Si la descarga se completa, se guarda el
+    manifiesto para poder pedir incrementales a partir de este snapshot.
+    """
+    salida = _SalidaZip()
+    # Compresión rápida: el perfil son sobre todo bases de datos que ya comprimen poco
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+        for rel, ruta in incluidos:
+            try:
+                info = zipfile.ZipInfo.from_file(ruta, rel, strict_timestamps=False)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                h = hashlib.sha256()
+                with open(ruta, 'rb') as origen, zipf.open(info, 'w') as destino:
+                    for bloque in iter(lambda: origen.read(TAMANO_BLOQUE), b''):
+                        h.update(bloque)
+                        destino.write(bloque)
+                        if salida.partes:
+                            yield salida.recoger()
+            except FileNotFoundError:
+                # Chromium lo borró entre el recorrido y la compresión
+                manifiesto["archivos"].pop(rel, None)
+                continue
+            manifiesto["archivos"][rel]["sha256"] = h.hexdigest()
+        zipf.writestr(MANIFIESTO, json.dumps(manifiesto))
+    yield salida.recoger()
+    _guardar_manifiesto(manifiesto)
+    print(f"📦 Snapshot {manifiesto['id']} ({manifiesto['tipo']}): {len(incluidos)} archivos, "
+          f"{len(manifiesto['eliminados'])} eliminados.")
+
+
+def _ruta_segura(perfil_dir, rel):
+    ruta = os.path.abspath(os.path.join(perfil_dir, rel))
+    if os.path.commonpath([ruta, perfil_dir]) != perfil_dir:
+        raise ValueError(f"Ruta fuera del perfil en el snapshot: {rel}")
+    return ruta
+
+
+def snapshot_aplicado(perfil_dir):
+    """Id del último snapshot aplicado a este perfil, o None."""
+    try:
+        with open(f"{perfil_dir}.snapshot", encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def aplicar_snapshot(ruta_zip, perfil_dir):
+    """
+    Aplica un ZIP de snapshot al perfil. Uno completo sustituye el perfil entero
+    (se extrae aparte y luego se cambia por el actual); uno incremental sólo
+    escribe los archivos que trae y borra los eliminados, y exige que el perfil
+    esté en su snapshot base. Los ZIP sin manifiesto (copias antiguas) se tratan
+    como completos. Devuelve el manifiesto aplicado (None si no traía).
+    Lanza ValueError si el snapshot no se puede aplicar a este perfil.
+    """
+    perfil_dir = os.path.abspath(perfil_dir)
+    with zipfile.ZipFile(ruta_zip) as zipf:
+        nombres = [n for n in zipf.namelist() if n != MANIFIESTO and not n.endswith('/')]
+        manifiesto = json.loads(zipf.read(MANIFIESTO)) if MANIFIESTO in zipf.namelist() else None
+
+        if manifiesto and manifiesto["tipo"] == "incremental":
+            actual = snapshot_aplicado(perfil_dir)
+            if not os.path.isdir(perfil_dir) or actual != manifiesto["base"]:
+                raise ValueError(f"El snapshot incremental parte de {manifiesto['base']}, pero el perfil "
+                                 f"está en {actual or 'un estado desconocido'}; sube primero un snapshot completo.")
+            for rel in manifiesto["eliminados"]:
+                ruta = _ruta_segura(perfil_dir, rel)
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            for nombre in nombres:
+                _ruta_segura(perfil_dir, nombre)
+                zipf.extract(nombre, perfil_dir)
+        else:
+            nuevo = f"{perfil_dir}.nuevo"
+            shutil.rmtree(nuevo, ignore_errors=True)
+            for nombre in nombres:
+                zipf.extract(nombre, nuevo)
+            if os.path.exists(perfil_dir):
+                shutil.rmtree(perfil_dir, onerror=_quitar_solo_lectura)
+            os.replace(nuevo, perfil_dir)
+
+    with open(f"{perfil_dir}.snapshot", 'w', encoding='utf-8') as f:
+        f.write(manifiesto["id"] if manifiesto else '')
+    if manifiesto:
+        # Este equipo puede generar a su vez incrementales a partir de lo aplicado
+        _guardar_manifiesto(manifiesto)
+    return manifiesto
+
+
+def _quitar_solo_lectura(func, path, exc_info):
+    # Cambia permisos y reintenta borrar
+    try:
+        os.chmod(path, 0o600)
+        func(path)
+    except Exception:
+        pass
@@ -0,0 +1,40 @@
+# src/core/telefonos.py
+import os
+import re
+
+# Código de país que se antepone a los números nacionales (Venezuela por defecto)
+CODIGO_PAIS = os.environ.get('TELEFONO_CODIGO_PAIS', '58')
+# Dígitos del número nacional sin el 0 inicial (p. ej. 414 1234567)
+DIGITOS_NACIONALES = 10
+
+
+def normalizar_telefono(telefono, codigo_pais=CODIGO_PAIS):
+    """
+    Convierte un teléfono tal como viene en los datos a formato E.164 ('+584141234567').
+    Acepta números nacionales ('0414-123.45.67', '4141234567'), con código de país
+    ('584141234567') o internacionales ('+57 ...', '0057 ...'). Devuelve None si el
+    número está vacío o no tiene una longitud válida.
+    """
+    if not telefono:
+        return None
+    texto = str(telefono).strip()
+    digitos = re.sub(r'\D', '', texto)
+    if texto.startswith('+'):
+        internacional = digitos
+        # '+58 0414...': sobra el 0 del prefijo nacional
+        if internacional.startswith(codigo_pais + '0') and len(internacional) == len(codigo_pais) + DIGITOS_NACIONALES + 1:
+            internacional = codigo_pais + internacional[len(codigo_pais) + 1:]
+    elif digitos.startswith('00'):
+        internacional = digitos[2:]
+    elif len(digitos) == DIGITOS_NACIONALES + 1 and digitos.startswith('0'):
+        internacional = codigo_pais + digitos[1:]
+    elif len(digitos) == DIGITOS_NACIONALES:
+        internacional = codigo_pais + digitos
+    elif len(digitos) == len(codigo_pais) + DIGITOS_NACIONALES and digitos.startswith(codigo_pais):
+        internacional = digitos
+    else:
+        return None
+    # E.164: como máximo 15 dígitos y sin ceros a la izquierda
+    if not 8 <= len(internacional) <= 15 or internacional.startswith('0'):
+        return None
+    return f"+{internacional}"
@@ -51,6 +51,28 @@ def get_metadata():
     return target_db.metadata
 
 
+# Objetos de búsqueda creados a mano en las migraciones, que los modelos no declaran
+COLUMNAS_BUSQUEDA = {('users', 'busqueda')}
+INDICES_BUSQUEDA = {'ix_users_busqueda'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """
+    Excluye del autogenerate lo que las migraciones de búsqueda crean por su cuenta:
+    las tablas del espejo FTS5 (contactos_fts y sus tablas sombra) y, en Postgres,
+    la columna generada users.busqueda y los índices GIN (ix_users_busqueda, ix_*_trgm).
+    """
+    if not reflected:
+        return True
+    if type_ == 'table':
+        return not name.startswith('contactos_fts')
+    if type_ == 'column':
+        return (object.table.name, name) not in COLUMNAS_BUSQUEDA
+    if type_ == 'index':
+        return not (name in INDICES_BUSQUEDA or name.endswith('_trgm'))
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +87,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -100,6 +123,7 @@ def run_migrations_online():
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
+            include_object=include_object,
             **conf_args
         )
 
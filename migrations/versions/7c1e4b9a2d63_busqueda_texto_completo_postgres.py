@@ -0,0 +1,52 @@
+"""Búsqueda de texto completo y trigramas en Postgres
+
+Revision ID: 7c1e4b9a2d63
+Revises: 35f43af52273
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e4b9a2d63'
+down_revision = '35f43af52273'
+branch_labels = None
+depends_on = None
+
+# (tabla, columna) con índice GIN de trigramas para los ILIKE '%término%'
+COLUMNAS_TRGM = [
+    ('users', 'nombre_completo'),
+    ('users', 'telefono'),
+    ('congregaciones', 'nombre'),
+    ('congregaciones', 'circuito'),
+    ('territorios', 'nombre'),
+]
+
+
+def upgrade():
+    # Sólo aplica a Postgres; en SQLite la búsqueda sigue usando LIKE
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "ALTER TABLE users ADD COLUMN busqueda tsvector GENERATED ALWAYS AS ("
+        "to_tsvector('simple', coalesce(nombre_completo, '') || ' ' || coalesce(telefono, ''))"
+        ") STORED"
+    )
+    op.create_index('ix_users_busqueda', 'users', ['busqueda'], postgresql_using='gin')
+    for tabla, columna in COLUMNAS_TRGM:
+        op.create_index(f'ix_{tabla}_{columna}_trgm', tabla, [columna],
+                        postgresql_using='gin', postgresql_ops={columna: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for tabla, columna in reversed(COLUMNAS_TRGM):
+        op.drop_index(f'ix_{tabla}_{columna}_trgm', table_name=tabla)
+    op.drop_index('ix_users_busqueda', table_name='users')
+    op.drop_column('users', 'busqueda')
@@ -0,0 +1,87 @@
+"""Espejo FTS5 de contactos para la búsqueda en SQLite
+
+Revision ID: 9d2e5f1a7b40
+Revises: 7c1e4b9a2d63
+Create Date: 2026-10-18 11:03:27.518802
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e5f1a7b40'
+down_revision = '7c1e4b9a2d63'
+branch_labels = None
+depends_on = None
+
+# Una fila por usuario (rowid = users.id) con el texto de su congregación y territorios
+COLUMNAS_FTS = "rowid, nombre, telefono, congregacion, circuito, territorios"
+
+
+def _select_contactos(condicion):
+    """SELECT con las columnas del espejo para los usuarios que cumplen `condicion`."""
+    return (
+        "SELECT u.id, u.nombre_completo, u.telefono, c.nombre, c.circuito, "
+        "(SELECT group_concat(t.nombre, ' ') FROM territorios t WHERE t.congregacion_id = c.id) "
+        "FROM users u JOIN congregaciones c ON c.id = u.congregacion_id "
+        f"WHERE {condicion}"
+    )
+
+
+def _refrescar_congregacion(congregacion_id):
+    """Sentencias de trigger que reescriben las filas de los usuarios de una congregación."""
+    return (
+        f"DELETE FROM contactos_fts WHERE rowid IN (SELECT id FROM users WHERE congregacion_id = {congregacion_id}); "
+        f"INSERT INTO contactos_fts ({COLUMNAS_FTS}) {_select_contactos(f'u.congregacion_id = {congregacion_id}')}; "
+    )
+
+
+TRIGGERS = {
+    'contactos_fts_users_ai':
+        f"AFTER INSERT ON users BEGIN "
+        f"INSERT INTO contactos_fts ({COLUMNAS_FTS}) {_select_contactos('u.id = new.id')}; END",
+    # Sólo las columnas que se indexan: cambiar la contraseña no toca el espejo
+    'contactos_fts_users_au':
+        f"AFTER UPDATE OF nombre_completo, telefono, congregacion_id ON users BEGIN "
+        f"DELETE FROM contactos_fts WHERE rowid = old.id; "
+        f"INSERT INTO contactos_fts ({COLUMNAS_FTS}) {_select_contactos('u.id = new.id')}; END",
+    'contactos_fts_users_ad':
+        "AFTER DELETE ON users BEGIN DELETE FROM contactos_fts WHERE rowid = old.id; END",
+    'contactos_fts_congregaciones_au':
+        f"AFTER UPDATE OF nombre, circuito ON congregaciones BEGIN {_refrescar_congregacion('new.id')} END",
+    'contactos_fts_congregaciones_ad':
+        "AFTER DELETE ON congregaciones BEGIN "
+        "DELETE FROM contactos_fts WHERE rowid IN (SELECT id FROM users WHERE congregacion_id = old.id); END",
+    'contactos_fts_territorios_ai':
+        f"AFTER INSERT ON territorios BEGIN {_refrescar_congregacion('new.congregacion_id')} END",
+    'contactos_fts_territorios_au':
+        f"AFTER UPDATE ON territorios BEGIN "
+        f"{_refrescar_congregacion('old.congregacion_id')}{_refrescar_congregacion('new.congregacion_id')} END",
+    'contactos_fts_territorios_ad':
+        f"AFTER DELETE ON territorios BEGIN {_refrescar_congregacion('old.congregacion_id')} END",
+}
+
+
+def upgrade():
+    # Sólo aplica a SQLite; en Postgres la búsqueda usa tsvector y pg_trgm
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE contactos_fts USING fts5("
+        "nombre, telefono, congregacion, circuito, territorios, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    op.execute(f"INSERT INTO contactos_fts ({COLUMNAS_FTS}) {_select_contactos('1 = 1')}")
+    for nombre, cuerpo in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER {nombre} {cuerpo}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for nombre in reversed(list(TRIGGERS)):
+        op.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+    op.execute("DROP TABLE IF EXISTS contactos_fts")
@@ -0,0 +1,29 @@
+"""Generación compartida de los contactos para invalidar la búsqueda en todos los procesos
+
+Revision ID: a4d7e3b9c162
+Revises: f3c8d1a6b295
+Create Date: 2026-10-18 21:14:09.530118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e3b9c162'
+down_revision = 'f3c8d1a6b295'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    generacion = op.create_table('generacion_busqueda',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('generacion', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(generacion, [{'id': 1, 'generacion': 0}])
+
+
+def downgrade():
+    op.drop_table('generacion_busqueda')
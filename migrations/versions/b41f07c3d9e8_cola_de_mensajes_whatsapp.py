@@ -0,0 +1,56 @@
+"""Cola persistente de mensajes de WhatsApp
+
+Revision ID: b41f07c3d9e8
+Revises: 9d2e5f1a7b40
+Create Date: 2026-10-18 13:26:50.114392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41f07c3d9e8'
+down_revision = '9d2e5f1a7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trabajos_envio',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('mensaje', sa.Text(), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('creado_en', sa.DateTime(), nullable=False),
+    sa.Column('finalizado_en', sa.DateTime(), nullable=True),
+    sa.Column('creado_por_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['creado_por_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trabajos_envio_estado', 'trabajos_envio', ['estado'])
+    op.create_table('mensajes_salientes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('trabajo_id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('nombre', sa.String(length=150), nullable=True),
+    sa.Column('telefono', sa.String(length=50), nullable=False),
+    sa.Column('texto', sa.Text(), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('intentos', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('actualizado_en', sa.DateTime(), nullable=False),
+    sa.Column('enviado_en', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['trabajo_id'], ['trabajos_envio.id'], ),
+    sa.ForeignKeyConstraint(['usuario_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mensajes_salientes_trabajo_id', 'mensajes_salientes', ['trabajo_id'])
+    op.create_index('ix_mensajes_salientes_cola', 'mensajes_salientes', ['estado', 'trabajo_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_mensajes_salientes_cola', table_name='mensajes_salientes')
+    op.drop_index('ix_mensajes_salientes_trabajo_id', table_name='mensajes_salientes')
+    op.drop_table('mensajes_salientes')
+    op.drop_index('ix_trabajos_envio_estado', table_name='trabajos_envio')
+    op.drop_table('trabajos_envio')
@@ -0,0 +1,52 @@
+"""Reintentos de los mensajes y control del navegador de WhatsApp desde el trabajador
+
+Revision ID: b6e1f4a8c305
+Revises: a4d7e3b9c162
+Create Date: 2026-10-18 23:02:41.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1f4a8c305'
+down_revision = 'a4d7e3b9c162'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('mensajes_salientes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reintentar_en', sa.DateTime(), nullable=True))
+
+    op.create_table('solicitudes_whatsapp',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('accion', sa.String(length=20), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('archivo', sa.String(length=500), nullable=True),
+    sa.Column('resultado', sa.Text(), nullable=True),
+    sa.Column('creada_en', sa.DateTime(), nullable=False),
+    sa.Column('atendida_en', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_solicitudes_whatsapp_estado', 'solicitudes_whatsapp', ['estado'])
+
+    op.create_table('estado_whatsapp',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('qr', sa.Text(), nullable=True),
+    sa.Column('navegador_abierto', sa.Boolean(), nullable=False),
+    sa.Column('lanzamientos', sa.Integer(), nullable=False),
+    sa.Column('actualizado_en', sa.DateTime(), nullable=True),
+    sa.Column('latido', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('estado_whatsapp')
+    op.drop_index('ix_solicitudes_whatsapp_estado', table_name='solicitudes_whatsapp')
+    op.drop_table('solicitudes_whatsapp')
+    with op.batch_alter_table('mensajes_salientes', schema=None) as batch_op:
+        batch_op.drop_column('reintentar_en')
@@ -0,0 +1,72 @@
+"""Teléfono normalizado a E.164 en usuarios
+
+Revision ID: c83a1d5e2f67
+Revises: b41f07c3d9e8
+Create Date: 2026-10-18 15:02:11.830245
+
+"""
+import os
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c83a1d5e2f67'
+down_revision = 'b41f07c3d9e8'
+branch_labels = None
+depends_on = None
+
+TAMANO_LOTE = 1000
+CODIGO_PAIS = os.environ.get('TELEFONO_CODIGO_PAIS', '58')
+DIGITOS_NACIONALES = 10
+
+
+def normalizar_telefono(telefono, codigo_pais=CODIGO_PAIS):
+    """
+    Copia congelada de core.telefonos.normalizar_telefono tal como era al escribir
+    esta migración: los cambios posteriores de la app no deben alterar lo que hace.
+    """
+    if not telefono:
+        return None
+    texto = str(telefono).strip()
+    digitos = re.sub(r'\D', '', texto)
+    if texto.startswith('+'):
+        internacional = digitos
+        if internacional.startswith(codigo_pais + '0') and len(internacional) == len(codigo_pais) + DIGITOS_NACIONALES + 1:
+            internacional = codigo_pais + internacional[len(codigo_pais) + 1:]
+    elif digitos.startswith('00'):
+        internacional = digitos[2:]
+    elif len(digitos) == DIGITOS_NACIONALES + 1 and digitos.startswith('0'):
+        internacional = codigo_pais + digitos[1:]
+    elif len(digitos) == DIGITOS_NACIONALES:
+        internacional = codigo_pais + digitos
+    elif len(digitos) == len(codigo_pais) + DIGITOS_NACIONALES and digitos.startswith(codigo_pais):
+        internacional = digitos
+    else:
+        return None
+    if not 8 <= len(internacional) <= 15 or internacional.startswith('0'):
+        return None
+    return f"+{internacional}"
+
+
+def upgrade():
+    op.add_column('users', sa.Column('telefono_e164', sa.String(length=16), nullable=True))
+    op.create_index('ix_users_telefono_e164', 'users', ['telefono_e164'])
+
+    # Normaliza los teléfonos existentes una sola vez
+    conexion = op.get_bind()
+    usuarios = sa.table('users', sa.column('id', sa.Integer), sa.column('telefono', sa.String),
+                        sa.column('telefono_e164', sa.String))
+    filas = conexion.execute(sa.select(usuarios.c.id, usuarios.c.telefono).where(usuarios.c.telefono.isnot(None))).all()
+    cambios = [{"_id": id_, "e164": normalizar_telefono(telefono)} for id_, telefono in filas]
+    cambios = [c for c in cambios if c["e164"]]
+    actualizar = usuarios.update().where(usuarios.c.id == sa.bindparam('_id')).values(telefono_e164=sa.bindparam('e164'))
+    for i in range(0, len(cambios), TAMANO_LOTE):
+        conexion.execute(actualizar, cambios[i:i + TAMANO_LOTE])
+
+
+def downgrade():
+    op.drop_index('ix_users_telefono_e164', table_name='users')
+    op.drop_column('users', 'telefono_e164')
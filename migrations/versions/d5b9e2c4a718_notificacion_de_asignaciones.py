@@ -0,0 +1,35 @@
+"""Estado de la notificación de las asignaciones S-43
+
+Revision ID: d5b9e2c4a718
+Revises: c83a1d5e2f67
+Create Date: 2026-10-18 16:40:05.271903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b9e2c4a718'
+down_revision = 'c83a1d5e2f67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Las asignaciones anteriores nunca llegaron a notificarse de forma fiable: 'desconocido'
+    with op.batch_alter_table('asignaciones_visita', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('mensaje_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('notificacion', sa.String(length=20), nullable=False, server_default='desconocido'))
+        batch_op.add_column(sa.Column('notificada_en', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_asignaciones_visita_mensaje_id', ['mensaje_id'])
+        batch_op.create_foreign_key('fk_asignaciones_visita_mensaje_id', 'mensajes_salientes', ['mensaje_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('asignaciones_visita', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_asignaciones_visita_mensaje_id', type_='foreignkey')
+        batch_op.drop_index('ix_asignaciones_visita_mensaje_id')
+        batch_op.drop_column('notificada_en')
+        batch_op.drop_column('notificacion')
+        batch_op.drop_column('mensaje_id')
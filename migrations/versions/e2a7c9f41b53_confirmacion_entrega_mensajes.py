@@ -0,0 +1,32 @@
+"""Confirmación de entrega y tiempos de los mensajes salientes
+
+Revision ID: e2a7c9f41b53
+Revises: d5b9e2c4a718
+Create Date: 2026-10-18 17:25:48.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c9f41b53'
+down_revision = 'd5b9e2c4a718'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('mensajes_salientes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('entrega', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('duracion_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('confirmacion_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('captura', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('mensajes_salientes', schema=None) as batch_op:
+        batch_op.drop_column('captura')
+        batch_op.drop_column('confirmacion_ms')
+        batch_op.drop_column('duracion_ms')
+        batch_op.drop_column('entrega')
@@ -0,0 +1,55 @@
+"""Espejo FTS5 de contactos con el tokenizador trigram (búsqueda por subcadena)
+
+Revision ID: e9a3c5b7d214
+Revises: b6e1f4a8c305
+Create Date: 2026-10-18 23:48:12.604551
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a3c5b7d214'
+down_revision = 'b6e1f4a8c305'
+branch_labels = None
+depends_on = None
+
+COLUMNAS_FTS = "rowid, nombre, telefono, congregacion, circuito, territorios"
+# Copia congelada del SELECT de 9d2e5f1a7b40: los triggers de esa migración siguen
+# manteniendo la tabla, que sólo cambia de tokenizador
+SELECT_CONTACTOS = (
+    "SELECT u.id, u.nombre_completo, u.telefono, c.nombre, c.circuito, "
+    "(SELECT group_concat(t.nombre, ' ') FROM territorios t WHERE t.congregacion_id = c.id) "
+    "FROM users u JOIN congregaciones c ON c.id = u.congregacion_id"
+)
+# El tokenizador trigram existe desde SQLite 3.34
+VERSION_TRIGRAM = (3, 34, 0)
+
+
+def _recrear(tokenizador):
+    op.execute("DROP TABLE contactos_fts")
+    op.execute(
+        "CREATE VIRTUAL TABLE contactos_fts USING fts5("
+        "nombre, telefono, congregacion, circuito, territorios, "
+        f"tokenize = '{tokenizador}')"
+    )
+    op.execute(f"INSERT INTO contactos_fts ({COLUMNAS_FTS}) {SELECT_CONTACTOS}")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    version = bind.exec_driver_sql("SELECT sqlite_version()").scalar()
+    if tuple(int(p) for p in version.split('.')) < VERSION_TRIGRAM:
+        # Sin trigram la búsqueda usa el respaldo ILIKE (core/busqueda_sql.py)
+        print(f"⚠️ SQLite {version} no tiene el tokenizador trigram: contactos_fts se queda como estaba.")
+        return
+    _recrear('trigram')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _recrear('unicode61 remove_diacritics 2')
@@ -0,0 +1,33 @@
+"""Huellas de las filas de contactos.csv para la sincronización incremental
+
+Revision ID: f3c8d1a6b295
+Revises: e2a7c9f41b53
+Create Date: 2026-10-18 19:02:37.418265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d1a6b295'
+down_revision = 'e2a7c9f41b53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('contactos_sincronizados',
+    sa.Column('id_origen', sa.String(length=64), nullable=False),
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('sincronizado_en', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['usuario_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id_origen')
+    )
+    op.create_index('ix_contactos_sincronizados_usuario_id', 'contactos_sincronizados', ['usuario_id'])
+
+
+def downgrade():
+    op.drop_index('ix_contactos_sincronizados_usuario_id', table_name='contactos_sincronizados')
+    op.drop_table('contactos_sincronizados')
@@ -13,6 +13,14 @@ document.addEventListener('DOMContentLoaded', function() {
 let usuariosEncontrados = [];
 let usuariosSeleccionados = [];
 
+// Estado de la paginación de resultados (cursor que devuelve /api/buscar)
+const TAMANO_PAGINA = 50;
+let terminoActual = '';
+let siguienteCursor = null;
+let cargandoPagina = false;
+let busquedaActual = 0;
+let observadorScroll = null;
+
 // ===============================================
 // LÓGICA DE BÚSQUEDA DE CONTACTOS
 // ===============================================
@@ -29,39 +37,96 @@ function configurarBusqueda() {
     });
 }
 
+async function pedirPagina(termino, cursor) {
+    const response = await fetch('/api/buscar', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ termino: termino, limit: TAMANO_PAGINA, cursor: cursor })
+    });
+    if (!response.ok) {
+        throw new Error(`Error del servidor: ${response.statusText}`);
+    }
+    return response.json();
+}
+
 async function buscarContactos(termino) {
     const listaResultados = document.getElementById('listaResultados');
     if (!listaResultados) return;
     listaResultados.innerHTML = '<div class="text-center py-5"><div class="spinner-border text-primary"></div></div>';
 
+    // Cada búsqueda nueva invalida las páginas que aún estén en camino
+    const busqueda = ++busquedaActual;
+    terminoActual = termino;
+    siguienteCursor = null;
+    cargandoPagina = true;
     try {
-        const response = await fetch('/api/buscar', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ termino: termino })
-        });
-        if (!response.ok) {
-            throw new Error(`Error del servidor: ${response.statusText}`);
-        }
-        const data = await response.json();
+        const data = await pedirPagina(termino, null);
+        if (busqueda !== busquedaActual) return;
         usuariosEncontrados = data.usuarios || [];
+        siguienteCursor = data.next_cursor || null;
         renderizarResultados(usuariosEncontrados);
     } catch (error) {
+        if (busqueda !== busquedaActual) return;
         console.error('Error en la búsqueda:', error);
         listaResultados.innerHTML = '<div class="alert alert-danger">Error de conexión al buscar.</div>';
+    } finally {
+        if (busqueda === busquedaActual) cargandoPagina = false;
+    }
+    observarFinDeLista();
+}
+
+async function cargarMasResultados() {
+    if (cargandoPagina || !siguienteCursor) return;
+    const busqueda = busquedaActual;
+    cargandoPagina = true;
+    try {
+        const data = await pedirPagina(terminoActual, siguienteCursor);
+        if (busqueda !== busquedaActual) return;
+        const nuevos = data.usuarios || [];
+        usuariosEncontrados = usuariosEncontrados.concat(nuevos);
+        siguienteCursor = data.next_cursor || null;
+        renderizarResultados(nuevos, true);
+    } catch (error) {
+        console.error('Error al cargar más resultados:', error);
+    } finally {
+        if (busqueda === busquedaActual) cargandoPagina = false;
+    }
+    observarFinDeLista();
+}
+
+// Un centinela al final de la lista pide la siguiente página al hacerse visible
+function observarFinDeLista() {
+    const listaResultados = document.getElementById('listaResultados');
+    if (!listaResultados) return;
+    let centinela = document.getElementById('finResultados');
+    if (!centinela) {
+        centinela = document.createElement('div');
+        centinela.id = 'finResultados';
+        centinela.className = 'col-12';
+        listaResultados.insertAdjacentElement('afterend', centinela);
+    }
+    if (!observadorScroll) {
+        observadorScroll = new IntersectionObserver(entradas => {
+            if (entradas.some(e => e.isIntersecting)) cargarMasResultados();
+        }, { rootMargin: '400px' });
+        observadorScroll.observe(centinela);
+    } else {
+        // Si el centinela sigue visible tras pintar la página, se pide la siguiente
+        observadorScroll.unobserve(centinela);
+        observadorScroll.observe(centinela);
     }
 }
 
-function renderizarResultados(usuarios) {
+function renderizarResultados(usuarios, agregar = false) {
     const listaResultados = document.getElementById('listaResultados');
-    listaResultados.innerHTML = ''; 
+    if (!agregar) listaResultados.innerHTML = '';
 
-    if (usuarios.length === 0) {
+    if (!agregar && usuarios.length === 0) {
         listaResultados.innerHTML = '<div class="text-center py-5 text-muted col-12"><p>No se encontraron usuarios.</p></div>';
         return;
     }
 
-    usuarios.forEach(usuario => {
+    const tarjetas = usuarios.map(usuario => {
         const telefono = usuario.telefono ? `<li class="list-group-item bg-transparent border-0 px-0 pt-0"><i class="bi bi-telephone-fill me-2 text-secondary"></i>${usuario.telefono}</li>` : '';
         let privilegiosHTML = '';
         if (usuario.privilegios && usuario.privilegios.length > 0) {
@@ -69,7 +134,7 @@ function renderizarResultados(usuarios) {
         }
         
         const isChecked = usuariosSeleccionados.some(u => u.id === usuario.id);
-        const tarjetaHTML = `
+        return `
             <div class="col-md-6 col-lg-4 mb-4">
                 <div class="card h-100 shadow-sm usuario-card ${isChecked ? 'selected' : ''}" data-user-id="${usuario.id}" onclick="toggleSeleccion(${usuario.id})">
                     <div class="card-body">
@@ -88,8 +153,8 @@ function renderizarResultados(usuarios) {
                     </div>
                 </div>
             </div>`;
-        listaResultados.insertAdjacentHTML('beforeend', tarjetaHTML);
     });
+    listaResultados.insertAdjacentHTML('beforeend', tarjetas.join(''));
 }
 
 function toggleSeleccion(id) {
@@ -139,9 +204,10 @@ function configurarWhatsapp() {
         try {
             const resp = await fetch('/api/whatsapp/conectar', { method: 'POST' });
             const data = await resp.json();
-            if(data.status === 'necesita_qr' && data.qr_code) {
-                qrImage.src = data.qr_code;
+            if(data.status === 'qr' && data.qr) {
+                qrImage.src = `data:image/png;base64,${data.qr}`;
                 statusDiv.textContent = 'Escanea el QR';
+                esperarInicioSesion();
             } else if(data.status === 'logueado') {
                 qrContainer.style.display = 'none';
                 statusDiv.textContent = 'Conectado';
@@ -158,8 +224,33 @@ function configurarWhatsapp() {
     });
 }
 
+// Mientras se muestra el QR, consulta el estado (en caché en el servidor) hasta que se inicie sesión
+const INTERVALO_ESTADO_MS = 3000;
+let temporizadorEstado = null;
+
+function esperarInicioSesion() {
+    clearTimeout(temporizadorEstado);
+    const consultar = async () => {
+        try {
+            const resp = await fetch('/api/whatsapp/estado');
+            const data = await resp.json();
+            if (data.status === 'logueado') {
+                document.getElementById('qr-container').style.display = 'none';
+                document.getElementById('whatsapp-status').textContent = 'Conectado';
+                return;
+            }
+        } catch (err) {
+            // Un fallo de red puntual no detiene la espera
+        }
+        temporizadorEstado = setTimeout(consultar, INTERVALO_ESTADO_MS);
+    };
+    temporizadorEstado = setTimeout(consultar, INTERVALO_ESTADO_MS);
+}
+
 async function enviarMensajesWhatsapp() {
-    const mensaje = document.getElementById('mensajeWhatsapp').value;
+    // Si TinyMCE llega a montarse sobre el textarea, el texto está en el editor
+    const editor = window.tinymce && tinymce.get('editor-whatsapp');
+    const mensaje = editor ? editor.getContent({ format: 'text' }) : document.getElementById('editor-whatsapp').value;
     if (usuariosSeleccionados.length === 0) { return alert('Por favor, selecciona al menos un contacto.'); }
     if (!mensaje.trim()) { return alert('Por favor, escribe un mensaje.'); }
     if (!confirm(`¿Estás seguro de enviar el mensaje a ${usuariosSeleccionados.length} contactos?`)) { return; }
@@ -168,15 +259,44 @@ async function enviarMensajesWhatsapp() {
         const response = await fetch('/api/whatsapp/enviar', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ usuarios: usuariosSeleccionados, mensaje: mensaje })
+            body: JSON.stringify({ usuario_ids: usuariosSeleccionados.map(u => u.id), mensaje: mensaje })
         });
         const data = await response.json();
         alert(data.mensaje);
+        if (data.trabajo_id) seguirTrabajoEnvio(data.trabajo_id);
     } catch (error) {
         alert(`Error al enviar: ${error.message}`);
     }
 }
 
+// Consulta periódicamente el progreso de un envío puesto en cola
+const INTERVALO_PROGRESO_MS = 3000;
+let temporizadorProgreso = null;
+
+function seguirTrabajoEnvio(trabajoId) {
+    const progresoDiv = document.getElementById('progreso-envio');
+    if (!progresoDiv) return;
+    clearTimeout(temporizadorProgreso);
+
+    const consultar = async () => {
+        try {
+            const resp = await fetch(`/api/whatsapp/trabajos/${trabajoId}`);
+            if (!resp.ok) { progresoDiv.textContent = 'No se pudo consultar el progreso del envío.'; return; }
+            const t = await resp.json();
+            const hechos = t.enviados + t.fallidos;
+            let texto = `Envío #${t.id}: ${hechos}/${t.total} procesados (${t.enviados} enviados, ${t.entregados} entregados, ${t.fallidos} fallidos)`;
+            if (t.estado === 'en_cola' && t.mensajes_por_delante) texto += ` · ${t.mensajes_por_delante} mensajes por delante`;
+            if (t.estado === 'completado') texto += ' · completado';
+            progresoDiv.textContent = texto;
+            if (t.estado !== 'completado') temporizadorProgreso = setTimeout(consultar, INTERVALO_PROGRESO_MS);
+        } catch (err) {
+            // Un fallo de red puntual no detiene el seguimiento
+            temporizadorProgreso = setTimeout(consultar, INTERVALO_PROGRESO_MS);
+        }
+    };
+    consultar();
+}
+
 // --- GESTIÓN DE PERFIL DE WHATSAPP WEB ---
 
 document.getElementById('form-subir-perfil').addEventListener('submit', async function(e) {
@@ -199,27 +319,14 @@ document.getElementById('form-subir-perfil').addEventListener('submit', async fu
     }
 });
 
-document.getElementById('btn-descargar-perfil').addEventListener('click', async function() {
+document.getElementById('btn-descargar-perfil').addEventListener('click', function() {
+    // El servidor genera el ZIP mientras se descarga: se deja la descarga al
+    // navegador en lugar de acumular el archivo entero en memoria con fetch.
     const msgDiv = document.getElementById('perfil-msg');
-    msgDiv.textContent = "Preparando descarga...";
-    try {
-        const resp = await fetch('/api/whatsapp/descargar_perfil');
-        if (resp.ok) {
-            const blob = await resp.blob();
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = "playwright_whatsapp_profile.zip";
-            document.body.appendChild(a);
-            a.click();
-            a.remove();
-            window.URL.revokeObjectURL(url);
-            msgDiv.textContent = "Descarga iniciada.";
-        } else {
-            const data = await resp.json();
-            msgDiv.textContent = data.mensaje || "No se pudo descargar el perfil.";
-        }
-    } catch (err) {
-        msgDiv.textContent = "Error de red al descargar perfil.";
-    }
+    const a = document.createElement('a');
+    a.href = '/api/whatsapp/descargar_perfil';
+    document.body.appendChild(a);
+    a.click();
+    a.remove();
+    msgDiv.textContent = "Descarga iniciada.";
 });
\ No newline at end of file
@@ -0,0 +1,221 @@
+# tests/test_busqueda.py
+# El número de consultas SQL de una búsqueda no debe crecer con el número de usuarios
+# (ni por privilegios, ni por congregación): se cuentan con before_cursor_execute.
+import glob
+import importlib.util
+import os
+import random
+import time
+from contextlib import contextmanager
+
+import click
+import pytest
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from flask import Flask
+from fuzzywuzzy import process as fuzzywuzzy_process
+from sqlalchemy import event
+
+from core.models import db, User, Congregacion, Territorio, Privilegio
+from core.motor_busqueda import IndicesDifusos, MotorBusquedaModerno, soundex, _motores
+
+USUARIOS = 40
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        privilegios = [Privilegio(nombre='Precursor'), Privilegio(nombre='Anciano')]
+        congregaciones = [Congregacion(nombre='Centro', circuito='VE-1'), Congregacion(nombre='Tipuro', circuito='VE-3')]
+        db.session.add_all(privilegios + congregaciones)
+        db.session.flush()
+        for cong in congregaciones:
+            db.session.add(Territorio(nombre=f'Territorio {cong.nombre}', congregacion_id=cong.id))
+        for i in range(USUARIOS):
+            db.session.add(User(nombre_completo=f'Ana Pérez {i}', telefono=f'0414{i:07d}',
+                                username=f'ana{i}', email=f'ana{i}@example.com', password_hash='x',
+                                congregacion_id=congregaciones[i % 2].id, privilegios=privilegios[:i % 3]))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@contextmanager
+def contar_consultas():
+    sentencias = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', registrar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', registrar)
+
+
+def motor_con_indice():
+    motor = MotorBusquedaModerno()
+    motor.buscar_contactos('')  # Sin init_app el índice se construye en línea
+    return motor
+
+
+def motor_sin_indice(monkeypatch):
+    motor = MotorBusquedaModerno()
+    monkeypatch.setattr(motor, '_obtener_indice_contactos', lambda generacion=None: None)
+    motor._backend_sql()  # La verificación del backend sólo ocurre una vez por proceso
+    return motor
+
+
+def test_construccion_del_indice_con_consultas_fijas(app):
+    motor = MotorBusquedaModerno()
+    with contar_consultas() as sentencias:
+        resultados = motor.buscar_contactos('ana')
+    assert len(resultados) == USUARIOS
+    # Generación (al buscar y al construir) + usuarios + privilegios + territorios
+    assert len(sentencias) <= 5
+
+
+def test_busqueda_en_indice_solo_lee_la_generacion(app):
+    motor = motor_con_indice()
+    with contar_consultas() as sentencias:
+        resultados = motor.buscar_contactos('perez, tipuro')
+        pagina, siguiente = motor.buscar_pagina('ana', limite=10)
+    assert len(resultados) == USUARIOS
+    assert len(pagina) == 10 and siguiente is not None
+    assert all(u['privilegios'] is not None for u in pagina)
+    assert len(sentencias) <= 2
+
+
+def test_respaldo_en_bd_sin_n_mas_1(app, monkeypatch):
+    motor = motor_sin_indice(monkeypatch)
+    with contar_consultas() as sentencias:
+        resultados = motor.buscar_contactos('ana')
+    assert len(resultados) == USUARIOS
+    assert any(u['privilegios'] for u in resultados)
+    # Generación + ids + usuarios + privilegios
+    assert len(sentencias) <= 4
+
+    # Una consulta de ids por sub-consulta separada por comas
+    with contar_consultas() as sentencias:
+        assert len(motor.buscar_contactos('centro, tipuro')) == USUARIOS
+    assert len(sentencias) <= 5
+
+    with contar_consultas() as sentencias:
+        pagina, siguiente = motor.buscar_pagina('centro', limite=10)
+    assert len(pagina) == 10 and siguiente is not None
+    assert len(sentencias) <= 4
+
+
+def test_termino_vacio(app, monkeypatch):
+    motor = motor_con_indice()
+    with contar_consultas() as sentencias:
+        assert len(motor.buscar_contactos('')) == USUARIOS
+    assert len(sentencias) <= 1
+
+    motor = motor_sin_indice(monkeypatch)
+    with contar_consultas() as sentencias:
+        assert len(motor.buscar_contactos('')) == USUARIOS
+        pagina, _ = motor.buscar_pagina('', limite=USUARIOS)
+    assert len(pagina) == USUARIOS
+    # Por cada búsqueda: generación + usuarios + privilegios
+    assert len(sentencias) <= 6
+
+
+def test_init_app_construye_el_indice_al_arrancar(app, tmp_path):
+    app.config['BUSQUEDA_INDICE_DIFUSO'] = str(tmp_path / 'indice_difuso.bk')
+    motor = MotorBusquedaModerno()
+    motor.init_app(app)
+    assert motor.listo.wait(10)
+    while motor.estado()["reconstruyendo"]:
+        time.sleep(0.05)
+    assert motor.estado()["usuarios"] == USUARIOS
+    # Que los commits de otras pruebas no lo reconstruyan sobre esta base ya borrada
+    _motores.discard(motor)
+
+
+def test_init_app_no_construye_en_la_cli(app, tmp_path):
+    app.config['BUSQUEDA_INDICE_DIFUSO'] = str(tmp_path / 'indice_difuso.bk')
+    motor = MotorBusquedaModerno()
+    with click.Context(click.Command('upgrade'), info_name='upgrade'):
+        motor.init_app(app)
+    assert not motor.estado()["reconstruyendo"] and not motor.listo.is_set()
+
+
+# --- Respaldo FTS5 (SQLite): mismas subcadenas que el índice en memoria ---
+
+def aplicar_migracion(revision):
+    ruta, = glob.glob(os.path.join(os.path.dirname(__file__), '..', 'migrations', 'versions', f'{revision}_*.py'))
+    spec = importlib.util.spec_from_file_location(revision, ruta)
+    migracion = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migracion)
+    with db.engine.begin() as conexion, Operations.context(Operations(MigrationContext.configure(conexion))):
+        migracion.upgrade()
+
+
+def test_fts5_encuentra_las_mismas_subcadenas_que_el_indice(app):
+    centro = db.session.execute(db.select(Congregacion).filter_by(nombre='Centro')).scalar_one()
+    for i, nombre in enumerate(('Juliana Rondón', 'Mariana Gómez', 'Luis Figueroa')):
+        db.session.add(User(nombre_completo=nombre, telefono=f'0424337{i:04d}', username=f'otro{i}',
+                            email=f'otro{i}@example.com', password_hash='x', congregacion_id=centro.id))
+    db.session.commit()
+    aplicar_migracion('9d2e5f1a7b40')
+    aplicar_migracion('e9a3c5b7d214')
+
+    motor = motor_con_indice()
+    assert motor._backend_sql().nombre == 'fts5'
+    for termino in ('ana', 'iana', 'rez', 'ndón', '0414', '3370', 'ritorio', 'entr', 've-3', 'tipuro 3',
+                    'pérez, gómez', 'na', 'a ana', 'lu, ve-1'):
+        esperados = {u['id'] for u in motor._buscar_en_indice(motor.indice_contactos, termino)}
+        assert set(motor._buscar_ids_en_bd(termino)) == esperados, termino
+    # Una subcadena que no es prefijo de ninguna palabra, larga y corta
+    juliana = db.session.execute(db.select(User.id).filter_by(username='otro0')).scalar()
+    assert motor._backend_sql().buscar_ids([([], ['liana'])]) == [juliana]
+    assert juliana in motor._backend_sql().buscar_ids([([], ['ul'])])
+
+
+# --- Interpretación de términos: mismo resultado que fuzzywuzzy.process.extractOne ---
+
+VOCABULARIO = ('1', '2', '3', 'la', 'las', 'los', 'el', 'av', 'san', 'carlos', 'marquez', 'marcos', 'maria',
+               'mariela', 'josé', 'josefina', 'jesús', 'pérez', 'perdomo', 'gonzález', 'gómez', 'rodríguez',
+               'rondón', 'monagas', 'maturín', 'tipuro', 'floresta', 'centro', 'central', 'dimas', 'inés',
+               'laura', 'luisa', 'lucía', 'figueroa', 'fernández', 've-1', 've-3', 'territorio', 'alto')
+
+
+def interpretar_como_antes(termino, vocabulario):
+    """Abreviaturas, soundex y extractOne sobre todo el vocabulario con corte 75."""
+    palabras = sorted(vocabulario)
+    candidatos = [p for p in palabras if len(p) > 2 and p[:3] == termino]
+    if candidatos:
+        return candidatos[0] if len(candidatos) == 1 else fuzzywuzzy_process.extractOne(termino, candidatos)[0]
+    candidatos = [p for p in palabras if soundex(p) == soundex(termino)]
+    if candidatos:
+        return fuzzywuzzy_process.extractOne(termino, candidatos)[0]
+    if len(termino) < 3: return termino
+    resultado = fuzzywuzzy_process.extractOne(termino, palabras, score_cutoff=75)
+    return resultado[0] if resultado else termino
+
+
+def test_interpretacion_igual_que_extract_one():
+    motor = MotorBusquedaModerno()
+    motor.indices_difusos = IndicesDifusos.construir(VOCABULARIO)
+    azar = random.Random(7)
+    letras = 'abcdefghijlmnopqrstuvyzáéíóñ0123'
+    terminos = ['mar1quep', 'lasp', 'varlosm']
+    for _ in range(1500):
+        palabra = azar.choice(VOCABULARIO)
+        i = azar.randrange(len(palabra) + 1)
+        terminos.append(azar.choice((
+            palabra[:i] + azar.choice(letras) + palabra[i:],
+            palabra[:i] + palabra[i + 1:],
+            palabra[:i] + azar.choice(letras) + palabra[i + 1:],
+            palabra + azar.choice(letras) + azar.choice(letras))))
+    for termino in terminos:
+        if not termino: continue
+        assert motor._interpretar_termino(termino) == interpretar_como_antes(termino, VOCABULARIO), termino
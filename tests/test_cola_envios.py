@@ -0,0 +1,59 @@
+# tests/test_cola_envios.py
+# Un fallo de la sesión de WhatsApp devuelve los mensajes a la cola con espera
+# exponencial; sólo tras ENVIOS_MAX_INTENTOS se dan por fallidos.
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from core.models import db, MensajeSaliente
+from core.cola_envios import (EN_COLA, ENVIANDO, FALLIDO, encolar_envio, reclamar_siguientes, devolver_a_la_cola,
+                              resumen_trabajo)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_fallo_de_sesion_reintenta_con_espera(app):
+    trabajo = encolar_envio([{'telefono': '+584141234567'}, {'telefono': '+584241234567'}], 'Hola')
+    lote = reclamar_siguientes(10)
+    assert [m.estado for m in lote] == [ENVIANDO, ENVIANDO]
+
+    antes = datetime.utcnow()
+    assert devolver_a_la_cola(lote, 'Sesión caída', max_intentos=3, espera_base=30) == 2
+    assert all(m.estado == EN_COLA and m.error == 'Sesión caída' for m in lote)
+    assert all(antes + timedelta(seconds=29) <= m.reintentar_en <= antes + timedelta(seconds=31) for m in lote)
+    # No se reclaman antes de su hora
+    assert reclamar_siguientes(10) == []
+
+    for mensaje in lote:
+        mensaje.reintentar_en = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    lote = reclamar_siguientes(10)
+    assert [m.intentos for m in lote] == [2, 2]
+    antes = datetime.utcnow()
+    devolver_a_la_cola(lote, 'Sesión caída', max_intentos=3, espera_base=30)
+    # La espera se duplica en cada intento
+    assert all(m.reintentar_en >= antes + timedelta(seconds=59) for m in lote)
+    assert resumen_trabajo(trabajo.id)["en_cola"] == 2
+
+
+def test_agotados_los_intentos_el_mensaje_falla(app):
+    trabajo = encolar_envio([{'telefono': '+584141234567'}], 'Hola')
+    lote = reclamar_siguientes(10)
+    lote[0].intentos = 3
+    db.session.commit()
+    assert devolver_a_la_cola(lote, 'Sesión caída', max_intentos=3, espera_base=30) == 0
+    mensaje = db.session.get(MensajeSaliente, lote[0].id)
+    assert mensaje.estado == FALLIDO and 'tras 3 intentos' in mensaje.error
+    assert resumen_trabajo(trabajo.id)["estado"] == 'completado'
@@ -0,0 +1,73 @@
+# tests/test_importacion.py
+# Las filas rechazadas de una planilla no dejan rastro (ni congregaciones nuevas) y
+# un correo sólo puede pertenecer a una persona, exista ya o se dé de alta en el lote.
+import pytest
+from flask import Flask
+
+from core.models import db, User, Role, Congregacion
+from core.importacion import ImportacionContactos, importar_planilla, leer_estado_importacion
+
+COLUMNAS = {'nombre_completo': 'Nombre', 'telefono': 'Telefono', 'email': 'Email',
+            'congregacion': 'Congregacion', 'circuito': 'Circuito'}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Role(name='editor'))
+        db.session.add(User(nombre_completo='Ana Pérez', telefono='04141234567', telefono_e164='+584141234567',
+                            username='ana', email='ana@example.com', password_hash='x'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def fila(nombre, telefono='', email='', congregacion='', circuito=''):
+    return {'Nombre': nombre, 'Telefono': telefono, 'Email': email, 'Congregacion': congregacion, 'Circuito': circuito}
+
+
+def test_fila_rechazada_no_crea_la_congregacion(app):
+    errores = []
+    importacion = ImportacionContactos(al_error=lambda *error: errores.append(error))
+    importacion.procesar([
+        (2, fila('Luis Rondón', '04241112233', ' ANA@example.com ', 'Tipuro', 'VE-3')),
+        (3, fila('Marta Gómez', '04241112244', 'marta@example.com', 'Centro', 'VE-1')),
+    ], COLUMNAS)
+    assert [(numero, campo) for numero, campo, *_ in errores] == [(2, 'email')]
+    assert db.session.execute(db.select(Congregacion.nombre)).scalars().all() == ['Centro']
+    marta = db.session.execute(db.select(User).filter_by(email='marta@example.com')).scalar_one()
+    assert marta.congregacion.nombre == 'Centro'
+
+
+def test_correo_repetido_en_el_lote(app):
+    errores = []
+    importacion = ImportacionContactos(al_error=lambda *error: errores.append(error))
+    importacion.procesar([
+        (2, fila('Luis Rondón', '04241112233', 'luis@example.com')),
+        # La misma persona repetida conserva su correo; otra persona no puede usarlo
+        (3, fila('Luis Rondón', '04241112233', 'Luis@Example.com')),
+        (4, fila('Pedro Díaz', '04241112255', 'luis@example.com')),
+        (5, fila('Ana Pérez', '04141234567', 'ana@example.com')),
+    ], COLUMNAS)
+    assert [numero for numero, *_ in errores] == [4]
+    assert importacion.creados == 1 and importacion.actualizados == 1
+    # Entre lotes el correo ya es del usuario insertado
+    importacion.procesar([(6, fila('Pedro Díaz', '04241112255', 'luis@example.com'))], COLUMNAS)
+    assert [numero for numero, *_ in errores] == [4, 6]
+
+
+def test_planilla_se_borra_aunque_falle_el_informe(app, tmp_path):
+    ruta = tmp_path / 'abc.csv'
+    ruta.write_text('Nombre;Telefono\nLuis;04241112233\n', encoding='utf-8')
+    # El informe de errores no se puede abrir: en su lugar hay un directorio
+    (tmp_path / 'abc_errores.csv').mkdir()
+    estado = importar_planilla(str(ruta), str(tmp_path), 'abc')
+    assert estado["estado"] == "error"
+    assert leer_estado_importacion(str(tmp_path), 'abc')["estado"] == "error"
+    assert not ruta.exists()
@@ -0,0 +1,58 @@
+# tests/test_visitas.py
+# Asignación de visitas en lote por JSON: el cuerpo tiene que ser un objeto con la
+# lista 'asignaciones'; cualquier otra cosa es un 400 con el mismo error JSON.
+import pytest
+from flask import Flask
+from flask_login import LoginManager
+
+from core.models import db, User, Role, AsignacionVisita
+from visitas import visitas_bp
+
+
+@pytest.fixture
+def cliente():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'pruebas'
+    db.init_app(app)
+    login_manager = LoginManager(app)
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+    app.register_blueprint(visitas_bp)
+    with app.app_context():
+        db.create_all()
+        admin = Role(name='admin')
+        db.session.add_all([
+            User(nombre_completo='Admin', username='admin', email='admin@example.com', password_hash='x', role=admin),
+            User(nombre_completo='Luis Rondón', telefono='04141234567', username='luis',
+                 email='luis@example.com', password_hash='x')])
+        db.session.commit()
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['_user_id'] = '1'
+        yield cliente
+        db.session.remove()
+        db.drop_all()
+
+
+def test_asignacion_en_lote_por_json(cliente):
+    respuesta = cliente.post('/visitas/asignar/lote', json={"asignaciones": [
+        {"publicador_id": 2, "nombre_interesado": "Marta", "direccion": "Calle 1"},
+        {"publicador_telefono": "0414-123.45.67", "nombre_interesado": "Pedro", "direccion": "Calle 2"}]})
+    assert respuesta.status_code == 201
+    assert respuesta.get_json()["asignadas"] == 2
+    assert db.session.query(AsignacionVisita).count() == 2
+
+
+@pytest.mark.parametrize('cuerpo', [[{"publicador_id": 2}], 7, "asignaciones", {"asignaciones": {"a": 1}}])
+def test_cuerpo_mal_formado_es_un_400(cliente, cuerpo):
+    respuesta = cliente.post('/visitas/asignar/lote', json=cuerpo)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"status": "error", "mensaje": "'asignaciones' debe ser una lista de objetos."}
+
+
+def test_json_invalido_es_un_400(cliente):
+    respuesta = cliente.post('/visitas/asignar/lote', data='{"asignaciones": [', content_type='application/json')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["status"] == "error"
+    assert db.session.query(AsignacionVisita).count() == 0
@@ -0,0 +1,196 @@
+# src/trabajador_envios.py
+"""
+Trabajador que atiende la cola de mensajes de WhatsApp (tablas trabajos_envio y
+mensajes_salientes). Debe haber uno solo por perfil de Chromium: es el único
+proceso que abre el navegador, de modo que los envíos masivos se atienden en orden
+de llegada y un reinicio de gunicorn ya no los pierde. El proceso web le pide
+conectar (QR), cerrar o aplicar un snapshot del perfil con core/control_whatsapp.py.
+Mientras haya asignaciones S-43 esperando respuesta, también lee los 'Acepto' de
+los publicadores y las confirma.
+
+Uso: python trabajador_envios.py
+"""
+import os
+import sys
+import time
+import asyncio
+
+# Segundos entre consultas a la cola cuando está vacía
+INTERVALO_SONDEO = float(os.environ.get("ENVIOS_INTERVALO", 2))
+# Segundos sin mensajes tras los que se cierra el navegador (libera el perfil)
+INACTIVIDAD_CIERRE = float(os.environ.get("ENVIOS_INACTIVIDAD", 120))
+# Mensajes que se reclaman de la cola en cada vuelta
+TAMANO_LOTE = int(os.environ.get("ENVIOS_LOTE", 10))
+# Reintentos cuando falla la sesión de WhatsApp (no el mensaje): intentos por mensaje
+# y espera antes del primer reintento, que se duplica en cada uno
+MAX_INTENTOS = int(os.environ.get("ENVIOS_MAX_INTENTOS", 5))
+ESPERA_REINTENTO = float(os.environ.get("ENVIOS_ESPERA_REINTENTO", 30))
+# Ritmo máximo de envío (cubeta de fichas) y retraso aleatorio entre mensajes
+POR_MINUTO = float(os.environ.get("ENVIOS_POR_MINUTO", 12))
+RAFAGA = int(os.environ.get("ENVIOS_RAFAGA", 1))
+JITTER = float(os.environ.get("ENVIOS_JITTER", 3))
+# Respuestas 'Acepto' a las asignaciones S-43: cada cuántos segundos se leen, durante
+# cuántas horas tras la notificación se esperan y la pausa si no hay sesión iniciada.
+# Mientras se esperan, el navegador sigue abierto: la espera es corta a propósito
+INTERVALO_RESPUESTAS = float(os.environ.get("ENVIOS_RESPUESTAS_INTERVALO", 30))
+ESPERA_RESPUESTAS_HORAS = float(os.environ.get("ENVIOS_ESPERA_RESPUESTAS_HORAS", 2))
+PAUSA_SIN_SESION = float(os.environ.get("ENVIOS_PAUSA_SIN_SESION", 600))
+
+
+def tomar_candado(ruta):
+    """Candado de archivo que impide arrancar un segundo trabajador sobre el mismo perfil."""
+    archivo = open(ruta, 'w')
+    try:
+        import fcntl
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        print("⚠️ fcntl no disponible: no se puede garantizar un único trabajador.")
+    except OSError:
+        print(f"❌ Ya hay un trabajador de envíos en ejecución ({ruta}).")
+        sys.exit(1)
+    return archivo
+
+
+def atender_solicitud(solicitud, servicio, loop):
+    """Ejecuta una solicitud del proceso web (core/control_whatsapp.py) y guarda la respuesta."""
+    from core.models import db
+    from core.control_whatsapp import responder, publicar_estado
+    from core.perfil_whatsapp import aplicar_snapshot
+    from whatsapp_servicio import PERFIL_DIR
+
+    print(f"📨 Solicitud del web: {solicitud.accion}")
+    try:
+        if solicitud.accion == 'conectar':
+            qr = loop.run_until_complete(asyncio.wait_for(servicio.conectar_whatsapp(), timeout=90))
+            publicar_estado(servicio.estado(), qr)
+            responder(solicitud, {"qr": qr, "status": "qr" if qr else "logueado"})
+        elif solicitud.accion == 'cerrar':
+            loop.run_until_complete(servicio.cerrar())
+            responder(solicitud, {"status": "cerrado"})
+        elif solicitud.accion == 'aplicar_perfil':
+            # El perfil no se toca con Chromium abierto sobre él
+            loop.run_until_complete(servicio.cerrar())
+            try:
+                manifiesto = aplicar_snapshot(solicitud.archivo, PERFIL_DIR)
+            except ValueError as e:
+                responder(solicitud, {"mensaje": str(e), "codigo": 409}, fallida=True)
+                return
+            responder(solicitud, {"snapshot": manifiesto["id"] if manifiesto else None,
+                                  "tipo": manifiesto["tipo"] if manifiesto else "completo"})
+        else:
+            responder(solicitud, {"mensaje": f"Acción desconocida: {solicitud.accion}"}, fallida=True)
+    except Exception as e:
+        print(f"❌ Error atendiendo la solicitud {solicitud.accion}: {e}")
+        db.session.rollback()
+        responder(solicitud, {"mensaje": str(e)}, fallida=True)
+    finally:
+        if solicitud.archivo and os.path.exists(solicitud.archivo):
+            os.remove(solicitud.archivo)
+
+
+def atender_cola(app):
+    from core.models import db
+    from core.cola_envios import (recuperar_interrumpidos, reclamar_siguientes, registrar_resultado,
+                                  devolver_a_la_cola, hay_respuestas_pendientes, confirmar_asignaciones)
+    from core.control_whatsapp import INTERVALO_LATIDO, recuperar_solicitudes, tomar_solicitud, publicar_estado
+    from whatsapp_servicio import WhatsAppServicio, LimitadorTasa
+
+    with app.app_context():
+        recuperados = recuperar_interrumpidos()
+        if recuperados:
+            print(f"🔁 {recuperados} mensajes interrumpidos vuelven a la cola.")
+        recuperar_solicitudes()
+
+        servicio = WhatsAppServicio()
+        # Un solo limitador para todo el proceso: el ritmo se respeta también entre lotes
+        limitador = LimitadorTasa(POR_MINUTO, RAFAGA, JITTER)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        ultimo_envio = None
+        proxima_escucha = time.monotonic()
+        publicado, ultimo_latido = None, 0
+        print(f"📮 Trabajador de envíos esperando mensajes ({POR_MINUTO:g}/min)...")
+        try:
+            while True:
+                # Estado de la sesión para /api/whatsapp/estado: al cambiar y como latido
+                estado = servicio.estado()
+                firma = (estado["estado"], estado["navegador_abierto"], estado["lanzamientos"])
+                if firma != publicado or time.monotonic() - ultimo_latido > INTERVALO_LATIDO:
+                    publicar_estado(estado)
+                    publicado, ultimo_latido = firma, time.monotonic()
+
+                solicitud = tomar_solicitud()
+                if solicitud is not None:
+                    atender_solicitud(solicitud, servicio, loop)
+                    # El navegador queda abierto tras conectar (p. ej. esperando el QR)
+                    ultimo_envio = time.monotonic() if servicio.estado()["navegador_abierto"] else None
+                    continue
+                if estado["estado"] == 'esperando_qr' and estado["navegador_abierto"]:
+                    # ¿Ya se escaneó el QR? Se mira en la página abierta, sin esperar
+                    loop.run_until_complete(servicio.esta_logueado())
+
+                if time.monotonic() >= proxima_escucha:
+                    proxima_escucha = time.monotonic() + INTERVALO_RESPUESTAS
+                    if hay_respuestas_pendientes(ESPERA_RESPUESTAS_HORAS):
+                        try:
+                            telefonos = loop.run_until_complete(servicio.leer_respuestas())
+                        except Exception as e:
+                            print(f"⚠️ Error leyendo respuestas: {e}")
+                            telefonos = []
+                        if telefonos:
+                            confirmadas = confirmar_asignaciones(telefonos, ESPERA_RESPUESTAS_HORAS)
+                            print(f"🙋 {len(telefonos)} respuestas 'Acepto': {confirmadas} asignaciones confirmadas.")
+                        if servicio.sesion.estado == 'esperando_qr':
+                            proxima_escucha = time.monotonic() + PAUSA_SIN_SESION
+                        else:
+                            # Mientras se esperan respuestas el navegador sigue abierto
+                            ultimo_envio = time.monotonic()
+
+                lote = reclamar_siguientes(TAMANO_LOTE)
+                if not lote:
+                    db.session.remove()
+                    if ultimo_envio and time.monotonic() - ultimo_envio > INACTIVIDAD_CIERRE:
+                        loop.run_until_complete(servicio.cerrar())
+                        ultimo_envio = None
+                    time.sleep(INTERVALO_SONDEO)
+                    continue
+
+                def al_procesar(i, resultado):
+                    registrar_resultado(lote[i], resultado["enviado"], resultado["error"], resultado["entrega"],
+                                        resultado["duracion_ms"], resultado["confirmacion_ms"], resultado["captura"])
+                    print(f"[METRICA] Trabajo {lote[i].trabajo_id}: {resultado['entrega'] or 'fallido'} para "
+                          f"{resultado['telefono']} en {resultado['duracion_ms']}ms "
+                          f"(confirmación {resultado['confirmacion_ms']}ms)")
+
+                try:
+                    loop.run_until_complete(servicio.difundir(
+                        [(m.telefono, m.texto) for m in lote], limitador, al_procesar))
+                except Exception as e:
+                    # Un fallo de la sesión o de la base de datos no es culpa de los mensajes: los
+                    # que no llegaron a procesarse vuelven a la cola con espera exponencial
+                    print(f"❌ Error en el lote de envíos: {e}")
+                    # Si el fallo vino de la base de datos la sesión queda inservible hasta el rollback;
+                    # después, cada mensaje se recarga con el estado que llegó a confirmarse
+                    db.session.rollback()
+                    devueltos = devolver_a_la_cola(lote, str(e), MAX_INTENTOS, ESPERA_REINTENTO)
+                    if devueltos:
+                        print(f"🔁 {devueltos} mensajes vuelven a la cola para reintentarse más tarde.")
+                ultimo_envio = time.monotonic()
+        finally:
+            loop.run_until_complete(servicio.cerrar())
+            loop.close()
+
+
+if __name__ == '__main__':
+    if POR_MINUTO <= 0:
+        print(f"❌ ENVIOS_POR_MINUTO debe ser mayor que 0 (es {POR_MINUTO:g}).")
+        sys.exit(1)
+    # El trabajador no busca contactos: que create_app() no construya el índice de búsqueda
+    os.environ.setdefault("BUSQUEDA_CALENTAR", "0")
+    from app import app
+    os.makedirs(app.instance_path, exist_ok=True)
+    candado = tomar_candado(os.path.join(app.instance_path, 'trabajador_envios.lock'))
+    try:
+        atender_cola(app)
+    except KeyboardInterrupt:
+        print("👋 Trabajador de envíos detenido.")
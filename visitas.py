@@ -1,11 +1,177 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy import insert
 from core.models import db, User, AsignacionVisita
-from whatsapp_servicio import WhatsAppServicio
-import threading
+from core.cola_envios import encolar_envio
+from core.telefonos import normalizar_telefono
+import csv
+import io
 
 visitas_bp = Blueprint('visitas', __name__)
-ws_service = WhatsAppServicio() # Usaremos la misma instancia de WhatsApp
+
+# Columnas de una asignación y su longitud máxima en la tabla
+CAMPOS_ASIGNACION = {'nombre_interesado': 150, 'direccion': 255, 'telefono_interesado': 50, 'observaciones': None}
+# Ids o teléfonos por consulta al resolver publicadores de un lote
+TAMANO_LOTE_CONSULTA = 500
+
+
+def _es_admin():
+    return current_user.role and current_user.role.name == 'admin'
+
+
+def mensaje_asignacion(publicador, asignaciones):
+    """
+    Texto del aviso S-43 que recibe el publicador: un solo mensaje con todas las
+    visitas que se le asignan (diccionarios con los CAMPOS_ASIGNACION).
+    """
+    varias = len(asignaciones) > 1
+    visitas = "\n\n".join(
+        (f"*Visita {i}*\n" if varias else "")
+        + f"*Persona Interesada:* {a.get('nombre_interesado') or ''}\n"
+        + f"*Dirección:* {a.get('direccion') or ''}\n"
+        + f"*Teléfono:* {a.get('telefono_interesado') or ''}\n"
+        + f"*Observaciones:* {a.get('observaciones') or ''}"
+        for i, a in enumerate(asignaciones, 1)
+    )
+    titulo = "*Nuevas Asignaciones de Visita (S-43)*" if varias else "*Nueva Asignación de Visita (S-43)*"
+    aviso = (f"Se te han asignado {len(asignaciones)} nuevas visitas de parte de la congregación." if varias
+             else "Se te ha asignado una nueva visita de parte de la congregación.")
+    return f"""{titulo}
+----------------------------------
+Hola {publicador.nombre_completo.split()[0]},
+{aviso}
+
+{visitas}
+----------------------------------
+_Por favor, responde a este mensaje con la palabra 'Acepto' para confirmar._
+"""
+
+
+def notificar_asignacion(asignacion, publicador):
+    """
+    Encola el aviso de WhatsApp en la transacción de la asignación (sin commit):
+    si la asignación no se guarda, tampoco se envía nada. Lo entrega el trabajador
+    de envíos, que anota el resultado en asignacion.notificacion.
+    """
+    datos = {campo: getattr(asignacion, campo) for campo in CAMPOS_ASIGNACION}
+    trabajo = encolar_envio(
+        [{"id": publicador.id, "nombre": publicador.nombre_completo, "telefono": publicador.telefono,
+          "texto": mensaje_asignacion(publicador, [datos])}],
+        "Asignación de visita (S-43)", creado_por_id=current_user.id, confirmar=False)
+    if trabajo is None:
+        asignacion.notificacion = 'sin_telefono'
+        return False
+    asignacion.mensaje = trabajo.mensajes[0]
+    asignacion.notificacion = 'en_cola'
+    return True
+
+
+def _resolver_publicadores(filas):
+    """
+    Publicador de cada fila, por `publicador_id` o por `publicador_telefono` (con el
+    índice de telefono_e164). Todas las filas se resuelven con pocas consultas IN.
+    Devuelve ({indice de fila: User}, [errores]).
+    """
+    ids, telefonos = set(), set()
+    for fila in filas:
+        if str(fila.get('publicador_id') or '').strip().isdigit():
+            ids.add(int(fila['publicador_id']))
+        elif normalizar_telefono(fila.get('publicador_telefono')):
+            telefonos.add(normalizar_telefono(fila['publicador_telefono']))
+
+    por_id, por_telefono = {}, {}
+    ids, telefonos = sorted(ids), sorted(telefonos)
+    for i in range(0, len(ids), TAMANO_LOTE_CONSULTA):
+        for u in db.session.execute(db.select(User).where(User.id.in_(ids[i:i + TAMANO_LOTE_CONSULTA]))).scalars():
+            por_id[u.id] = u
+    for i in range(0, len(telefonos), TAMANO_LOTE_CONSULTA):
+        for u in db.session.execute(db.select(User).where(User.telefono_e164.in_(telefonos[i:i + TAMANO_LOTE_CONSULTA]))).scalars():
+            por_telefono.setdefault(u.telefono_e164, []).append(u)
+
+    publicadores, errores = {}, []
+    for n, fila in enumerate(filas, 1):
+        publicador_id = str(fila.get('publicador_id') or '').strip()
+        if publicador_id:
+            usuario = por_id.get(int(publicador_id)) if publicador_id.isdigit() else None
+            if usuario is None:
+                errores.append(f"Fila {n}: no existe el publicador con id '{publicador_id}'.")
+                continue
+        else:
+            e164 = normalizar_telefono(fila.get('publicador_telefono'))
+            candidatos = por_telefono.get(e164, []) if e164 else []
+            if len(candidatos) != 1:
+                motivo = "varios publicadores tienen" if candidatos else "ningún publicador tiene"
+                errores.append(f"Fila {n}: {motivo} el teléfono '{fila.get('publicador_telefono') or ''}'.")
+                continue
+            usuario = candidatos[0]
+        publicadores[n] = usuario
+    return publicadores, errores
+
+
+def asignar_en_lote(filas, creado_por_id=None):
+    """
+    Valida todas las filas y, sólo si no hay errores, guarda las asignaciones con
+    un único INSERT de varias filas (executemany) y encola un mensaje por publicador
+    con todas sus visitas, todo en una transacción.
+    Devuelve (resumen, errores); con errores no se guarda nada.
+    """
+    if not filas:
+        return None, ["No hay asignaciones que guardar."]
+    publicadores, errores = _resolver_publicadores(filas)
+    datos = {}
+    for n, fila in enumerate(filas, 1):
+        valores = {campo: (str(fila.get(campo) or '').strip() or None) for campo in CAMPOS_ASIGNACION}
+        for campo in ('nombre_interesado', 'direccion'):
+            if not valores[campo]:
+                errores.append(f"Fila {n}: falta '{campo}'.")
+        for campo, maximo in CAMPOS_ASIGNACION.items():
+            if maximo and valores[campo] and len(valores[campo]) > maximo:
+                errores.append(f"Fila {n}: '{campo}' supera los {maximo} caracteres.")
+        datos[n] = valores
+    if errores:
+        return None, errores
+
+    # Visitas agrupadas por publicador, en el orden en que aparecen
+    por_publicador = {}
+    for n, publicador in publicadores.items():
+        por_publicador.setdefault(publicador.id, (publicador, []))[1].append(datos[n])
+
+    trabajo = encolar_envio(
+        [{"id": p.id, "nombre": p.nombre_completo, "telefono": p.telefono, "texto": mensaje_asignacion(p, visitas)}
+         for p, visitas in por_publicador.values()],
+        "Asignación de visitas (S-43)", creado_por_id=creado_por_id, confirmar=False)
+    mensaje_de = {m.usuario_id: m.id for m in trabajo.mensajes} if trabajo else {}
+
+    db.session.execute(insert(AsignacionVisita), [
+        dict(datos[n], publicador_id=p.id, mensaje_id=mensaje_de.get(p.id),
+             notificacion='en_cola' if p.id in mensaje_de else 'sin_telefono')
+        for n, p in publicadores.items()
+    ])
+    db.session.commit()
+    sin_telefono = [p.nombre_completo for p, _ in por_publicador.values() if p.id not in mensaje_de]
+    return {
+        "asignadas": len(publicadores),
+        "publicadores": len(por_publicador),
+        "notificaciones": len(mensaje_de),
+        "trabajo_id": trabajo.id if trabajo else None,
+        "sin_telefono": sin_telefono
+    }, []
+
+
+def leer_csv_asignaciones(archivo):
+    """Filas de un CSV de asignaciones (UTF-8 o latin-1, separado por ';' o ',')."""
+    contenido = archivo.read()
+    try:
+        texto = contenido.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = contenido.decode('latin-1')
+    try:
+        delimitador = csv.Sniffer().sniff(texto[:4096], delimiters=';,').delimiter
+    except csv.Error:
+        delimitador = ';'
+    lector = csv.DictReader(io.StringIO(texto), delimiter=delimitador)
+    return [{(k or '').strip().lower(): v for k, v in fila.items()} for fila in lector]
+
 
 @visitas_bp.route('/visitas/asignar/<int:publicador_id>', methods=['GET', 'POST'])
 @login_required
@@ -13,7 +179,7 @@ def asignar_visita(publicador_id):
     """
     Muestra el formulario S-43 para asignar una visita a un publicador específico.
     """
-    if not current_user.role or current_user.role.name != 'admin':
+    if not _es_admin():
         flash('No tienes permiso para realizar esta acción.', 'danger')
         return redirect(url_for('home'))
 
@@ -38,29 +204,62 @@ def asignar_visita(publicador_id):
             publicador_id=publicador.id
         )
         db.session.add(nueva_asignacion)
+        encolado = notificar_asignacion(nueva_asignacion, publicador)
+        # Una sola transacción: la asignación y su notificación en la cola
         db.session.commit()
 
-        # Preparar y enviar el mensaje por WhatsApp
-        mensaje = f"""*Nueva Asignación de Visita (S-43)*
-----------------------------------
-Hola {publicador.nombre_completo.split()[0]},
-Se te ha asignado una nueva visita de parte de la congregación.
+        if encolado:
+            flash(f'Visita asignada a {publicador.nombre_completo}; la notificación por WhatsApp está en cola.', 'success')
+        else:
+            flash(f'Visita asignada a {publicador.nombre_completo}, pero no tiene un teléfono válido para notificarle.', 'warning')
+        return redirect(url_for('home'))
 
-*Persona Interesada:* {nombre_interesado}
-*Dirección:* {direccion}
-*Teléfono:* {telefono_interesado}
-*Observaciones:* {observaciones}
-----------------------------------
-_Por favor, responde a este mensaje con la palabra 'Acepto' para confirmar._
-"""
-        # Usamos un hilo para no bloquear la página mientras se envía el mensaje
-        def tarea_envio():
-            ws_service.enviar_mensaje(publicador.telefono, mensaje)
+    return render_template('s43_form.html', publicador=publicador)
 
-        thread = threading.Thread(target=tarea_envio)
-        thread.start()
 
-        flash(f'Visita asignada a {publicador.nombre_completo} y notificación enviada por WhatsApp.', 'success')
+@visitas_bp.route('/visitas/asignar/lote', methods=['GET', 'POST'])
+@login_required
+def asignar_visitas_lote():
+    """
+    Asigna muchas visitas de una vez: JSON {"asignaciones": [...]} o un CSV subido en
+    el campo 'archivo'. Cada asignación lleva publicador_id o publicador_telefono,
+    nombre_interesado, direccion y, opcionalmente, telefono_interesado y observaciones.
+    Se guardan todas o ninguna.
+    """
+    es_json = request.is_json
+    if not _es_admin():
+        if es_json:
+            return jsonify({"status": "error", "mensaje": "No tienes permiso para realizar esta acción."}), 403
+        flash('No tienes permiso para realizar esta acción.', 'danger')
         return redirect(url_for('home'))
 
-    return render_template('s43_form.html', publicador=publicador)
\ No newline at end of file
+    if request.method == 'GET':
+        return render_template('s43_lote.html', columnas=['publicador_id', 'publicador_telefono', *CAMPOS_ASIGNACION])
+
+    if es_json:
+        # Un cuerpo que no es un objeto JSON (una lista, un número, JSON inválido) recibe el mismo 400
+        cuerpo = request.get_json(silent=True)
+        filas = cuerpo.get('asignaciones', []) if isinstance(cuerpo, dict) else None
+        if not isinstance(filas, list) or not all(isinstance(f, dict) for f in filas):
+            return jsonify({"status": "error", "mensaje": "'asignaciones' debe ser una lista de objetos."}), 400
+    else:
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Selecciona un archivo CSV.', 'warning')
+            return redirect(url_for('visitas.asignar_visitas_lote'))
+        filas = leer_csv_asignaciones(archivo)
+
+    resumen, errores = asignar_en_lote(filas, creado_por_id=current_user.id)
+    if errores:
+        if es_json:
+            return jsonify({"status": "error", "errores": errores}), 400
+        flash(f'No se guardó ninguna asignación ({len(errores)} errores): ' + ' '.join(errores[:10]), 'danger')
+        return redirect(url_for('visitas.asignar_visitas_lote'))
+
+    if es_json:
+        return jsonify({"status": "ok", **resumen}), 201
+    flash(f"{resumen['asignadas']} visitas asignadas a {resumen['publicadores']} publicadores; "
+          f"{resumen['notificaciones']} notificaciones en cola.", 'success')
+    if resumen['sin_telefono']:
+        flash('Sin teléfono válido para notificar: ' + ', '.join(resumen['sin_telefono']), 'warning')
+    return redirect(url_for('home'))
@@ -1,210 +1,670 @@
 import os
-
-
-import os
+import json
+import time
+import random
+import asyncio
 import datetime
+import collections
 from playwright.async_api import async_playwright
+from core.telefonos import normalizar_telefono
+
+URL_WHATSAPP = "https://web.whatsapp.com"
+# Perfil de Chromium con la sesión de WhatsApp: el que lanza el servicio y el que
+# suben y descargan los snapshots de /api/whatsapp (core/perfil_whatsapp.py)
+PERFIL_DIR = os.path.abspath(os.environ.get("WHATSAPP_PERFIL_DIR", "whatsapp_profile"))
+SELECTOR_QR = "canvas[aria-label='Código QR']"
+SELECTOR_LISTA_CHATS = "#pane-side, [data-testid='chat-list-search']"
+SELECTOR_EMERGENTES = ('button:has-text("Continuar"), button:has-text("OK"), button:has-text("Entendido"), '
+                       'button:has-text("Cerrar"), button[aria-label="Cerrar"], button[aria-label="Close"]')
+SELECTOR_CAJA_TEXTO = ", ".join([
+    'div[contenteditable="true"][data-testid="conversation-compose-box-input"]',
+    'div[contenteditable="true"][data-tab="10"]',
+    'div[contenteditable="true"][data-tab][role="textbox"]',
+    'footer div[contenteditable="true"]'
+])
+SELECTOR_BOTON_ENVIAR = 'button[data-testid="send"], span[data-testid="send"], button[aria-label="Enviar"]'
+SELECTOR_MENSAJE_SALIENTE = 'div.message-out'
+# Estado de entrega del último mensaje saliente según el icono de los ticks
+JS_ESTADO_ENTREGA = """selector => {
+    const salientes = document.querySelectorAll(selector);
+    const ultimo = salientes[salientes.length - 1];
+    if (!ultimo) return null;
+    if (ultimo.querySelector('[data-icon="msg-dblcheck-ack"], [data-icon="msg-dblcheck-read"]')) return 'leido';
+    if (ultimo.querySelector('[data-icon="msg-dblcheck"]')) return 'entregado';
+    if (ultimo.querySelector('[data-icon="msg-check"]')) return 'enviado';
+    if (ultimo.querySelector('[data-icon="msg-time"]')) return 'pendiente';
+    return null;
+}"""
+# Palabra con la que los publicadores confirman una asignación (sin tildes ni mayúsculas)
+PALABRA_CONFIRMACION = os.environ.get("WHATSAPP_PALABRA_CONFIRMACION", "acepto")
+# Observador de mensajes entrantes que contienen la palabra de confirmación. Se
+# instala con add_init_script en cada documento que carga la pestaña y entrega cada
+# respuesta al proceso con la función expuesta window.__respuestaEntrante, así que
+# una recarga no se lleva respuestas guardadas en la página:
+# - del chat abierto, los mensajes recibidos (data-id "false_<jid>_<id>") que llegan
+#   con el chat ya abierto; los que se pintan al abrirlo son historial y se ignoran;
+# - de la lista de chats, las filas con mensajes sin leer cuya vista previa la contiene,
+#   también las que se pintan al cargar la página: las respuestas que llegaron mientras
+#   se recargaba siguen sin leer y se vuelven a leer.
+JS_OBSERVAR_RESPUESTAS = r"""palabra => {
+    if (window.top !== window) return;
+    const vistos = new Set();
+    const patron = new RegExp('\\b' + palabra + '\\b');
+    const contiene = t => patron.test((t || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase());
+    const anotar = (clave, evento) => { if (!vistos.has(clave)) { vistos.add(clave); window.__respuestaEntrante(evento); } };
+    const SELECTOR_FILA = '#pane-side [role="listitem"], #pane-side [data-testid="cell-frame-container"]';
+    let chatAbierto = null, abiertoDesde = 0;
+    const observar = () => new MutationObserver(registros => {
+        const cabecera = document.querySelector('#main header span[dir="auto"]');
+        const titulo = cabecera ? cabecera.innerText.trim() : null;
+        if (titulo !== chatAbierto) { chatAbierto = titulo; abiertoDesde = Date.now(); }
+        const historial = Date.now() - abiertoDesde < 2000;
+        const filas = new Set();
+        for (const r of registros) {
+            const objetivo = r.target.nodeType === 1 ? r.target : r.target.parentElement;
+            const fila = objetivo && objetivo.closest(SELECTOR_FILA);
+            if (fila) filas.add(fila);
+            for (const nodo of r.addedNodes) {
+                if (nodo.nodeType !== 1) continue;
+                // Filas que se pintan de nuevo, p. ej. toda la lista al cargar la página
+                if (nodo.matches(SELECTOR_FILA)) filas.add(nodo);
+                else nodo.querySelectorAll(SELECTOR_FILA).forEach(f => filas.add(f));
+                if (!nodo.closest('#main')) continue;
+                const mensajes = nodo.matches('[data-id^="false_"]') ? [nodo] : nodo.querySelectorAll('[data-id^="false_"]');
+                for (const m of mensajes) {
+                    const id = m.getAttribute('data-id');
+                    const texto = (m.querySelector('span.selectable-text') || m).innerText;
+                    if (historial || !contiene(texto)) { vistos.add(id); continue; }
+                    anotar(id, {fuente: 'chat', jid: id.split('_')[1], titulo, texto});
+                }
+            }
+        }
+        for (const fila of filas) {
+            if (!fila.querySelector('[aria-label*="unread" i], [aria-label*="no leído" i], [data-testid="icon-unread-count"]')) continue;
+            const spans = fila.querySelectorAll('span[title]');
+            if (spans.length < 2) continue;
+            const nombre = spans[0].getAttribute('title'), texto = spans[spans.length - 1].getAttribute('title');
+            if (contiene(texto)) anotar(`fila|${nombre}|${texto}`, {fuente: 'lista', jid: null, titulo: nombre, texto});
+        }
+    }).observe(document.body, {childList: true, subtree: true, characterData: true});
+    if (document.body) observar(); else document.addEventListener('DOMContentLoaded', observar);
+}"""
+# Respuestas guardadas como máximo entre dos lecturas
+MAX_RESPUESTAS_PENDIENTES = 500
+# ¿El chat abierto en #main es el de este número (sólo dígitos)? Lo dice el JID de sus
+# mensajes ("true_<numero>@c.us_<id>"), el de la foto de la cabecera (su URL lleva
+# "u=<numero>%40c.us") o, con alguien que no está en los contactos, la cabecera, que
+# entonces muestra el número.
+JS_CHAT_ES_NUMERO = """numero => {
+    const main = document.querySelector('#main');
+    if (!main) return false;
+    if (main.querySelector(`[data-id*="_${numero}@c.us_"]`)) return true;
+    const jid = new RegExp(`(^|\\D)${numero}(@|%40)c\\.us`);
+    if ([...main.querySelectorAll('header img[src]')].some(img => jid.test(img.getAttribute('src')))) return true;
+    const cabecera = main.querySelector('header span[dir="auto"]');
+    return !!cabecera && cabecera.innerText.replace(/\\D/g, '') === numero;
+}"""
+# Fila de la lista de chats (ya filtrada por el buscador) que es la del número: por el
+# JID de sus atributos (data-id o la URL de la foto) o, si el contacto no está guardado,
+# por el título, que entonces es el número. Un contacto guardado se titula con su
+# nombre, así que el título nunca basta para descartarlo ni para elegirlo.
+JS_FILA_DEL_NUMERO = """numero => {
+    const jid = new RegExp(`(^|\\D)${numero}(@|%40)c\\.us`);
+    return [...document.querySelectorAll('#pane-side [data-testid="cell-frame-container"], #pane-side [role="listitem"]')]
+        .find(fila => [fila, ...fila.querySelectorAll('[data-id], img[src]')]
+                .some(el => jid.test(el.getAttribute('data-id') || el.getAttribute('src') || ''))
+            || [...fila.querySelectorAll('span[title]')]
+                .some(s => s.getAttribute('title').replace(/\\D/g, '') === numero)) || null;
+}"""
+# Pulsa dentro de la aplicación un enlace wa.me al número. WhatsApp Web abre esos
+# enlaces (los mismos que llegan en un mensaje) en la propia página, sin recargarla,
+# tenga o no chat con ese número. target=_blank: si no lo intercepta, el navegador lo
+# abre en otra pestaña en lugar de sacar a esta de WhatsApp Web.
+JS_PULSAR_ENLACE_WA_ME = """numero => {
+    const enlace = document.createElement('a');
+    enlace.href = `https://wa.me/${numero}`;
+    enlace.target = '_blank';
+    enlace.rel = 'noopener noreferrer';
+    enlace.style.display = 'none';
+    (document.querySelector('#app') || document.body).appendChild(enlace);
+    enlace.click();
+    enlace.remove();
+}"""
+# Fila de la lista de chats cuyo título es exactamente este
+JS_FILA_CON_TITULO = """titulo => [...document.querySelectorAll('#pane-side [data-testid="cell-frame-container"]')]
+    .find(fila => { const s = fila.querySelector('span[title]'); return s && s.getAttribute('title') === titulo; }) || null"""
+# JID del último mensaje recibido en #main, sólo si la cabecera del chat abierto es este título
+JS_REMITENTE_CHAT_ABIERTO = """titulo => {
+    const cabecera = document.querySelector('#main header span[dir="auto"]');
+    if (!cabecera || cabecera.innerText.trim() !== titulo) return null;
+    const recibidos = document.querySelectorAll('#main [data-id^="false_"]');
+    return recibidos.length ? recibidos[recibidos.length - 1].getAttribute('data-id').split('_')[1] : null;
+}"""
+# Milisegundos que se espera a que el reloj del mensaje pase a un tick
+ESPERA_CONFIRMACION_MS = int(os.environ.get("WHATSAPP_ESPERA_CONFIRMACION_MS", 15000))
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas de un difundido: como máximo `por_minuto` envíos por minuto,
+    con ráfagas de hasta `rafaga` seguidos. Cada envío espera además un retraso
+    aleatorio de 0 a `jitter` segundos, para no mandar a un ritmo perfectamente
+    regular. Lanza ValueError si `por_minuto` no es positivo.
+    """
+
+    def __init__(self, por_minuto=12, rafaga=1, jitter=3.0):
+        if not por_minuto or por_minuto <= 0:
+            raise ValueError(f"El ritmo de envío debe ser mayor que 0 mensajes por minuto (es {por_minuto}).")
+        self.tasa = por_minuto / 60.0
+        self.rafaga = max(1, rafaga)
+        self.jitter = jitter
+        self.fichas = float(self.rafaga)
+        self._ultimo = time.monotonic()
+
+    def _reponer(self):
+        ahora = time.monotonic()
+        self.fichas = min(self.rafaga, self.fichas + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    async def adquirir(self):
+        # difundir() envía de uno en uno, así que no hay esperas concurrentes que ordenar
+        self._reponer()
+        while self.fichas < 1:
+            await asyncio.sleep((1 - self.fichas) / self.tasa)
+            self._reponer()
+        self.fichas -= 1
+        if self.jitter:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+
+
+class CapturasFallo:
+    """
+    Capturas de pantalla de los envíos fallidos, como buffer circular en disco: se
+    conservan sólo las `maximo` más recientes. Los envíos correctos no hacen capturas.
+    """
+
+    def __init__(self, directorio=None, maximo=None):
+        self.directorio = os.path.abspath(directorio or os.environ.get("WHATSAPP_CAPTURAS_DIR", "capturas_fallos"))
+        self.maximo = maximo or int(os.environ.get("WHATSAPP_CAPTURAS_MAX", 20))
+
+    async def guardar(self, pagina, telefono):
+        """Guarda la captura de la página y devuelve su ruta (None si no se pudo)."""
+        if pagina is None or pagina.is_closed():
+            return None
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            marca = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            numero = ''.join(filter(str.isdigit, telefono or '')) or 'desconocido'
+            ruta = os.path.join(self.directorio, f"fallo_{marca}_{numero}.png")
+            await pagina.screenshot(path=ruta)
+            # Los nombres empiezan por la fecha: ordenarlos es ordenarlos por antigüedad
+            capturas = sorted(f for f in os.listdir(self.directorio) if f.startswith("fallo_") and f.endswith(".png"))
+            for viejo in capturas[:-self.maximo]:
+                os.remove(os.path.join(self.directorio, viejo))
+            print(f"📸 Captura del fallo guardada en {ruta}")
+            return ruta
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar la captura del fallo: {e}")
+            return None
+
+
+class SesionNoDisponible(Exception):
+    """
+    No se pudo abrir o preparar la sesión de WhatsApp Web (navegador caído, QR sin
+    escanear...). Es un fallo de la sesión, no del mensaje: difundir() la deja
+    escapar para que el trabajador devuelva los mensajes a la cola.
+    """
+
+
+class SesionWhatsApp:
+    """
+    Un único contexto persistente de Chromium con la página de WhatsApp Web ya
+    cargada, reutilizado entre envíos: un difundido a 200 publicadores carga la
+    página una vez en lugar de 200. Antes de entregar la página se comprueba que
+    siga viva; si el navegador se cerró o la pestaña se colgó, se relanza.
+
+    Los objetos de Playwright pertenecen al event loop que los creó, así que la
+    sesión vive mientras viva ese loop (hay que llamar a cerrar() antes de cerrarlo).
+    """
+
+    def __init__(self, perfil_dir, headless=None):
+        self.perfil_dir = perfil_dir
+        self.headless = os.environ.get("RENDER") == "true" if headless is None else headless
+        self._playwright = None
+        self.contexto = None
+        self.pagina = None
+        self._loop = None
+        self._lock = None
+        self._caida = False
+        self.preparada = False
+        # Respuestas que entrega el observador de la página; viven en el proceso, así
+        # que sobreviven a recargas y relanzamientos hasta que leer_respuestas las lee
+        self.respuestas = collections.deque(maxlen=MAX_RESPUESTAS_PENDIENTES)
+        self.lanzamientos = 0
+        self.lanzada_en = None
+        # Último estado de la cuenta visto en la página: desconocido, esperando_qr o conectado
+        self.estado = 'desconocido'
+        self.estado_actualizado = None
+
+    def _argumentos(self):
+        chromium_args = ["--no-sandbox", "--disable-setuid-sandbox"]
+        if not self.headless:
+            chromium_args.append("--start-maximized")
+        return chromium_args
+
+    async def _lanzar(self):
+        await self._liberar()
+        self._loop = asyncio.get_running_loop()
+        self._playwright = await async_playwright().start()
+        self.contexto = await self._playwright.chromium.launch_persistent_context(
+            user_data_dir=self.perfil_dir,
+            headless=self.headless,
+            args=self._argumentos()
+        )
+        await self.contexto.expose_binding("__respuestaEntrante", lambda _origen, evento: self.respuestas.append(evento))
+        await self.contexto.add_init_script(script=f"({JS_OBSERVAR_RESPUESTAS})({json.dumps(PALABRA_CONFIRMACION)})")
+        # El perfil persistente ya abre una pestaña: se reutiliza en lugar de crear otra
+        self.pagina = self.contexto.pages[0] if self.contexto.pages else await self.contexto.new_page()
+        self._caida = False
+        self.pagina.on("crash", lambda _: self._marcar_caida("la pestaña se colgó"))
+        # Cualquier carga de un documento nuevo (send?phone=, una recarga de WhatsApp)
+        # deja la página sin preparar: QR, ventanas emergentes...
+        self.pagina.on("domcontentloaded", lambda _: setattr(self, 'preparada', False))
+        self.contexto.on("close", lambda _: self._marcar_caida("el navegador se cerró"))
+        print("🌐 Abriendo WhatsApp Web...")
+        await self.pagina.goto(URL_WHATSAPP)
+        self.preparada = False
+        self.lanzamientos += 1
+        self.lanzada_en = datetime.datetime.now()
+
+    def marcar_estado(self, estado):
+        self.estado = estado
+        self.estado_actualizado = datetime.datetime.now()
+
+    def _marcar_caida(self, motivo):
+        if not self._caida:
+            print(f"⚠️ Sesión de WhatsApp caída: {motivo}.")
+        self._caida = True
+
+    async def saludable(self):
+        """Chequeo de salud: mismo event loop, pestaña abierta, que responda y siga en WhatsApp Web."""
+        if self.pagina is None or self._caida or self.pagina.is_closed():
+            return False
+        if self._loop is not asyncio.get_running_loop():
+            return False
+        try:
+            await asyncio.wait_for(self.pagina.evaluate("1"), timeout=5)
+        except Exception:
+            return False
+        return self.pagina.url.startswith(URL_WHATSAPP)
+
+    async def obtener_pagina(self):
+        """Página de WhatsApp Web lista para usar, relanzando el navegador si hace falta."""
+        if self._lock is None or self._loop is not asyncio.get_running_loop():
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not await self.saludable():
+                if self.lanzamientos:
+                    print("🔄 Relanzando la sesión de WhatsApp...")
+                await self._lanzar()
+            return self.pagina
+
+    async def _liberar(self):
+        """Suelta el navegador actual; si pertenece a otro loop ya no se puede cerrar desde aquí."""
+        if self._loop is asyncio.get_running_loop():
+            try:
+                if self.contexto is not None:
+                    await self.contexto.close()
+                if self._playwright is not None:
+                    await self._playwright.stop()
+            except Exception as e:
+                print(f"⚠️ Error liberando el navegador: {e}")
+        self._playwright = self.contexto = self.pagina = self._loop = None
+        self.preparada = False
+
+    async def cerrar(self):
+        if self.contexto is not None:
+            print("🔒 Cerrando la sesión del navegador de WhatsApp.")
+        await self._liberar()
+
 
 class WhatsAppServicio:
+    def __init__(self, perfil_dir=PERFIL_DIR):
+        self.perfil_dir = os.path.abspath(perfil_dir)
+        self.sesion = SesionWhatsApp(self.perfil_dir)
+        self.capturas = CapturasFallo()
+
     async def conectar_whatsapp(self):
         """
         Inicia sesión en WhatsApp Web y devuelve el QR como imagen base64 si es necesario.
-        Si la sesión ya está activa, devuelve None.
+        Si la sesión ya está activa, devuelve None. La página queda abierta para que
+        el escaneo del QR complete el inicio de sesión.
         """
         import base64
-        import io
-        from PIL import Image
-        headless = os.environ.get("RENDER") == "true"
-        async with async_playwright() as p:
-            chromium_args = ["--no-sandbox", "--disable-setuid-sandbox"]
-            if not headless:
-                chromium_args.append("--start-maximized")
-            navegador = await p.chromium.launch_persistent_context(
-                user_data_dir=self.perfil_dir,
-                headless=headless,
-                args=chromium_args
-            )
-            pagina = await navegador.new_page()
-            print("🌐 Abriendo WhatsApp Web para conexión...")
-            await pagina.goto("https://web.whatsapp.com")
-            try:
-                # Espera el QR
-                await pagina.wait_for_selector("canvas[aria-label='Código QR']", timeout=15000)
-                print("🛑 QR encontrado, capturando imagen...")
-                qr_element = await pagina.query_selector("canvas[aria-label='Código QR']")
-                qr_bytes = await qr_element.screenshot(type="png")
-                # Convertir a base64
-                qr_base64 = base64.b64encode(qr_bytes).decode("utf-8")
-                await navegador.close()
-                return qr_base64
-            except Exception as e:
-                print("✅ Sesión ya activa o QR no requerido.", e)
-                await navegador.close()
-                return None
-    def __init__(self, perfil_dir="whatsapp_profile"):
-        self.perfil_dir = os.path.abspath(perfil_dir)
+        pagina = await self.sesion.obtener_pagina()
+        print("🌐 Verificando conexión con WhatsApp Web...")
+        await pagina.wait_for_selector(f"{SELECTOR_QR}, {SELECTOR_LISTA_CHATS}", timeout=60000)
+        qr_element = await pagina.query_selector(SELECTOR_QR)
+        if qr_element is None:
+            print("✅ Sesión ya activa, QR no requerido.")
+            self.sesion.marcar_estado('conectado')
+            return None
+        print("🛑 QR encontrado, capturando imagen...")
+        self.sesion.marcar_estado('esperando_qr')
+        qr_bytes = await qr_element.screenshot(type="png")
+        # Convertir a base64
+        return base64.b64encode(qr_bytes).decode("utf-8")
+
+    async def esta_logueado(self):
+        """
+        Mira en la página ya abierta si hay sesión (milisegundos). Sin navegador
+        abierto no lanza uno: responde con el último estado conocido.
+        """
+        if self.sesion.pagina is not None and await self.sesion.saludable():
+            if await self.sesion.pagina.query_selector(SELECTOR_LISTA_CHATS):
+                self.sesion.marcar_estado('conectado')
+            elif await self.sesion.pagina.query_selector(SELECTOR_QR):
+                self.sesion.marcar_estado('esperando_qr')
+        return self.sesion.estado == 'conectado'
+
+    def estado(self):
+        """Estado en caché de la sesión, sin tocar el navegador."""
+        return {
+            "logueado": self.sesion.estado == 'conectado',
+            "estado": self.sesion.estado,
+            "actualizado_en": self.sesion.estado_actualizado.isoformat() if self.sesion.estado_actualizado else None,
+            "navegador_abierto": self.sesion.pagina is not None,
+            "lanzamientos": self.sesion.lanzamientos
+        }
+
+    async def _preparar_sesion(self, pagina):
+        """Espera el inicio de sesión y cierra las ventanas emergentes; una vez por lanzamiento."""
+        if self.sesion.preparada:
+            return
+        print("🕒 Verificando sesión...")
+        # Lo primero que aparezca: el QR (sin sesión) o la lista de chats (sesión activa)
+        await pagina.wait_for_selector(f"{SELECTOR_QR}, {SELECTOR_LISTA_CHATS}", timeout=60000)
+        if await pagina.query_selector(SELECTOR_QR):
+            print("🛑 Escanea el código QR para iniciar sesión.")
+            self.sesion.marcar_estado('esperando_qr')
+            await pagina.wait_for_selector(SELECTOR_LISTA_CHATS, timeout=120000)
+            print("✅ Sesión iniciada correctamente.")
+        else:
+            print("✅ Sesión ya activa.")
+        self.sesion.marcar_estado('conectado')
+        print("🔍 Verificando ventanas emergentes...")
+        try:
+            close_buttons = await pagina.query_selector_all(SELECTOR_EMERGENTES)
+            for button in close_buttons:
+                try:
+                    await button.click(timeout=2000)
+                    # La ventana se da por cerrada cuando su botón desaparece
+                    await button.wait_for_element_state("hidden", timeout=2000)
+                    print("✅ Ventana emergente cerrada.")
+                except:
+                    pass
+            await pagina.keyboard.press('Escape')
+        except Exception as e:
+            print(f"⚠️ Error cerrando ventanas emergentes: {e}")
+        print("✅ Ventanas emergentes procesadas.")
+        self.sesion.preparada = True
 
     async def abrir_sesion(self):
-        headless = os.environ.get("RENDER") == "true"
-        async with async_playwright() as p:
-            chromium_args = ["--no-sandbox", "--disable-setuid-sandbox"]
-            if not headless:
-                chromium_args.append("--start-maximized")
-            navegador = await p.chromium.launch_persistent_context(
-                user_data_dir=self.perfil_dir,
-                headless=headless,
-                args=chromium_args
-            )
-            pagina = await navegador.new_page()
-            print("🌐 Abriendo WhatsApp Web...")
-            await pagina.goto("https://web.whatsapp.com")
-            print("🕒 Verificando sesión...")
-            try:
-                await pagina.wait_for_selector("canvas[aria-label='Código QR']", timeout=15000)
-                print("🛑 Escanea el código QR para iniciar sesión.")
-                await pagina.wait_for_selector("canvas[aria-label='Código QR']", state="detached", timeout=120000)
-                print("✅ Sesión iniciada correctamente.")
-            except:
-                print("✅ Sesión ya activa o verificando...")
-                await pagina.wait_for_timeout(5000)
-            print("🔍 Verificando ventanas emergentes...")
-            await pagina.wait_for_timeout(3000)
+        pagina = await self.sesion.obtener_pagina()
+        await self._preparar_sesion(pagina)
+
+    async def cerrar(self):
+        await self.sesion.cerrar()
+
+    async def enviar_mensaje(self, telefono: str, mensaje: str) -> bool:
+        """Envía un mensaje usando la sesión compartida; True si quedó confirmado en la conversación."""
+        return (await self.enviar_con_confirmacion(telefono, mensaje))["enviado"]
+
+    async def enviar_con_confirmacion(self, telefono, mensaje):
+        """
+        Como enviar_mensaje, pero devuelve el resultado completo de _enviar_en_pagina
+        (estado de entrega y tiempos). Si el navegador se cae a mitad del envío, se
+        relanza y se reintenta una vez; si la sesión sigue sin poder usarse, lanza
+        SesionNoDisponible en lugar de dar el mensaje por fallido.
+        """
+        for intento in (1, 2):
             try:
-                continuar_button = await pagina.query_selector('button:has-text("Continuar")')
-                if continuar_button:
-                    await continuar_button.click()
-                    print("✅ Ventana emergente 'Continuar' cerrada.")
-                    await pagina.wait_for_timeout(2000)
-                close_buttons = await pagina.query_selector_all('button:has-text("OK"), button:has-text("Entendido"), button:has-text("Cerrar"), button[aria-label="Cerrar"], button[aria-label="Close"]')
-                for button in close_buttons:
-                    try:
-                        await button.click(timeout=2000)
-                        print("✅ Ventana emergente adicional cerrada.")
-                        await pagina.wait_for_timeout(1000)
-                    except:
-                        pass
-                await pagina.keyboard.press('Escape')
-                await pagina.wait_for_timeout(1000)
+                pagina = await self.sesion.obtener_pagina()
+                await self._preparar_sesion(pagina)
             except Exception as e:
-                print(f"⚠️ Error cerrando ventanas emergentes: {e}")
-            print("✅ Ventanas emergentes procesadas.")
-            await navegador.close()
+                print(f"❌ Error al preparar la sesión para {telefono}: {e}")
+                if intento == 2 or await self.sesion.saludable():
+                    raise SesionNoDisponible(str(e)) from e
+            else:
+                resultado = await self._enviar_en_pagina(pagina, telefono, mensaje)
+                if resultado["enviado"] or await self.sesion.saludable():
+                    return resultado
+                if intento == 2:
+                    raise SesionNoDisponible(resultado["error"] or "La sesión de WhatsApp dejó de responder")
+            print("🔄 La sesión no responde; se reintenta con un navegador nuevo.")
 
-    async def enviar_mensaje(self, telefono: str, mensaje: str) -> bool:
+    async def difundir(self, envios, limitador=None, al_procesar=None):
+        """
+        Envía una lista de (telefono, mensaje) uno tras otro por la pestaña de la
+        sesión, al ritmo que marque `limitador`. Es una sola pestaña a propósito:
+        WhatsApp Web deja activa una por sesión, y abrir otra manda la primera a la
+        pantalla de "Usar aquí".
+
+        `al_procesar(indice, resultado)` se llama tras cada destinatario. Si la sesión
+        deja de poder usarse se interrumpe con SesionNoDisponible. Devuelve un
+        resultado por destinatario (el de enviar_con_confirmacion más el teléfono) en
+        el orden de `envios`.
+        """
+        resultados = []
+        print(f"📣 Difundiendo {len(envios)} mensajes...")
+        for i, (telefono, mensaje) in enumerate(envios):
+            if limitador:
+                await limitador.adquirir()
+            resultados.append(dict(await self.enviar_con_confirmacion(telefono, mensaje), telefono=telefono))
+            if al_procesar:
+                al_procesar(i, resultados[-1])
+        return resultados
+
+    async def leer_respuestas(self):
+        """
+        Teléfonos E.164 que han respondido con PALABRA_CONFIRMACION desde la última
+        llamada. Usa la sesión persistente (la abre si hace falta); sin sesión
+        iniciada la cierra y devuelve [].
+        El observador de la página (JS_OBSERVAR_RESPUESTAS) deja las respuestas en
+        sesion.respuestas entre llamadas, así que no se recorren los chats: sólo se
+        abre el de un remitente guardado con nombre (la lista no muestra su número).
+        """
+        pagina = await self.sesion.obtener_pagina()
+        await pagina.wait_for_selector(f"{SELECTOR_QR}, {SELECTOR_LISTA_CHATS}", timeout=60000)
+        if not await self.esta_logueado():
+            print("🛑 Sin sesión de WhatsApp: no se pueden leer respuestas.")
+            await self.cerrar()
+            return []
+        eventos = list(self.sesion.respuestas)
+        self.sesion.respuestas.clear()
+
+        telefonos = set()
+        for evento in eventos:
+            jid = evento["jid"]
+            if jid is None:
+                # Fila de la lista: el título es el número si el contacto no está guardado
+                e164 = normalizar_telefono(evento["titulo"]) if (evento["titulo"] or '').startswith('+') else None
+                if e164:
+                    telefonos.add(e164)
+                    continue
+                jid = await self._remitente_por_titulo(pagina, evento["titulo"])
+            if jid and jid.endswith("@c.us"):
+                telefonos.add("+" + jid.split("@")[0])
+        return sorted(telefonos)
+
+    async def _remitente_por_titulo(self, pagina, titulo):
+        """
+        JID del último mensaje recibido en el chat con ese título (None si no se
+        encuentra). Sólo se hace clic en la fila cuyo título coincide exactamente, y
+        el JID se lee cuando la cabecera de #main ya muestra ese título.
+        """
         try:
-            headless = os.environ.get("RENDER") == "true"
-            async with async_playwright() as p:
-                navegador = await p.chromium.launch_persistent_context(
-                    user_data_dir=self.perfil_dir,
-                    headless=headless,
-                    args=["--start-maximized"] if not headless else []
-                )
-                pagina = await navegador.new_page()
-                print("🌐 Abriendo WhatsApp Web...")
-                await pagina.goto("https://web.whatsapp.com")
-                try:
-                    await pagina.wait_for_selector("canvas[aria-label='Código QR']", timeout=15000)
-                    print("🛑 Escanea el código QR para iniciar sesión.")
-                    await pagina.wait_for_selector("canvas[aria-label='Código QR']", state="detached", timeout=120000)
-                    print("✅ Sesión iniciada correctamente.")
-                except:
-                    print("✅ Sesión ya activa o verificando...")
-                    await pagina.wait_for_timeout(5000)
-                print("🔍 Verificando ventanas emergentes...")
-                await pagina.wait_for_timeout(3000)
-                try:
-                    continuar_button = await pagina.query_selector('button:has-text("Continuar")')
-                    if continuar_button:
-                        await continuar_button.click()
-                        print("✅ Ventana emergente 'Continuar' cerrada.")
-                        await pagina.wait_for_timeout(2000)
-                    close_buttons = await pagina.query_selector_all('button:has-text("OK"), button:has-text("Entendido"), button:has-text("Cerrar"), button[aria-label="Cerrar"], button[aria-label="Close"]')
-                    for button in close_buttons:
-                        try:
-                            await button.click(timeout=2000)
-                            print("✅ Ventana emergente adicional cerrada.")
-                            await pagina.wait_for_timeout(1000)
-                        except:
-                            pass
-                    await pagina.keyboard.press('Escape')
-                    await pagina.wait_for_timeout(1000)
-                except Exception as e:
-                    print(f"⚠️ Error cerrando ventanas emergentes: {e}")
-                print("✅ Ventanas emergentes procesadas.")
-                numero = ''.join(filter(str.isdigit, telefono))
-                print(f"  Buscando número: {numero}")
-                try:
-                    search_input = await pagina.wait_for_selector('[data-testid="chat-list-search"]', timeout=10000)
-                    await search_input.click()
-                    print("✅ Buscador de chats encontrado.")
-                    await search_input.type(numero, delay=100)
-                    await pagina.wait_for_timeout(3000)
-                    try:
-                        first_result = await pagina.wait_for_selector('[data-testid="cell-frame-container"]', timeout=5000)
-                        await first_result.click()
-                        print("✅ Chat encontrado y abierto desde búsqueda.")
-                    except:
-                        print("⚠️ No se encontró en búsqueda, probando crear nuevo chat...")
-                        await pagina.goto(f"https://web.whatsapp.com/send?phone={numero}")
-                        await pagina.wait_for_timeout(5000)
-                except Exception as e:
-                    print(f"❌ Error en búsqueda: {e}")
-                    print("🔄 Usando método de URL directa...")
-                    await pagina.goto(f"https://web.whatsapp.com/send?phone={numero}")
-                    await pagina.wait_for_timeout(5000)
-                print("🔍 Buscando caja de texto para escribir mensaje...")
-                input_box = None
-                selectors = [
-                    'div[contenteditable="true"][data-testid="conversation-compose-box-input"]',
-                    'div[contenteditable="true"][data-tab="10"]',
-                    'div[contenteditable="true"][data-tab][role="textbox"]',
-                    'footer div[contenteditable="true"]'
-                ]
-                for selector in selectors:
-                    try:
-                        await pagina.wait_for_selector(selector, timeout=7000)
-                        input_box = await pagina.query_selector(selector)
-                        if input_box:
-                            print(f"✅ Caja de texto encontrada con selector: {selector}")
-                            break
-                    except Exception as e:
-                        print(f"⚠️ No se encontró caja con selector: {selector}")
-                if not input_box:
-                    print("❌ No se pudo obtener la caja de texto del mensaje")
-                    await navegador.close()
-                    return False
-                print("✍️ Escribiendo mensaje en la caja de texto del mensaje...")
-                await input_box.click(force=True)
-                await pagina.wait_for_timeout(500)
-                try:
-                    await input_box.fill("")
-                except Exception:
-                    await pagina.keyboard.press('Control+A')
-                    await pagina.keyboard.press('Delete')
-                await pagina.wait_for_timeout(500)
-                print(f"📝 Escribiendo mensaje: {mensaje}")
-                await input_box.type(mensaje, delay=50)
-                await pagina.wait_for_timeout(1000)
-                print("📤 Enviando mensaje con Enter...")
-                await pagina.keyboard.press('Enter')
-                await pagina.wait_for_timeout(2000)
-                try:
-                    send_button = await pagina.query_selector('button[data-testid="send"], span[data-testid="send"]')
-                    if send_button:
-                        await send_button.click()
-                        print("✅ También se hizo clic en el botón de enviar.")
-                except Exception:
-                    print("ℹ️ No se encontró botón de enviar (normal si Enter funcionó).")
-                try:
-                    await pagina.wait_for_selector('[data-testid="msg-container"]', timeout=5000)
-                    print("✅ Mensaje confirmado en la conversación.")
-                except Exception:
-                    print("⚠️ No se pudo confirmar el mensaje en la conversación.")
-                await pagina.screenshot(path="debug_screenshot.png")
-                print("📸 Captura de pantalla guardada como debug_screenshot.png")
-                print(f"✅ Mensaje enviado a {telefono}")
-                await navegador.close()
-                return True
+            search_input = await pagina.wait_for_selector('[data-testid="chat-list-search"]', timeout=10000)
+            await search_input.fill(titulo)
+            fila = await pagina.wait_for_function(JS_FILA_CON_TITULO, arg=titulo, timeout=5000)
+            await fila.as_element().click()
+            await pagina.wait_for_function(JS_REMITENTE_CHAT_ABIERTO, arg=titulo, timeout=10000)
+            jid = await pagina.evaluate(JS_REMITENTE_CHAT_ABIERTO, titulo)
+            await search_input.fill("")
+            return jid
+        except Exception as e:
+            print(f"⚠️ No se pudo identificar al remitente '{titulo}': {e}")
+            return None
+
+    async def _abrir_chat(self, pagina, numero):
+        """
+        Abre el chat del número sin recargar WhatsApp Web y devuelve True sólo si el
+        chat abierto es el suyo (JS_CHAT_ES_NUMERO). En orden: el que ya está abierto,
+        la fila del buscador que es la del número (JS_FILA_DEL_NUMERO) y un enlace
+        wa.me pulsado dentro de la página, que sirve también para números sin chat.
+        Sólo si nada de eso funciona navega a send?phone=, que recarga la página.
+        """
+        if await pagina.evaluate(JS_CHAT_ES_NUMERO, numero):
+            print("✅ El chat del número ya está abierto.")
+            return True
+        if await self._abrir_desde_buscador(pagina, numero) or await self._abrir_con_enlace(pagina, numero):
+            return True
+        print("🔄 No se pudo abrir el chat dentro de la página; usando la URL directa (recarga WhatsApp Web)...")
+        await pagina.goto(f"{URL_WHATSAPP}/send?phone={numero}", wait_until="domcontentloaded")
+        try:
+            await pagina.wait_for_selector(SELECTOR_CAJA_TEXTO, timeout=60000)
+            await pagina.wait_for_function(JS_CHAT_ES_NUMERO, arg=numero, timeout=5000)
+            return True
+        except Exception:
+            return False
+
+    async def _abrir_desde_buscador(self, pagina, numero):
+        """Busca el número y hace clic en su fila, nunca en otra (p. ej. de la lista sin filtrar)."""
+        try:
+            search_input = await pagina.wait_for_selector('[data-testid="chat-list-search"]', timeout=10000)
+            await search_input.click()
+            # fill() reemplaza de una vez la búsqueda anterior que sigue escrita en la página
+            await search_input.fill(numero)
+            fila = await pagina.wait_for_function(JS_FILA_DEL_NUMERO, arg=numero, timeout=3000)
+            await fila.as_element().click()
+            await pagina.wait_for_function(JS_CHAT_ES_NUMERO, arg=numero, timeout=5000)
+            print("✅ Chat encontrado y abierto desde búsqueda.")
+            return True
+        except Exception:
+            return False
+
+    async def _abrir_con_enlace(self, pagina, numero):
+        """Abre el chat con un enlace wa.me pulsado dentro de la página (JS_PULSAR_ENLACE_WA_ME)."""
+        try:
+            await pagina.evaluate(JS_PULSAR_ENLACE_WA_ME, numero)
+            await pagina.wait_for_function(JS_CHAT_ES_NUMERO, arg=numero, timeout=8000)
+            print("✅ Chat abierto con un enlace wa.me, sin recargar la página.")
+            return True
+        except Exception:
+            # Un número sin WhatsApp deja un aviso abierto
+            await pagina.keyboard.press('Escape')
+            return False
+        finally:
+            # Si WhatsApp no interceptó el enlace, el navegador lo abrió en otra pestaña
+            for otra in pagina.context.pages:
+                if otra is not pagina:
+                    await otra.close()
+
+    @staticmethod
+    def _resultado_vacio(error=None):
+        return {"enviado": False, "entrega": None, "error": error,
+                "duracion_ms": None, "confirmacion_ms": None, "captura": None}
+
+    async def _enviar_en_pagina(self, pagina, telefono, mensaje):
+        """
+        Envía un mensaje en la pestaña dada y lee su confirmación de los ticks del DOM.
+        Nunca lanza: devuelve {enviado, entrega, error, duracion_ms, confirmacion_ms,
+        captura}, donde `entrega` es pendiente / enviado / entregado / leido y
+        `confirmacion_ms` lo que tardó el mensaje en pasar del reloj al primer tick.
+        Sólo si el envío falla se guarda una captura de pantalla.
+        """
+        resultado = self._resultado_vacio()
+        inicio = time.monotonic()
+        try:
+            await self._entregar(pagina, telefono, mensaje, resultado)
         except Exception as e:
             print(f"❌ Error al enviar mensaje a {telefono}: {e}")
-            return False
\ No newline at end of file
+            resultado["error"] = str(e)
+        resultado["duracion_ms"] = int((time.monotonic() - inicio) * 1000)
+        if not resultado["enviado"]:
+            resultado["error"] = resultado["error"] or "No se pudo enviar el mensaje"
+            resultado["captura"] = await self.capturas.guardar(pagina, telefono)
+        return resultado
+
+    async def _entregar(self, pagina, telefono, mensaje, resultado):
+        e164 = normalizar_telefono(telefono)
+        if e164 is None:
+            resultado["error"] = f"Teléfono inválido: {telefono}"
+            print(f"❌ {resultado['error']}")
+            return
+        numero = e164.lstrip('+')
+        print(f"  Buscando número: {numero}")
+        if not await self._abrir_chat(pagina, numero):
+            resultado["error"] = f"No se pudo comprobar que el chat abierto sea el de {numero}"
+            print(f"❌ {resultado['error']}")
+            return
+
+        print("🔍 Buscando caja de texto para escribir mensaje...")
+        try:
+            # Un solo wait con todos los selectores: el primero que aparezca sirve
+            input_box = await pagina.wait_for_selector(SELECTOR_CAJA_TEXTO, timeout=20000)
+        except Exception:
+            input_box = None
+        if not input_box:
+            resultado["error"] = "No se pudo obtener la caja de texto del mensaje"
+            print(f"❌ {resultado['error']}")
+            return
+        mensajes_previos = len(await pagina.query_selector_all(SELECTOR_MENSAJE_SALIENTE))
+
+        print("✍️ Escribiendo mensaje en la caja de texto del mensaje...")
+        await input_box.click(force=True)
+        try:
+            await input_box.fill("")
+        except Exception:
+            await pagina.keyboard.press('Control+A')
+            await pagina.keyboard.press('Delete')
+        # Última comprobación antes de escribir: la caja tiene que ser la del chat del número
+        if not await pagina.evaluate(JS_CHAT_ES_NUMERO, numero):
+            resultado["error"] = f"El chat abierto ya no es el de {numero}"
+            print(f"❌ {resultado['error']}")
+            return
+        # Todo el texto en una sola operación (y los saltos de línea no disparan Enter)
+        await pagina.keyboard.insert_text(mensaje)
+        await pagina.wait_for_function("el => el.innerText.trim().length > 0", arg=input_box, timeout=5000)
+
+        print("📤 Enviando mensaje con Enter...")
+        enviado_en = time.monotonic()
+        await pagina.keyboard.press('Enter')
+        try:
+            # Enviado cuando la caja queda vacía; si no, se prueba con el botón
+            await pagina.wait_for_function("el => !el.innerText.trim()", arg=input_box, timeout=5000)
+        except Exception:
+            send_button = await pagina.query_selector(SELECTOR_BOTON_ENVIAR)
+            if send_button:
+                await send_button.click()
+                print("✅ Se hizo clic en el botón de enviar.")
+        try:
+            await pagina.wait_for_function(
+                "([selector, previos]) => document.querySelectorAll(selector).length > previos",
+                arg=[SELECTOR_MENSAJE_SALIENTE, mensajes_previos], timeout=10000)
+        except Exception:
+            resultado["error"] = "El mensaje no apareció en la conversación"
+            print(f"⚠️ {resultado['error']}")
+            return
+
+        # El mensaje ya está en la conversación; los ticks dicen si salió del teléfono
+        resultado["enviado"] = True
+        try:
+            await pagina.wait_for_function(
+                f"selector => !['pendiente', null].includes(({JS_ESTADO_ENTREGA})(selector))",
+                arg=SELECTOR_MENSAJE_SALIENTE, timeout=ESPERA_CONFIRMACION_MS)
+            resultado["confirmacion_ms"] = int((time.monotonic() - enviado_en) * 1000)
+        except Exception:
+            print("⚠️ El mensaje sigue pendiente (reloj) tras la espera de confirmación.")
+        resultado["entrega"] = await pagina.evaluate(JS_ESTADO_ENTREGA, SELECTOR_MENSAJE_SALIENTE) or 'pendiente'
+        print(f"✅ Mensaje a {telefono}: {resultado['entrega']}")